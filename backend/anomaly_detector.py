@@ -0,0 +1,191 @@
+from typing import Dict, Hashable, Iterable, List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+DEFAULT_ALPHA = 0.1
+DEFAULT_THRESHOLD = 4.0
+DEFAULT_WARMUP = 10
+DEFAULT_COOLDOWN = 5
+INITIAL_CAPACITY = 64
+
+# 标准差下限，按指标的量纲设置：观众数变化（人）、单 tick 销售额（元）、库存变化（件）
+VIEWER_MIN_STD = 20.0
+SALES_MIN_STD = 10.0
+STOCK_MIN_STD = 1.0
+
+
+class EwmaDetector:
+    """Streaming z-score detector for one metric, one slot per key.
+
+    Each slot keeps an exponentially weighted mean and variance of its
+    samples, so state and work per sample are constant. With ``changes``
+    a sample is the difference from the slot's previous value, which
+    turns drifting levels (viewers, stock) into a stationary series.
+
+    ``update`` scores a batch of samples against the state before they
+    are folded in, then updates every slot in the batch with one
+    vectorized pass. A slot is not scored until ``warmup`` of its
+    samples have met a non-zero variance, so a series that has been
+    exactly flat (a room with no sales yet) is not flagged on its first
+    move; after being flagged it stays quiet for ``cooldown`` samples, so
+    one step change gives one anomaly instead of one per tick while the
+    variance catches up. The standard deviation has a floor of
+    ``min_std`` so a metric that has been flat for a while does not turn
+    every small move into a large z-score.
+    """
+
+    def __init__(
+        self,
+        alpha: float = DEFAULT_ALPHA,
+        threshold: float = DEFAULT_THRESHOLD,
+        warmup: int = DEFAULT_WARMUP,
+        cooldown: int = DEFAULT_COOLDOWN,
+        min_std: float = 1.0,
+        changes: bool = False,
+    ):
+        if not 0 < alpha < 1:
+            raise ValueError(f"alpha must be between 0 and 1, got {alpha}")
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.min_std = min_std
+        self.changes = changes
+        self._capacity = 0
+        self.mean = np.zeros(0)
+        self.var = np.zeros(0)
+        self.last = np.zeros(0)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.warm = np.zeros(0, dtype=np.int64)
+        self.quiet = np.zeros(0, dtype=np.int64)
+        self.reserve(INITIAL_CAPACITY)
+
+    def reserve(self, size: int):
+        if size <= self._capacity:
+            return
+        capacity = max(size, self._capacity * 2)
+        for name in ("mean", "var", "last", "count", "warm", "quiet"):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        self._capacity = capacity
+
+    def update(self, slots: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Fold one value per slot into the statistics (slots must be unique).
+
+        Returns the positions in ``slots`` flagged as anomalous and their z-scores.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        count = self.count[slots]
+        if self.changes:
+            samples = values - self.last[slots]
+            self.last[slots] = values
+            # 第一个值只作为基准，不构成样本
+            folded = count - 1
+        else:
+            samples = values
+            folded = count
+        mean = self.mean[slots]
+        var = self.var[slots]
+        warm = self.warm[slots]
+        quiet = self.quiet[slots]
+
+        diff = samples - mean
+        z = diff / np.maximum(np.sqrt(var), self.min_std)
+        flagged = np.flatnonzero((warm >= self.warmup) & (quiet == 0) & (np.abs(z) >= self.threshold))
+        # 预热只计方差非零时的样本：一直为 0 的序列（还没开卖的直播间）方差为 0，
+        # 第一笔销售会被下限标准差放大成很大的 z 值
+        self.warm[slots] = warm + (var > 0)
+
+        # 样本少时按累计平均（权重 1/n）更新，否则初期方差被低估，预热结束时容易误报；
+        # 只有基准值（folded < 0）的槽位权重为 0
+        weight = np.where(folded >= 0, np.maximum(self.alpha, 1.0 / np.maximum(folded + 1, 1)), 0.0)
+        increment = weight * diff
+        self.mean[slots] = mean + increment
+        self.var[slots] = (1 - weight) * (var + diff * increment)
+        quiet = np.maximum(quiet - 1, 0)
+        quiet[flagged] = self.cooldown
+        self.quiet[slots] = quiet
+        self.count[slots] = count + 1
+        return flagged, z[flagged]
+
+
+class Anomalies(NamedTuple):
+    """Flagged samples of one ``AnomalyDetector.check``, as positions into the arrays it was given."""
+
+    viewer_rooms: np.ndarray
+    viewer_scores: np.ndarray
+    sales_rooms: np.ndarray
+    sales_scores: np.ndarray
+    stock_products: np.ndarray
+    stock_scores: np.ndarray
+
+
+class AnomalyDetector:
+    """The metrics the simulation watches for anomalies.
+
+    Per room: the change in viewers and the sales amount of the tick; per
+    product: the change in stock (sales and event-driven cuts or
+    restocks). Rooms are keyed by room id and products by
+    ``(room_id, product_id)``; callers resolve keys to slots once with
+    ``room_slots`` / ``product_slots`` and pass slot arrays to ``check``
+    every tick, so a tick over all rooms is a few NumPy passes.
+    """
+
+    def __init__(
+        self,
+        alpha: float = DEFAULT_ALPHA,
+        threshold: float = DEFAULT_THRESHOLD,
+        warmup: int = DEFAULT_WARMUP,
+        cooldown: int = DEFAULT_COOLDOWN,
+    ):
+        # 分片进程用同样的参数各自创建检测器
+        self.settings = {"alpha": alpha, "threshold": threshold, "warmup": warmup, "cooldown": cooldown}
+        self.viewers = EwmaDetector(min_std=VIEWER_MIN_STD, changes=True, **self.settings)
+        self.sales = EwmaDetector(min_std=SALES_MIN_STD, **self.settings)
+        self.stock = EwmaDetector(min_std=STOCK_MIN_STD, changes=True, **self.settings)
+        self.room_index: Dict[Hashable, int] = {}
+        self.product_index: Dict[Tuple[Hashable, Hashable], int] = {}
+        # 直播间商品列表未变时复用槽位数组
+        self._product_slots: Dict[Hashable, Tuple[List, int, np.ndarray]] = {}
+
+    def room_slots(self, room_ids: Iterable[Hashable]) -> np.ndarray:
+        index = self.room_index
+        slots = np.fromiter((index.setdefault(room_id, len(index)) for room_id in room_ids), dtype=np.int64)
+        self.viewers.reserve(len(index))
+        self.sales.reserve(len(index))
+        return slots
+
+    def product_slots(self, room_id: Hashable, products: List) -> np.ndarray:
+        cached = self._product_slots.get(room_id)
+        if cached is not None and cached[0] is products and cached[1] == len(products):
+            return cached[2]
+        index = self.product_index
+        slots = np.fromiter(
+            (index.setdefault((room_id, product.id), len(index)) for product in products),
+            dtype=np.int64,
+            count=len(products),
+        )
+        self.stock.reserve(len(index))
+        self._product_slots[room_id] = (products, len(products), slots)
+        return slots
+
+    def products_slots(self, room_ids: Sequence[Hashable], rooms: Sequence) -> np.ndarray:
+        """Slots of every product of ``rooms``, concatenated in room order."""
+        slots = [self.product_slots(room_id, room.products) for room_id, room in zip(room_ids, rooms)]
+        return np.concatenate(slots) if slots else np.empty(0, dtype=np.int64)
+
+    def check(
+        self,
+        room_slots: np.ndarray,
+        viewers: np.ndarray,
+        sales: np.ndarray,
+        product_slots: np.ndarray,
+        stock: np.ndarray,
+    ) -> Anomalies:
+        """Score one tick: current viewers and tick sales amount per room, current stock per product."""
+        viewer_rooms, viewer_scores = self.viewers.update(room_slots, viewers)
+        sales_rooms, sales_scores = self.sales.update(room_slots, sales)
+        stock_products, stock_scores = self.stock.update(product_slots, stock)
+        return Anomalies(viewer_rooms, viewer_scores, sales_rooms, sales_scores, stock_products, stock_scores)
@@ -0,0 +1,99 @@
+import hashlib
+import math
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# 相对分桶步长：数值相差约 5% 以内视为同一数据状态
+RELATIVE_BUCKET_RATIO = 0.05
+# 转化率按绝对值 0.5 个百分点分桶
+CONVERSION_BUCKET_SIZE = 0.005
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?？!！。.,，~～ "
+
+
+def normalize_question(text: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation."""
+    return _WHITESPACE.sub(" ", text.strip().lower()).rstrip(_TRAILING_PUNCTUATION)
+
+
+def relative_bucket(value: float, ratio: float = RELATIVE_BUCKET_RATIO) -> int:
+    """Bucket index on a log scale, so nearby values of any magnitude share a bucket."""
+    if value <= 0:
+        return 0
+    return int(math.log1p(value) / math.log1p(ratio))
+
+
+def context_fingerprint(context: Dict[str, Any]) -> str:
+    """Quantized hash of the chat context summary used to build the prompt."""
+    parts = [
+        relative_bucket(float(context.get("total_sales", 0) or 0)),
+        relative_bucket(float(context.get("total_profit", 0) or 0)),
+        context.get("room_count", 0),
+    ]
+    for room in context.get("rooms") or []:
+        parts.append((
+            room.get("room_id") or room.get("host_name"),
+            relative_bucket(float(room.get("viewers", 0) or 0)),
+            int(float(room.get("conversion_rate", 0) or 0) / CONVERSION_BUCKET_SIZE),
+            relative_bucket(float(room.get("sales", 0) or 0)),
+            tuple(room.get("flags") or ()),
+        ))
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+
+
+class ChatResponseCache:
+    """LRU cache with a per-entry TTL for chat answers.
+
+    Keys are ``(normalized question, context fingerprint)``, so the same
+    question asked against a nearly identical dashboard within ``ttl``
+    seconds is answered without calling the model.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl > 0
+
+    @staticmethod
+    def make_key(question: str, context: Dict[str, Any]) -> Tuple[str, str]:
+        return normalize_question(question), context_fingerprint(context)
+
+    def get(self, key: Tuple[str, str]) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > self.clock():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+        if entry is not None:
+            del self._entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key: Tuple[str, str], response: str):
+        if not self.enabled:
+            return
+        self._entries[key] = (self.clock() + self.ttl, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+        }
@@ -0,0 +1,178 @@
+import heapq
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+# 近期出现过这些日志的直播间视为异常，优先放入提示词
+ALERT_ACTION_TYPES = ("异常流量", "库存预警")
+ALERT_WINDOW_SECONDS = 120
+
+# 相关度打分：问题中点名 > 异常 > 销售额排名
+SCORE_MENTIONED = 1_000_000
+SCORE_ALERT = 10_000
+SCORE_CRITICAL_STOCK = 5_000
+SCORE_UNHEALTHY = 5_000
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate: about one token per CJK character, four ASCII characters per token."""
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 1
+
+
+def format_room_line(entry: Dict[str, Any]) -> str:
+    line = (
+        f"- {entry['host_name']}（{entry['name']}）: {entry['viewers']}观众, "
+        f"{entry['conversion_rate']*100:.1f}%转化率, 销售额¥{entry['sales']:.0f}"
+    )
+    if entry.get("flags"):
+        line += f"，{'、'.join(entry['flags'])}"
+    return line
+
+
+def summary_from_request_context(context: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert a browser-supplied ``{"globalStats", "liveRooms"}`` context into the summary shape."""
+    stats = context.get("globalStats") or {}
+    rooms = []
+    for room in context.get("liveRooms") or []:
+        entry = {
+            "room_id": room.get("id"),
+            "name": room.get("name", ""),
+            "host_name": room.get("host_name", ""),
+            "viewers": room.get("viewers", 0),
+            "conversion_rate": room.get("conversion_rate", 0),
+            "sales": room.get("sales", 0),
+            "flags": [],
+        }
+        entry["line"] = format_room_line(entry)
+        rooms.append(entry)
+    return {
+        "total_sales": stats.get("total_sales", 0),
+        "total_profit": stats.get("total_profit", 0),
+        "room_count": len(rooms),
+        "rooms": rooms,
+        "omitted_rooms": 0,
+    }
+
+
+class ChatContextBuilder:
+    """Server-side source of the data context for chat prompts.
+
+    Room entries are kept up to date from the ``live_rooms_delta`` patches
+    produced each tick (``apply_delta``) and from the tick's agent logs
+    (``note_logs``), so maintaining them costs O(changed fields) per tick.
+    ``build`` then picks the rooms most relevant to a question, such as
+    rooms named in it, rooms with recent alerts and the top sellers, until
+    ``token_budget`` is used up.
+    """
+
+    def __init__(
+        self,
+        global_stats: Dict[str, Any],
+        token_budget: int = 1200,
+        max_rooms: int = 20,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.global_stats = global_stats
+        self.token_budget = token_budget
+        self.max_rooms = max_rooms
+        self.clock = clock
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._product_status: Dict[str, Dict[str, str]] = {}
+        self._critical_counts: Dict[str, int] = {}
+        self._alerts: Dict[str, float] = {}
+
+    def apply_delta(self, delta: Dict[str, Any]):
+        for room_id, patch in delta.get("rooms", {}).items():
+            entry = self._entries.get(room_id)
+            if entry is None:
+                entry = self._entries[room_id] = {
+                    "room_id": room_id,
+                    "name": "",
+                    "host_name": "",
+                    "viewers": 0,
+                    "conversion_rate": 0,
+                    "sales": 0,
+                    "health_status": "green",
+                }
+            for field in ("name", "host_name", "viewers", "conversion_rate", "sales", "health_status"):
+                if field in patch:
+                    entry[field] = patch[field]
+
+            statuses = self._product_status.setdefault(room_id, {})
+            for product_id, product_patch in (patch.get("products") or {}).items():
+                if "stock_status" in product_patch:
+                    self._set_product_status(room_id, statuses, product_id, product_patch["stock_status"])
+            if "product_ids" in patch:
+                for product_id in set(statuses) - set(patch["product_ids"]):
+                    self._set_product_status(room_id, statuses, product_id, None)
+
+        for room_id in delta.get("removed", []):
+            self._entries.pop(room_id, None)
+            self._product_status.pop(room_id, None)
+            self._critical_counts.pop(room_id, None)
+            self._alerts.pop(room_id, None)
+
+    def _set_product_status(self, room_id: str, statuses: Dict[str, str], product_id: str, status: Optional[str]):
+        previous = statuses.pop(product_id, None)
+        if status is not None:
+            statuses[product_id] = status
+        delta = (status == "告急") - (previous == "告急")
+        if delta:
+            self._critical_counts[room_id] = self._critical_counts.get(room_id, 0) + delta
+
+    def note_logs(self, logs: Iterable[Dict[str, Any]]):
+        now = self.clock()
+        for log in logs:
+            if log.get("action_type") in ALERT_ACTION_TYPES and log.get("room_id") in self._entries:
+                self._alerts[log["room_id"]] = now
+
+    def _flags(self, room_id: str, entry: Dict[str, Any], now: float) -> List[str]:
+        flags = []
+        alerted_at = self._alerts.get(room_id)
+        if alerted_at is not None and now - alerted_at <= ALERT_WINDOW_SECONDS:
+            flags.append("近期有异常告警")
+        critical = self._critical_counts.get(room_id, 0)
+        if critical:
+            flags.append(f"{critical}个商品库存告急")
+        if entry.get("health_status", "green") != "green":
+            flags.append(f"健康度{entry['health_status']}")
+        return flags
+
+    def _score(self, room_id: str, entry: Dict[str, Any], question: str, flags: List[str]) -> float:
+        score = float(entry.get("sales", 0))
+        if any(key and key in question for key in (room_id, entry.get("name"), entry.get("host_name"))):
+            score += SCORE_MENTIONED
+        if "近期有异常告警" in flags:
+            score += SCORE_ALERT
+        if self._critical_counts.get(room_id):
+            score += SCORE_CRITICAL_STOCK
+        if entry.get("health_status", "green") != "green":
+            score += SCORE_UNHEALTHY
+        return score
+
+    def build(self, question: str) -> Dict[str, Any]:
+        """Summary for one question: global totals plus the most relevant rooms within the token budget."""
+        now = self.clock()
+        candidates = []
+        for room_id, entry in self._entries.items():
+            flags = self._flags(room_id, entry, now)
+            candidates.append((self._score(room_id, entry, question, flags), room_id, flags))
+
+        rooms = []
+        budget = self.token_budget
+        for _, room_id, flags in heapq.nlargest(self.max_rooms, candidates):
+            room = dict(self._entries[room_id], flags=flags)
+            room["line"] = format_room_line(room)
+            cost = estimate_tokens(room["line"])
+            if cost > budget:
+                break
+            budget -= cost
+            rooms.append(room)
+
+        return {
+            "total_sales": self.global_stats.get("total_sales", 0),
+            "total_profit": self.global_stats.get("total_profit", 0),
+            "room_count": len(self._entries),
+            "rooms": rooms,
+            "omitted_rooms": len(self._entries) - len(rooms),
+        }
@@ -1,10 +1,18 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Dict, Any
+from typing import Any, AsyncIterator, Dict, List, Optional
 import httpx
+import json
 import os
+import time
 from dotenv import load_dotenv
 
+from metrics import registry as metrics
+
+from ..chat_cache import ChatResponseCache
+from ..chat_context import summary_from_request_context
+
 load_dotenv()
 
 router = APIRouter()
@@ -13,46 +21,149 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY environment variable is not set")
 
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent"
+# 上游地址可配置，便于指向本地 stub 服务进行测试
+GEMINI_API_URL = os.getenv(
+    "GEMINI_API_URL",
+    "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent",
+)
+
+# 流式接口（SSE），默认由 generateContent 地址推导
+GEMINI_STREAM_URL = os.getenv(
+    "GEMINI_STREAM_URL",
+    GEMINI_API_URL.replace(":generateContent", ":streamGenerateContent"),
+)
+
+# 连接池配置：整个应用生命周期复用同一个 AsyncClient，避免每次请求重新握手
+CHAT_HTTP_MAX_CONNECTIONS = int(os.getenv("CHAT_HTTP_MAX_CONNECTIONS", "20"))
+CHAT_HTTP_MAX_KEEPALIVE = int(os.getenv("CHAT_HTTP_MAX_KEEPALIVE", "10"))
+CHAT_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("CHAT_HTTP_KEEPALIVE_EXPIRY", "30"))
+CHAT_HTTP2 = os.getenv("CHAT_HTTP2", "false").lower() in ("1", "true", "yes")
+
+http_client: Optional[httpx.AsyncClient] = None
+
+# 相同问题 + 近似数据状态的回答缓存（CHAT_CACHE_TTL=0 关闭）
+response_cache = ChatResponseCache(
+    max_entries=int(os.getenv("CHAT_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("CHAT_CACHE_TTL", "30")),
+)
+
+# 上游调用耗时：outcome 为 HTTP 状态码或 error
+UPSTREAM_SECONDS = metrics.histogram(
+    "livepulse_chat_upstream_seconds", "Latency of Gemini upstream calls made by /api/chat", ("endpoint", "outcome")
+)
+UPSTREAM_FIRST_CHUNK_SECONDS = metrics.histogram(
+    "livepulse_chat_upstream_first_chunk_seconds", "Time until the first streamed chunk arrives from Gemini"
+)
+
+
+def create_http_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=CHAT_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=CHAT_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=CHAT_HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(30.0, connect=5.0)
+    if CHAT_HTTP2:
+        try:
+            return httpx.AsyncClient(http2=True, limits=limits, timeout=timeout)
+        except ImportError:
+            print("[CHAT_API] HTTP/2 requested but the 'h2' package is missing, falling back to HTTP/1.1 keep-alive")
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    # Lazily created if the router is used without the startup hook (e.g. mounted elsewhere)
+    global http_client
+    if http_client is None or http_client.is_closed:
+        http_client = create_http_client()
+    return http_client
+
+
+@router.on_event("startup")
+async def open_http_client():
+    get_http_client()
+
+
+@router.on_event("shutdown")
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
 
 class ChatRequest(BaseModel):
     message: str
-    context: Dict[str, Any]
+    # 可选：旧版前端上传的 {globalStats, liveRooms}；服务端有实时数据时忽略
+    context: Optional[Dict[str, Any]] = None
 
 class ChatResponse(BaseModel):
     response: str
 
-@router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    try:
-        # 构建系统提示，包含实时数据上下文
-        system_prompt = f"""你是一个专业的直播销售策略顾问。你将根据实时数据为用户提供销售策略建议。
+def resolve_context(request: ChatRequest, http_request: Request) -> Dict[str, Any]:
+    """Context summary for the prompt: the server's live state when available, else the uploaded context"""
+    builder = getattr(http_request.app.state, "chat_context", None)
+    if builder is not None:
+        return builder.build(request.message)
+    if request.context:
+        return summary_from_request_context(request.context)
+    raise ValueError("No live data context available")
+
+
+def build_contents(message: str, context: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Build the Gemini request contents: system prompt with live data context + the user's question"""
+    room_lines = [room["line"] for room in context["rooms"]]
+    if context["omitted_rooms"]:
+        room_lines.append(f"- 其余{context['omitted_rooms']}个直播间运行平稳，未列出")
+
+    # 构建系统提示，包含实时数据上下文
+    system_prompt = f"""你是一个专业的直播销售策略顾问。你将根据实时数据为用户提供销售策略建议。
 
 当前数据概况：
-- 总销售额: ¥{request.context['globalStats']['total_sales']}
-- 总利润: ¥{request.context['globalStats']['total_profit']}
-- 直播间数量: {len(request.context['liveRooms'])}
+- 总销售额: ¥{context['total_sales']}
+- 总利润: ¥{context['total_profit']}
+- 直播间数量: {context['room_count']}
 
 直播间详情：
-{chr(10).join([f"- {room['host_name']}: {room['viewers']}观众, {room['conversion_rate']*100:.1f}%转化率" for room in request.context['liveRooms']])}
+{chr(10).join(room_lines)}
 
 请基于以上数据，为用户提供专业、具体且可操作的建议。回答要简洁明了，重点突出。"""
 
-        # 准备发送给 Gemini API 的消息
-        # Gemini API expects a list of "parts" for content, and roles are typically "user" and "model"
-        # The system prompt can be the first part of the user's message, or handled differently depending on specific Gemini model best practices.
-        # For simplicity, we'll prepend system prompt to user message here.
-        contents = [
-            {
-                "role": "user",
-                "parts": [{"text": system_prompt + "\n\n" + request.message}]
-            }
-        ]
+    # 准备发送给 Gemini API 的消息
+    # Gemini API expects a list of "parts" for content, and roles are typically "user" and "model"
+    # The system prompt can be the first part of the user's message, or handled differently depending on specific Gemini model best practices.
+    # For simplicity, we'll prepend system prompt to user message here.
+    return [
+        {
+            "role": "user",
+            "parts": [{"text": system_prompt + "\n\n" + message}]
+        }
+    ]
+
+@router.get("/chat/cache-stats")
+async def chat_cache_stats():
+    return response_cache.stats()
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, http_request: Request):
+    try:
+        context = resolve_context(request, http_request)
+        cache_key = None
+        if response_cache.enabled:
+            cache_key = response_cache.make_key(request.message, context)
+            cached_response = response_cache.get(cache_key)
+            if cached_response is not None:
+                print("[CHAT_API] Cache hit, skipping Gemini API call")
+                return ChatResponse(response=cached_response)
+
+        contents = build_contents(request.message, context)
 
         # 调用 Gemini API
-        async with httpx.AsyncClient() as client:
+        client = get_http_client()
+        try:
+            print("[CHAT_API] Attempting to call Gemini API...")
+            upstream_start = time.perf_counter()
+            outcome = "error"
             try:
-                print("[CHAT_API] Attempting to call Gemini API...")
                 response = await client.post(
                     f"{GEMINI_API_URL}?key={GEMINI_API_KEY}", # API key is often sent as a query parameter
                     headers={
@@ -67,43 +178,145 @@ async def chat(request: ChatRequest):
                     },
                     timeout=30.0
                 )
-                
-                response.raise_for_status()  # 如果响应状态码不是2xx，抛出异常
-                
-                ai_response = response.json()
-                print(f"[CHAT_API] Received response from Gemini API: {ai_response}")
-                
-                # Extracting text from Gemini's response structure
-                # This might need adjustment based on the exact Gemini model and response
-                if "candidates" not in ai_response or not ai_response["candidates"] or \
-                   "content" not in ai_response["candidates"][0] or \
-                   "parts" not in ai_response["candidates"][0]["content"] or not ai_response["candidates"][0]["content"]["parts"] or \
-                   "text" not in ai_response["candidates"][0]["content"]["parts"][0]:
-                    raise ValueError("Invalid response format from Gemini API")
-                
-                return ChatResponse(response=ai_response['candidates'][0]['content']['parts'][0]['text'])
-                
-            except httpx.HTTPStatusError as e:
-                error_message = f"Gemini API error: {e.response.status_code}"
-                print(f"[CHAT_API] HTTPStatusError: {error_message} - Response: {e.response.text}")
-                try:
-                    error_data = e.response.json()
-                    if "error" in error_data and "message" in error_data["error"] :
-                        error_message = f"Gemini API error: {error_data['error']['message']}"
-                except:
-                    pass # Keep the original status code error if parsing fails
-                raise HTTPException(status_code=500, detail=error_message)
-                
-            except httpx.RequestError as e:
-                print(f"[CHAT_API] RequestError: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"Network error: {str(e)}")
-            except ValueError as e:
-                print(f"[CHAT_API] ValueError (likely invalid response format): {str(e)}")
-                raise HTTPException(status_code=500, detail=f"Error processing Gemini response: {str(e)}")
-            except Exception as e:
-                print(f"[CHAT_API] Unexpected error during Gemini API call: {str(e)}")
-                raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
+                outcome = str(response.status_code)
+            finally:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - upstream_start, endpoint="chat", outcome=outcome)
+            
+            response.raise_for_status()  # 如果响应状态码不是2xx，抛出异常
+            
+            ai_response = response.json()
+            print(f"[CHAT_API] Received response from Gemini API: {ai_response}")
+            
+            # Extracting text from Gemini's response structure
+            # This might need adjustment based on the exact Gemini model and response
+            if "candidates" not in ai_response or not ai_response["candidates"] or \
+               "content" not in ai_response["candidates"][0] or \
+               "parts" not in ai_response["candidates"][0]["content"] or not ai_response["candidates"][0]["content"]["parts"] or \
+               "text" not in ai_response["candidates"][0]["content"]["parts"][0]:
+                raise ValueError("Invalid response format from Gemini API")
+            
+            response_text = ai_response['candidates'][0]['content']['parts'][0]['text']
+            if cache_key is not None:
+                response_cache.put(cache_key, response_text)
+            return ChatResponse(response=response_text)
+            
+        except httpx.HTTPStatusError as e:
+            error_message = f"Gemini API error: {e.response.status_code}"
+            print(f"[CHAT_API] HTTPStatusError: {error_message} - Response: {e.response.text}")
+            try:
+                error_data = e.response.json()
+                if "error" in error_data and "message" in error_data["error"] :
+                    error_message = f"Gemini API error: {error_data['error']['message']}"
+            except:
+                pass # Keep the original status code error if parsing fails
+            raise HTTPException(status_code=500, detail=error_message)
+            
+        except httpx.RequestError as e:
+            print(f"[CHAT_API] RequestError: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Network error: {str(e)}")
+        except ValueError as e:
+            print(f"[CHAT_API] ValueError (likely invalid response format): {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error processing Gemini response: {str(e)}")
+        except Exception as e:
+            print(f"[CHAT_API] Unexpected error during Gemini API call: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
     except Exception as e:
         print(f"[CHAT_API] Outer exception: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e)) 
+
+def _sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _chunk_text(chunk: Dict[str, Any]) -> str:
+    candidates = chunk.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+async def stream_chat_events(
+    request: ChatRequest, context: Dict[str, Any], http_request: Request
+) -> AsyncIterator[str]:
+    """Forward Gemini's streamed tokens as SSE events: ``data: {"text": ...}`` per chunk, then ``event: done``"""
+    cache_key = None
+    if response_cache.enabled:
+        cache_key = response_cache.make_key(request.message, context)
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            yield _sse({"text": cached_response})
+            yield _sse({"cached": True}, event="done")
+            return
+
+    client = get_http_client()
+    collected = []
+    upstream_start = time.perf_counter()
+    outcome = "error"
+    try:
+        print("[CHAT_API] Attempting to stream from Gemini API...")
+        # 退出 async with 时会关闭上游连接：客户端断开（生成器被取消或检测到断开）即取消上游调用
+        async with client.stream(
+            "POST",
+            f"{GEMINI_STREAM_URL}?alt=sse&key={GEMINI_API_KEY}",
+            headers={"Content-Type": "application/json"},
+            json={"contents": build_contents(request.message, context)},
+            timeout=httpx.Timeout(30.0, connect=5.0, read=None),
+        ) as response:
+            outcome = str(response.status_code)
+            if response.status_code >= 400:
+                await response.aread()
+                error_message = f"Gemini API error: {response.status_code}"
+                try:
+                    error_message = f"Gemini API error: {response.json()['error']['message']}"
+                except Exception:
+                    pass
+                print(f"[CHAT_API] Stream HTTP error: {error_message}")
+                yield _sse({"detail": error_message}, event="error")
+                return
+
+            async for line in response.aiter_lines():
+                if await http_request.is_disconnected():
+                    print("[CHAT_API] Client disconnected, cancelling upstream stream")
+                    return
+                if not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if not payload:
+                    continue
+                text = _chunk_text(json.loads(payload))
+                if text:
+                    if not collected:
+                        UPSTREAM_FIRST_CHUNK_SECONDS.observe(time.perf_counter() - upstream_start)
+                    collected.append(text)
+                    yield _sse({"text": text})
+
+        if cache_key is not None and collected:
+            response_cache.put(cache_key, "".join(collected))
+        yield _sse({"cached": False}, event="done")
+
+    except httpx.RequestError as e:
+        print(f"[CHAT_API] Stream RequestError: {str(e)}")
+        yield _sse({"detail": f"Network error: {str(e)}"}, event="error")
+    except ValueError as e:
+        print(f"[CHAT_API] Stream ValueError (likely invalid chunk format): {str(e)}")
+        yield _sse({"detail": f"Error processing Gemini response: {str(e)}"}, event="error")
+    finally:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - upstream_start, endpoint="stream", outcome=outcome)
+
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """Streaming variant of /chat using server-sent events"""
+    try:
+        context = resolve_context(request, http_request)
+    except Exception as e:
+        print(f"[CHAT_API] Failed to build chat context: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(
+        stream_chat_events(request, context, http_request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
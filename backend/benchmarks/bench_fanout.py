@@ -0,0 +1,447 @@
+"""Load-test the Socket.IO and /ws fan-out of one backend instance.
+
+Starts ``main:application`` under uvicorn in a subprocess, connects
+``--sio-clients`` Socket.IO clients (each subscribes to all rooms) and
+``--ws-clients`` plain WebSocket clients, and lets the simulation run
+for ``--duration`` seconds while firing ``/trigger-events`` bursts.
+
+Measured:
+
+- emit-to-receive latency of ``live_rooms_delta`` / ``room_delta``:
+  receive time minus the delta's server-side ``ts`` (server and clients
+  share the host clock)
+- /ws fan-out latency: ``/ws`` rebroadcasts every text frame to all
+  connections, so the first ``/ws`` client also sends a timestamped
+  probe every ``--ws-probe-interval`` seconds and each client measures
+  its arrival
+- messages and bytes per second received, per event
+- server CPU (utime + stime of the server and its child processes, e.g.
+  shard processes) and RSS sampled from ``/proc`` once per second
+- ``/trigger-events`` request latency
+
+All clients run in this process's event loop. With many clients on few
+cores the client side can become the bottleneck; ``client_loop_lag_ms``
+in the report shows when that happens.
+
+Usage (from backend/)::
+
+    python benchmarks/bench_fanout.py --rooms 1000 --sio-clients 50 --ws-clients 20 --duration 30 --output fanout.json
+    python benchmarks/bench_fanout.py --rooms 1000 --sio-clients 50 --compare fanout.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+import socketio
+from aiohttp import ClientSession, WSMsgType
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from wire_codec import WireCodec  # noqa: E402
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+EVENT_IDS = ("competitor_offline", "kol_promotion", "host_performance", "stock_shortage", "negative_comments")
+LATENCY_EVENTS = ("live_rooms_delta", "room_delta")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--products", type=int, default=0, help="products per room, 0 = random 3-6")
+    parser.add_argument("--engine", choices=("python", "vectorized", "sharded"), default="python")
+    parser.add_argument("--tick-seconds", type=float, default=1.0)
+    parser.add_argument("--sio-clients", type=int, default=20)
+    parser.add_argument("--ws-clients", type=int, default=10)
+    parser.add_argument("--encoding", choices=("json", "msgpack"), default="json")
+    parser.add_argument(
+        "--watch-rooms", type=int, default=0,
+        help="subscribe each Socket.IO client to this many random rooms instead of all rooms",
+    )
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds, after warm-up")
+    parser.add_argument("--warmup", type=float, default=3.0)
+    parser.add_argument("--burst-size", type=int, default=20, help="events per /trigger-events call, 0 disables")
+    parser.add_argument("--burst-interval", type=float, default=2.0)
+    parser.add_argument("--ws-probe-interval", type=float, default=0.5)
+    parser.add_argument("--port", type=int, default=0, help="0 = pick a free port")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--server-log", default=os.devnull, help="file for the server's stdout/stderr")
+    parser.add_argument("--compare", help="print the change against a previous JSON report")
+    return parser.parse_args()
+
+
+def percentiles(samples_ms):
+    if not samples_ms:
+        return {"count": 0}
+    ordered = sorted(samples_ms)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    return {
+        "count": len(ordered),
+        "mean": statistics.mean(ordered),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+    }
+
+
+class Recorder:
+    """Counters shared by all clients; only samples taken inside the measured window are kept."""
+
+    def __init__(self):
+        self.measuring = False
+        self.latency_ms = {}
+        self.messages = {}
+        self.bytes = {}
+        self.errors = []
+
+    def message(self, event, size, sent_at=None):
+        if not self.measuring:
+            return
+        self.messages[event] = self.messages.get(event, 0) + 1
+        self.bytes[event] = self.bytes.get(event, 0) + size
+        if sent_at is not None:
+            self.latency_ms.setdefault(event, []).append((time.time() - sent_at) * 1000)
+
+
+def payload_size(payload):
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    return len(json.dumps(payload, separators=(",", ":")))
+
+
+async def run_sio_client(url, args, room_ids, recorder):
+    client = socketio.AsyncClient(reconnection=False)
+    codec = WireCodec()
+    strings = list(codec.strings)
+
+    @client.on("wire_string_table")
+    async def on_table(table):
+        strings[:] = table["strings"]
+
+    def handler(event):
+        async def handle(payload):
+            size = payload_size(payload)
+            if isinstance(payload, (bytes, bytearray)):
+                payload = codec.decode(payload, strings)
+            sent_at = payload.get("ts") if event in LATENCY_EVENTS and isinstance(payload, dict) else None
+            recorder.message(event, size, sent_at)
+        return handle
+
+    for event in ("live_rooms_delta", "room_delta", "global_stats", "agent_logs_batch", "live_rooms_snapshot", "room_snapshot"):
+        client.on(event, handler(event))
+
+    await client.connect(url, transports=["websocket"], auth={"encoding": args.encoding})
+    if args.watch_rooms:
+        await client.emit("subscribe", {"room_ids": random.sample(room_ids, min(args.watch_rooms, len(room_ids)))})
+    else:
+        await client.emit("subscribe", {"all": True})
+    return client
+
+
+async def run_ws_client(session, url, recorder, stop, probe_interval=None):
+    async with session.ws_connect(url) as ws:
+        prober = asyncio.create_task(send_ws_probes(ws, probe_interval, stop)) if probe_interval else None
+        while not stop.is_set():
+            try:
+                message = await asyncio.wait_for(ws.receive(), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            if message.type != WSMsgType.TEXT:
+                break
+            try:
+                sent_at = json.loads(message.data).get("bench_ts")
+            except (ValueError, AttributeError):
+                sent_at = None
+            recorder.message("ws_broadcast", len(message.data), sent_at)
+        if prober is not None:
+            await prober
+
+
+async def send_ws_probes(ws, interval, stop):
+    while not stop.is_set():
+        await ws.send_str(json.dumps({"bench_ts": time.time()}))
+        await asyncio.sleep(interval)
+
+
+async def run_bursts(http, args, room_ids, recorder, stop, results):
+    while not stop.is_set():
+        await asyncio.sleep(args.burst_interval)
+        burst = [
+            {"event_id": random.choice(EVENT_IDS), "room_id": random.choice(room_ids)}
+            for _ in range(args.burst_size)
+        ]
+        start = time.perf_counter()
+        try:
+            response = await http.post("/trigger-events", json=burst)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            recorder.errors.append(f"trigger-events: {e!r}")
+            continue
+        if recorder.measuring:
+            results.append((time.perf_counter() - start) * 1000)
+
+
+async def measure_loop_lag(stop, samples, recorder, interval=0.1):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        if recorder.measuring:
+            samples.append(max(0.0, loop.time() - expected) * 1000)
+
+
+def process_tree(pid):
+    """``pid`` and its descendants, from the parent links in /proc/<pid>/stat."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, ()))
+    return tree
+
+
+def read_usage(pid):
+    """(CPU seconds, RSS bytes) summed over the process tree."""
+    cpu, rss = 0.0, 0
+    for member in process_tree(pid):
+        try:
+            with open(f"/proc/{member}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            with open(f"/proc/{member}/statm") as f:
+                resident = int(f.read().split()[1])
+        except OSError:
+            continue
+        # 去掉 pid 与 comm 后，utime / stime 位于第 12、13 列
+        cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+        rss += resident * PAGE_SIZE
+    return cpu, rss
+
+
+async def sample_server(pid, stop, samples, recorder, interval=1.0):
+    previous = None
+    while not stop.is_set():
+        now = time.perf_counter()
+        cpu, rss = read_usage(pid)
+        if recorder.measuring and previous is not None:
+            samples.append(((cpu - previous[1]) / (now - previous[0]) * 100, rss))
+        previous = (now, cpu)
+        await asyncio.sleep(interval)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, port, log):
+    env = dict(
+        os.environ,
+        SIMULATION_ROOMS=str(args.rooms),
+        SIMULATION_PRODUCTS_PER_ROOM=str(args.products),
+        SIMULATION_ENGINE=args.engine,
+        SIMULATION_TICK_SECONDS=str(args.tick_seconds),
+        # 每次从全新状态开始，且不让磁盘写入干扰测量
+        HISTORY_DIR="",
+        SNAPSHOT_PATH="",
+    )
+    env.setdefault("GEMINI_API_KEY", "benchmark")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:application", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+async def wait_for_server(http, process, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            response = await http.get("/live-rooms")
+            if response.status_code == 200 and response.json():
+                return [room["id"] for room in response.json()]
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("server did not come up in time")
+
+
+async def run(args, port, process):
+    base_url = f"http://127.0.0.1:{port}"
+    recorder = Recorder()
+    stop = asyncio.Event()
+    trigger_ms, loop_lag_ms, server_samples = [], [], []
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=30.0) as http, ClientSession() as session:
+        room_ids = await wait_for_server(http, process)
+        sio_clients = []
+        for _ in range(args.sio_clients):
+            sio_clients.append(await run_sio_client(base_url, args, room_ids, recorder))
+        ws_url = f"ws://127.0.0.1:{port}/ws"
+        tasks = [
+            asyncio.create_task(run_ws_client(
+                session, ws_url, recorder, stop, probe_interval=args.ws_probe_interval if index == 0 else None
+            ))
+            for index in range(args.ws_clients)
+        ]
+        if args.burst_size:
+            tasks.append(asyncio.create_task(run_bursts(http, args, room_ids, recorder, stop, trigger_ms)))
+        tasks.append(asyncio.create_task(measure_loop_lag(stop, loop_lag_ms, recorder)))
+        tasks.append(asyncio.create_task(sample_server(process.pid, stop, server_samples, recorder)))
+
+        await asyncio.sleep(args.warmup)
+        recorder.measuring = True
+        started = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        recorder.measuring = False
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        recorder.errors.extend(repr(result) for result in results if isinstance(result, Exception))
+        for client in sio_clients:
+            await client.disconnect()
+
+    cpu = [sample[0] for sample in server_samples]
+    rss = [sample[1] for sample in server_samples]
+    return {
+        "seconds": elapsed,
+        "latency_ms": {event: percentiles(samples) for event, samples in sorted(recorder.latency_ms.items())},
+        "messages_per_second": {event: count / elapsed for event, count in sorted(recorder.messages.items())},
+        "bytes_per_second": {event: size / elapsed for event, size in sorted(recorder.bytes.items())},
+        "messages_per_second_total": sum(recorder.messages.values()) / elapsed,
+        "trigger_events_ms": percentiles(trigger_ms),
+        "server_cpu_percent": {"mean": statistics.mean(cpu), "max": max(cpu)} if cpu else {},
+        "server_rss_mb": {"mean": statistics.mean(rss) / 2**20, "max": max(rss) / 2**20} if rss else {},
+        "client_loop_lag_ms": percentiles(loop_lag_ms),
+        "errors": recorder.errors,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def headline(report):
+    """The numbers worth comparing between two runs."""
+    results = report["results"]
+    values = {
+        "messages/s": results["messages_per_second_total"],
+        "trigger p50 ms": results["trigger_events_ms"].get("p50"),
+        "server cpu %": results["server_cpu_percent"].get("mean"),
+        "server rss MB": results["server_rss_mb"].get("max"),
+    }
+    for event, stats in results["latency_ms"].items():
+        values[f"{event} p50 ms"] = stats.get("p50")
+        values[f"{event} p99 ms"] = stats.get("p99")
+    return values
+
+
+def print_report(report, baseline=None):
+    config, results = report["config"], report["results"]
+    print(
+        f"{config['rooms']} rooms, {config['sio_clients']} Socket.IO + {config['ws_clients']} /ws clients, "
+        f"{config['engine']} engine, {config['encoding']}, commit {report['commit']}"
+    )
+    print(f"{'event':<20}{'count':>8}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}{'msg/s':>10}")
+    for event, rate in results["messages_per_second"].items():
+        stats = results["latency_ms"].get(event)
+        if stats:
+            print(
+                f"{event:<20}{stats['count']:>8}{stats['p50']:>10.1f}{stats['p90']:>10.1f}"
+                f"{stats['p99']:>10.1f}{stats['max']:>10.1f}{rate:>10.1f}"
+            )
+        else:
+            print(f"{event:<20}{'':>8}{'-':>10}{'-':>10}{'-':>10}{'-':>10}{rate:>10.1f}")
+    print(f"total messages/s: {results['messages_per_second_total']:.1f}")
+    if results["trigger_events_ms"]["count"]:
+        stats = results["trigger_events_ms"]
+        print(f"/trigger-events: p50 {stats['p50']:.1f} ms, p99 {stats['p99']:.1f} ms over {stats['count']} bursts")
+    if results["server_cpu_percent"]:
+        print(
+            f"server: cpu {results['server_cpu_percent']['mean']:.0f}% mean / {results['server_cpu_percent']['max']:.0f}% max, "
+            f"rss {results['server_rss_mb']['max']:.0f} MB max"
+        )
+    if results["client_loop_lag_ms"]["count"]:
+        print(f"client loop lag p99: {results['client_loop_lag_ms']['p99']:.1f} ms")
+    for error in results["errors"]:
+        print(f"error: {error}")
+
+    if baseline is not None:
+        print(f"\nchange vs commit {baseline.get('commit')}:")
+        old = headline(baseline)
+        for name, value in headline(report).items():
+            before = old.get(name)
+            if value is None or not before:
+                continue
+            print(f"  {name:<28}{before:>10.1f} -> {value:>10.1f} ({(value - before) / before * 100:+.0f}%)")
+
+
+def main():
+    args = parse_args()
+    port = args.port or free_port()
+    with open(args.server_log, "wb") as log:
+        process = start_server(args, port, log)
+        try:
+            results = asyncio.run(run(args, port, process))
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    report = {
+        "commit": git_commit(),
+        "cpu_count": os.cpu_count(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "output", "compare", "port", "server_log")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Micro-benchmarks of the simulation and event hot paths (pytest-benchmark).
+
+Covers one tick of each in-process engine, ``apply_event_effects`` per
+predefined event, ``LiveRoom.model_dump`` on rooms with many products,
+``generate_random_product`` and ``create_live_rooms``, at 5 to 10,000
+rooms. All inputs come from a fixed seed through ``RandomStreams``, and
+every round of a stateful benchmark starts from the same freshly built
+rooms, so stock running out over many rounds does not change what is
+measured.
+
+Needs ``pytest-benchmark`` from requirements-dev.txt (skipped without
+it). Not part of a regular test run; pass the file explicitly (from
+backend/)::
+
+    # record a baseline
+    python -m pytest benchmarks/bench_micro.py --benchmark-storage=benchmarks/baselines --benchmark-save=baseline
+    # compare against the latest recorded run, failing on a >20% slower mean
+    python -m pytest benchmarks/bench_micro.py --benchmark-storage=benchmarks/baselines \\
+        --benchmark-compare --benchmark-compare-fail=mean:20%
+
+``-k 'not 10000'`` skips the largest size for a quicker run.
+"""
+import os
+import random
+import sys
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+# 不在导入时打开历史存储或快照文件
+os.environ["HISTORY_DIR"] = ""
+os.environ["SNAPSHOT_PATH"] = ""
+
+import main  # noqa: E402
+from anomaly_detector import AnomalyDetector  # noqa: E402
+from delta_sync import RoomChanges  # noqa: E402
+from effect_scheduler import ActiveEffects  # noqa: E402
+from event_triggers import PREDEFINED_EVENTS, apply_event_effects  # noqa: E402
+from log_store import AgentLogStore  # noqa: E402
+from replay import RandomStreams  # noqa: E402
+from rolling_aggregates import LiveAggregates  # noqa: E402
+from vector_engine import VectorizedSimulation  # noqa: E402
+
+SEED = 20240601
+ROOM_COUNTS = (5, 100, 1000, 10000)
+PRODUCT_COUNTS = (5, 50, 500)
+
+
+def rounds_for(rooms: int) -> int:
+    # 大规模用例每轮都要重建直播间，轮数随规模减少
+    return max(3, min(50, 20000 // rooms))
+
+
+def build_rooms(monkeypatch, rooms: int, products: int = 0):
+    """Seeded rooms in ``main.live_rooms``; the same seed always gives the same rooms."""
+    monkeypatch.setattr(main, "SIMULATION_ROOMS", rooms)
+    monkeypatch.setattr(main, "SIMULATION_PRODUCTS_PER_ROOM", products)
+    monkeypatch.setattr(main, "random_streams", RandomStreams(SEED))
+    # 基准里没有广播来清空变更标记，每轮换新的，避免标记逐轮累积
+    monkeypatch.setattr(main, "room_changes", RoomChanges())
+    main.live_rooms.clear()
+    main.create_live_rooms()
+    main.live_aggregates.load(main.live_rooms)
+    return main.live_rooms
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(monkeypatch):
+    monkeypatch.setattr(main, "active_effects", ActiveEffects())
+    monkeypatch.setattr(main, "live_aggregates", LiveAggregates())
+    monkeypatch.setattr(main, "anomaly_detector", AnomalyDetector())
+    monkeypatch.setattr(main, "agent_logs", AgentLogStore(capacity=10000))
+    monkeypatch.setattr(main, "global_stats", dict(main.global_stats, total_sales=0, total_profit=0))
+    yield
+    main.live_rooms.clear()
+
+
+@pytest.mark.parametrize("rooms", ROOM_COUNTS)
+def test_create_live_rooms(benchmark, monkeypatch, rooms):
+    benchmark.pedantic(
+        build_rooms, args=(monkeypatch, rooms), rounds=rounds_for(rooms), warmup_rounds=1
+    )
+    assert len(main.live_rooms) == rooms
+
+
+def test_generate_random_product(benchmark):
+    rng = random.Random(SEED)
+    product = benchmark(main.generate_random_product, "prod_1_1", "food", rng)
+    assert product.stock == product.initial_stock
+
+
+@pytest.mark.parametrize("products", PRODUCT_COUNTS)
+def test_live_room_model_dump(benchmark, monkeypatch, products):
+    room = build_rooms(monkeypatch, 1, products)["room_1"]
+    data = benchmark(room.model_dump)
+    assert len(data["products"]) == products
+
+
+@pytest.mark.parametrize("rooms", ROOM_COUNTS)
+def test_simulate_tick_python(benchmark, monkeypatch, rooms):
+    def setup():
+        build_rooms(monkeypatch, rooms)
+        return (), {}
+
+    benchmark.pedantic(main.simulate_tick, setup=setup, rounds=rounds_for(rooms), warmup_rounds=1)
+
+
+@pytest.mark.parametrize("rooms", ROOM_COUNTS)
+def test_simulate_tick_vectorized(benchmark, monkeypatch, rooms):
+    def setup():
+        build_rooms(monkeypatch, rooms)
+        engine = VectorizedSimulation(
+            main.live_rooms,
+            rng=main.random_streams.numpy("engine"),
+            active_effects=main.active_effects,
+            anomaly_detector=main.anomaly_detector,
+        )
+        # 第一个 tick 会建立引擎商品到滑动窗口槽位的映射，只测之后的稳态 tick
+        main.simulate_tick_vectorized(engine)
+        return (engine,), {}
+
+    benchmark.pedantic(main.simulate_tick_vectorized, setup=setup, rounds=rounds_for(rooms), warmup_rounds=1)
+
+
+@pytest.mark.parametrize("event", PREDEFINED_EVENTS, ids=lambda event: event.id)
+def test_apply_event_effects(benchmark, monkeypatch, event):
+    rooms = build_rooms(monkeypatch, 1, 20)
+    template = rooms["room_1"]
+
+    def setup():
+        room = template.model_copy(deep=True)
+        return (event, room, main.global_stats, main.agent_logs, ActiveEffects(), random.Random(SEED)), {}
+
+    benchmark.pedantic(apply_event_effects, setup=setup, rounds=200, warmup_rounds=5)
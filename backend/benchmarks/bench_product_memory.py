@@ -0,0 +1,80 @@
+"""Measure the memory per product of ``Product`` records against per-product dicts.
+
+Builds the same seeded products twice with ``generate_random_product``:
+once kept as ``Product`` records (what the app stores) and once as their
+dict form (``Product.to_dict``, the same keys and values as the old
+per-product dicts), and reports the bytes allocated per product with
+``tracemalloc``, including the field values each product owns (id
+string, floats, ``ai_actions``).
+
+Usage (from backend/)::
+
+    python benchmarks/bench_product_memory.py --rooms 10000 --products 20
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SEED = 20240601
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--products", type=int, default=20, help="products per room")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args()
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    products = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return {"bytes_per_product": used / len(products), "total_mb": used / 1e6}
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ["HISTORY_DIR"] = ""
+    os.environ["SNAPSHOT_PATH"] = ""
+    import main as app_main
+
+    def build(to_dict: bool):
+        rng = random.Random(SEED)
+        products = []
+        for room in range(args.rooms):
+            for index in range(args.products):
+                product = app_main.generate_random_product(f"prod_{room + 1}_{index + 1}", "food", rng)
+                products.append(product.to_dict() if to_dict else product)
+        return products
+
+    results = {
+        "dict": measure(lambda: build(True)),
+        "record": measure(lambda: build(False)),
+    }
+    report = {"rooms": args.rooms, "products_per_room": args.products, "results": results}
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{args.rooms} rooms x {args.products} products = {args.rooms * args.products} products")
+    print(f"{'layout':<10}{'bytes/product':>15}{'total MB':>12}{'ratio':>8}")
+    baseline = results["dict"]["bytes_per_product"]
+    for name, stats in results.items():
+        print(f"{name:<10}{stats['bytes_per_product']:>15.0f}{stats['total_mb']:>12.1f}"
+              f"{stats['bytes_per_product'] / baseline:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Measure simulation tick time of the sharded engine for different shard counts.
+
+For each shard count, builds the rooms, starts a ``ShardedSimulation``,
+runs one warm-up tick (shard processes finish booting) and then times
+``simulate_tick_sharded`` — shard work, result transfer, write-back into
+the ``LiveRoom`` objects and log building. The vectorized single-process
+engine is measured as the baseline.
+
+Usage (from backend/)::
+
+    python benchmarks/bench_sharded_tick.py --rooms 10000 --shards 1 2 4 8 --ticks 20
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=10000)
+    parser.add_argument("--products", type=int, default=0, help="products per room, 0 = random 3-6")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args()
+
+
+def summarize(samples):
+    times = sorted(seconds * 1000 for seconds in samples)
+    return {
+        "tick_ms_mean": statistics.mean(times),
+        "tick_ms_p50": times[len(times) // 2],
+        "tick_ms_max": times[-1],
+        "rooms_per_second": 0.0,
+    }
+
+
+async def run(args):
+    import main as app_main
+    from sharded_engine import ShardedSimulation
+    from vector_engine import VectorizedSimulation
+
+    results = {}
+
+    app_main.create_live_rooms()
+    engine = VectorizedSimulation(app_main.live_rooms)
+    samples = []
+    for _ in range(args.ticks):
+        start = time.perf_counter()
+        app_main.simulate_tick_vectorized(engine)
+        samples.append(time.perf_counter() - start)
+    results["vectorized"] = summarize(samples)
+
+    for shards in args.shards:
+        app_main.create_live_rooms()
+        engine = ShardedSimulation(app_main.live_rooms, shards=shards)
+        try:
+            await app_main.simulate_tick_sharded(engine)
+            samples = []
+            for _ in range(args.ticks):
+                start = time.perf_counter()
+                await app_main.simulate_tick_sharded(engine)
+                samples.append(time.perf_counter() - start)
+        finally:
+            engine.close()
+        results[f"sharded x{engine.shard_count}"] = summarize(samples)
+
+    for stats in results.values():
+        stats["rooms_per_second"] = args.rooms / (stats["tick_ms_mean"] / 1000)
+    return results
+
+
+def main():
+    args = parse_args()
+    os.environ["SIMULATION_ROOMS"] = str(args.rooms)
+    os.environ["SIMULATION_PRODUCTS_PER_ROOM"] = str(args.products)
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    results = asyncio.run(run(args))
+
+    report = {"rooms": args.rooms, "ticks": args.ticks, "cpu_count": os.cpu_count(), "results": results}
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{args.rooms} rooms, {args.ticks} ticks, {report['cpu_count']} CPUs")
+    print(f"{'engine':<16}{'mean ms':>10}{'p50 ms':>10}{'max ms':>10}{'rooms/s':>12}")
+    for name, stats in results.items():
+        print(
+            f"{name:<16}{stats['tick_ms_mean']:>10.2f}{stats['tick_ms_p50']:>10.2f}"
+            f"{stats['tick_ms_max']:>10.2f}{stats['rooms_per_second']:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
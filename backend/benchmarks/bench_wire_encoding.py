@@ -0,0 +1,123 @@
+"""Compare the JSON and MessagePack wire encodings of the simulation payloads.
+
+Runs the simulation for a number of ticks and, for every payload the
+server emits per tick (``live_rooms_delta``, ``global_stats``, the
+``agent_logs_batch``) plus the initial ``live_rooms_snapshot``, measures
+bytes on the wire and encode time for:
+
+- json: what python-socketio sends today (``json.dumps`` with compact separators)
+- msgpack: ``WireCodec.encode`` with the string table
+
+Usage (from backend/)::
+
+    python benchmarks/bench_wire_encoding.py --rooms 1000 --products 20 --ticks 20
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--products", type=int, default=0, help="products per room, 0 = random 3-6")
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--engine", choices=("python", "vectorized"), default="python")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    return parser.parse_args()
+
+
+def measure(encode, payload, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        data = encode(payload)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(data), best
+
+
+def summarize(samples):
+    sizes = [size for size, _ in samples]
+    times = [seconds * 1000 for _, seconds in samples]
+    return {
+        "bytes_mean": statistics.mean(sizes),
+        "bytes_total": sum(sizes),
+        "encode_ms_mean": statistics.mean(times),
+        "encode_ms_max": max(times),
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ["SIMULATION_ROOMS"] = str(args.rooms)
+    os.environ["SIMULATION_PRODUCTS_PER_ROOM"] = str(args.products)
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    import main as app_main
+
+    def encode_json(payload):
+        return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+    encoders = {"json": encode_json, "msgpack": app_main.wire_codec.encode}
+
+    app_main.create_live_rooms()
+    encoder = app_main.room_delta_encoder
+    encoder.diff(app_main.live_rooms)
+    payloads = {"live_rooms_snapshot": [encoder.snapshot()]}
+
+    engine = None
+    if args.engine == "vectorized":
+        from vector_engine import VectorizedSimulation
+        engine = VectorizedSimulation(app_main.live_rooms)
+    for _ in range(args.ticks):
+        if engine is not None:
+            logs = app_main.simulate_tick_vectorized(engine)
+        else:
+            logs = app_main.simulate_tick()
+        delta = encoder.diff(app_main.live_rooms)
+        if delta:
+            payloads.setdefault("live_rooms_delta", []).append(delta)
+        payloads.setdefault("global_stats", []).append(dict(app_main.global_stats))
+        if logs:
+            payloads.setdefault("agent_logs_batch", []).append(logs)
+
+    results = {}
+    for event, samples in payloads.items():
+        results[event] = {
+            name: summarize([measure(encode, payload) for payload in samples])
+            for name, encode in encoders.items()
+        }
+        results[event]["count"] = len(samples)
+
+    report = {
+        "rooms": args.rooms,
+        "products": sum(len(room.products) for room in app_main.live_rooms.values()),
+        "ticks": args.ticks,
+        "engine": args.engine,
+        "string_table_size": app_main.wire_codec.version,
+        "results": results,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{report['rooms']} rooms, {report['products']} products, {args.ticks} ticks ({args.engine} engine), "
+          f"string table {report['string_table_size']} entries")
+    print(f"{'payload':<22}{'encoding':<10}{'bytes/msg':>12}{'ratio':>8}{'encode ms':>12}{'max ms':>10}")
+    for event, result in results.items():
+        baseline = result["json"]["bytes_mean"]
+        for name in encoders:
+            stats = result[name]
+            print(
+                f"{event:<22}{name:<10}{stats['bytes_mean']:>12.0f}{stats['bytes_mean'] / baseline:>8.2f}"
+                f"{stats['encode_ms_mean']:>12.3f}{stats['encode_ms_max']:>10.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
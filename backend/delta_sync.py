@@ -0,0 +1,419 @@
+import itertools
+import time
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from products import PRODUCT_FIELDS, Product, product_values
+
+# 增量同步协议版本号，客户端据此判断能否解析 patch 格式
+PROTOCOL_VERSION = 1
+
+# LiveRoom 上参与比对的标量字段（products 单独按商品比对）
+ROOM_FIELDS = (
+    "id",
+    "name",
+    "host_name",
+    "viewers",
+    "sales",
+    "conversion_rate",
+    "health_status",
+    "start_time",
+    "windows",
+)
+
+
+def _copy_product(product) -> Dict:
+    # 商品可以是 Product 记录或其 dict 形式（快照、镜像收到的 patch、字段 patch）
+    if isinstance(product, Product):
+        return product.to_dict()
+    copied = dict(product)
+    # 已发送的状态里 ai_actions 统一存为列表，与 to_dict 和客户端收到的形式一致
+    if isinstance(copied.get("ai_actions"), (list, tuple)):
+        copied["ai_actions"] = list(copied["ai_actions"])
+    return copied
+
+
+def _merge_patch(patch: Dict, later: Dict):
+    """Fold ``later`` (computed after ``patch``) into ``patch``, product fields included."""
+    products = later.pop("products", None)
+    patch.update(later)
+    if products:
+        merged = patch.setdefault("products", {})
+        for product_id, fields in products.items():
+            merged.setdefault(product_id, {}).update(fields)
+
+
+class RoomChanges:
+    """What changed in ``live_rooms`` since the last ``RoomDeltaEncoder.diff``.
+
+    The simulation and the event code mark what they write as they write
+    it, so ``diff`` compares only those rooms and products instead of
+    every product of every room on each tick. ``mark_fields`` marks the
+    scalar fields of a room (or of all rooms); products are compared on
+    the fields they were marked with. A room marked with ``mark_room``
+    (e.g. rewritten by an event, products added or removed) is compared
+    in full, and ``mark_everything`` asks for a full scan, e.g. after the
+    rooms were created, restored or taken over from another worker.
+    Replacing a room's product list must go through one of the latter.
+    """
+
+    def __init__(self):
+        self.clear()
+        # 第一次比对总是全量扫描
+        self.everything = True
+
+    def clear(self):
+        self.everything = False
+        self.all_fields = False
+        self.field_rooms: Set[str] = set()
+        self.full_rooms: Set[str] = set()
+        self.products: List[Tuple[str, Any, Optional[Sequence[str]]]] = []
+        self.batches: List[Tuple[List, Sequence[str], List[int], Optional[Sequence[str]]]] = []
+
+    def mark_everything(self):
+        self.everything = True
+
+    def mark_fields(self, room_id: Optional[str] = None):
+        """The scalar fields of ``room_id``, or of every room when None, may have changed."""
+        if room_id is None:
+            self.all_fields = True
+        else:
+            self.field_rooms.add(room_id)
+
+    def mark_room(self, room_id: str):
+        self.full_rooms.add(room_id)
+
+    def mark_product(self, room_id: str, product, fields: Optional[Sequence[str]] = None):
+        """``fields`` of one product may have changed (any field when None)."""
+        self.products.append((room_id, product, fields))
+
+    def mark_products(
+        self, products: List, product_rooms: Sequence[str], indexes, fields: Optional[Sequence[str]] = None
+    ):
+        """Batch form for the array engines: ``products[i]`` in room ``product_rooms[i]`` for every i in ``indexes``.
+
+        ``indexes`` is a NumPy array; the lists are read at ``diff`` time,
+        so they must not be rebuilt in between.
+        """
+        if len(indexes):
+            self.batches.append((products, product_rooms, indexes.tolist(), fields))
+
+
+class RoomDeltaEncoder:
+    """Tracks the last state sent to clients and encodes per-tick patches.
+
+    Protocol (version 1):
+
+    - ``live_rooms_snapshot``: ``{"version", "seq", "rooms": [room, ...]}``
+      sent on connect and whenever a client asks to ``resync``.
+    - ``live_rooms_delta``: ``{"version", "seq", "base_seq", "ts", "rooms",
+      "removed"}`` where ``rooms`` maps room_id to a patch holding only the
+      changed room fields. A patch may carry ``products`` (product_id ->
+      changed product fields) and ``product_ids`` (the full product order,
+      only present when products were added or removed).
+
+    Patch values are absolute, so applying a delta twice is harmless. A
+    client whose last seq differs from ``base_seq`` has missed a delta and
+    should request a snapshot.
+
+    Each room also carries its own seq, bumped only when that room changes,
+    for clients subscribed to individual rooms (``room_snapshot`` /
+    ``room_delta``).
+    """
+
+    def __init__(self):
+        self.seq = 0
+        self._last: Dict[str, Dict[str, Any]] = {}
+
+    def _room_state(self, previous: Dict[str, Any]) -> Dict:
+        room = {field: previous[field] for field in ROOM_FIELDS if field in previous}
+        room["products"] = [
+            _copy_product(previous["products"][product_id])
+            for product_id in previous["product_ids"]
+        ]
+        return room
+
+    def room_state(self, room_id: str) -> Optional[Dict]:
+        previous = self._last.get(room_id)
+        return self._room_state(previous) if previous is not None else None
+
+    def room_seqs(self) -> Dict[str, int]:
+        return {room_id: previous["seq"] for room_id, previous in self._last.items()}
+
+    def snapshot(self) -> Dict:
+        """Full state as of ``seq``, built from what has already been broadcast.
+
+        Using the broadcast state rather than the live objects keeps the
+        snapshot consistent with the next delta's ``base_seq``.
+        """
+        rooms = [self._room_state(previous) for previous in self._last.values()]
+        return {"version": PROTOCOL_VERSION, "seq": self.seq, "rooms": rooms}
+
+    def room_snapshot(self, room_id: str) -> Optional[Dict]:
+        previous = self._last.get(room_id)
+        if previous is None:
+            return None
+        return {
+            "version": PROTOCOL_VERSION,
+            "room_id": room_id,
+            "seq": previous["seq"],
+            "room": self._room_state(previous),
+        }
+
+    def room_delta(self, room_id: str, delta: Dict) -> Dict:
+        """Slice the patch for one room out of a delta returned by ``diff``."""
+        seq = self._last[room_id]["seq"]
+        return {
+            "version": PROTOCOL_VERSION,
+            "room_id": room_id,
+            "seq": seq,
+            "base_seq": seq - 1,
+            "ts": delta["ts"],
+            "patch": delta["rooms"][room_id],
+        }
+
+    def diff(self, live_rooms: Dict[str, Any], changes: Optional[RoomChanges] = None) -> Optional[Dict]:
+        """Return a delta against the last emitted state, or None if nothing changed.
+
+        Without ``changes``, or when it asks for everything, every room and
+        product is compared; otherwise only what ``changes`` marked. The
+        marks are cleared either way.
+        """
+        if changes is None or changes.everything:
+            patches = {room_id: self._diff_room(room, self._tracked(room_id)) for room_id, room in live_rooms.items()}
+        else:
+            patches = self._diff_marked(live_rooms, changes)
+        if changes is not None:
+            changes.clear()
+
+        changed: Dict[str, Dict] = {}
+        for room_id, patch in patches.items():
+            if patch:
+                self._last[room_id]["seq"] += 1
+                changed[room_id] = patch
+
+        removed = [room_id for room_id in self._last if room_id not in live_rooms]
+        for room_id in removed:
+            del self._last[room_id]
+
+        if not changed and not removed:
+            return None
+
+        base_seq = self.seq
+        self.seq += 1
+        return {
+            "version": PROTOCOL_VERSION,
+            "seq": self.seq,
+            "base_seq": base_seq,
+            "ts": time.time(),
+            "rooms": changed,
+            "removed": removed,
+        }
+
+    def _tracked(self, room_id: str) -> Dict[str, Any]:
+        previous = self._last.get(room_id)
+        if previous is None:
+            previous = self._last[room_id] = {"seq": 0, "products": {}, "product_ids": []}
+        return previous
+
+    def _diff_marked(self, live_rooms: Dict[str, Any], changes: RoomChanges) -> Dict[str, Dict]:
+        patches: Dict[str, Dict] = {}
+        full_rooms = changes.full_rooms
+        field_rooms = changes.field_rooms
+        all_fields = changes.all_fields
+        compared = set()
+        for room_id, room in live_rooms.items():
+            previous = self._last.get(room_id)
+            if previous is None or room_id in full_rooms:
+                patches[room_id] = self._diff_room(room, self._tracked(room_id))
+                compared.add(room_id)
+            elif all_fields or room_id in field_rooms:
+                patches[room_id] = self._diff_fields(room, previous)
+
+        # 商品只比对标记的字段；不认识的商品（列表变了却没有 mark_room）整间重新比对
+        resync: Set[str] = set()
+        marked = [changes.products]
+        for products, product_rooms, indexes, fields in changes.batches:
+            marked.append(zip(
+                map(product_rooms.__getitem__, indexes),
+                map(products.__getitem__, indexes),
+                itertools.repeat(fields),
+            ))
+        self._diff_marked_products(itertools.chain.from_iterable(marked), patches, compared, resync)
+
+        for room_id in resync:
+            room = live_rooms.get(room_id)
+            if room is not None:
+                _merge_patch(patches.setdefault(room_id, {}), self._diff_room(room, self._last[room_id]))
+        return patches
+
+    def _diff_marked_products(self, marked, patches: Dict[str, Dict], compared: Set[str], resync: Set[str]):
+        # 同一直播间的商品通常相邻，直播间级别的查找只在直播间切换时做一次
+        current = previous = last_products = product_patches = None
+        for room_id, product, fields in marked:
+            if room_id != current:
+                current = room_id
+                previous = None
+                if room_id not in compared and room_id not in resync:
+                    previous = self._last.get(room_id)
+                if previous is not None:
+                    # 字段值元组缓存只服务全量扫描，这里直接改已发送的状态，缓存作废
+                    previous.pop("product_values", None)
+                    last_products = previous["products"]
+                    product_patches = patches.get(room_id, {}).get("products")
+            if previous is None:
+                continue
+            product_id = product.id
+            last = last_products.get(product_id)
+            if last is None:
+                resync.add(room_id)
+                previous = None
+                continue
+
+            patch = None
+            if fields is None:
+                for key, value in product.to_dict().items():
+                    if key not in last or last[key] != value:
+                        if patch is None:
+                            patch = {}
+                        patch[key] = last[key] = value
+            else:
+                for key in fields:
+                    value = getattr(product, key)
+                    if last.get(key) != value:
+                        if key == "ai_actions":
+                            value = list(value)
+                            if last.get(key) == value:
+                                continue
+                        elif value is None:  # windows 尚未发布
+                            continue
+                        if patch is None:
+                            patch = {}
+                        patch[key] = last[key] = value
+            if patch is not None:
+                if product_patches is None:
+                    product_patches = patches.setdefault(room_id, {}).setdefault("products", {})
+                product_patches[product_id] = patch
+
+    @staticmethod
+    def _diff_fields(room, previous: Dict[str, Any]) -> Dict:
+        patch: Dict[str, Any] = {}
+        for field in ROOM_FIELDS:
+            value = getattr(room, field)
+            if field not in previous or previous[field] != value:
+                patch[field] = value
+                previous[field] = value
+        return patch
+
+    def _diff_room(self, room, previous: Dict[str, Any]) -> Dict:
+        patch = self._diff_fields(room, previous)
+
+        last_products: Dict[str, Dict] = previous["products"]
+        # 上次比对时每个商品的字段值元组；未变化的商品一次元组比较即可跳过
+        last_values: Dict[str, Tuple] = previous.setdefault("product_values", {})
+        product_ids: List[str] = []
+        product_patches: Dict[str, Dict] = {}
+        for product in room.products:
+            product_id = product.id
+            product_ids.append(product_id)
+            values = product_values(product)
+            windows = product.windows
+            cached = last_values.get(product_id)
+            if cached is not None and cached[1] is windows and cached[0] == values:
+                continue
+            last_values[product_id] = (values, windows)
+            last = last_products.get(product_id)
+            if last is None:
+                data = product_patches[product_id] = product.to_dict()
+                last_products[product_id] = _copy_product(data)
+                continue
+            fields = {}
+            if cached is not None:
+                for key, value, old in zip(PRODUCT_FIELDS, values, cached[0]):
+                    if value != old:
+                        fields[key] = value
+                if windows is not None and windows != last.get("windows"):
+                    fields["windows"] = windows
+            else:
+                # 没有缓存的值（刚从快照或其他进程的状态载入），按发送时的 dict 形式逐字段比较
+                for key, value in product.to_dict().items():
+                    if key not in last or last[key] != value:
+                        fields[key] = value
+            if fields:
+                if "ai_actions" in fields:
+                    fields["ai_actions"] = list(fields["ai_actions"])
+                product_patches[product_id] = fields
+                last.update(_copy_product(fields))
+
+        if product_patches:
+            patch["products"] = product_patches
+        if product_ids != previous["product_ids"]:
+            for product_id in set(previous["product_ids"]) - set(product_ids):
+                last_products.pop(product_id, None)
+                last_values.pop(product_id, None)
+            previous["product_ids"] = product_ids
+            patch["product_ids"] = product_ids
+        return patch
+
+    def apply(self, delta: Dict):
+        """Advance the tracked state with a delta produced by another encoder (mirror mode)."""
+        for room_id, patch in delta["rooms"].items():
+            previous = self._last.get(room_id)
+            if previous is None:
+                previous = self._last[room_id] = {"seq": 0, "products": {}, "product_ids": []}
+            for field in ROOM_FIELDS:
+                if field in patch:
+                    previous[field] = patch[field]
+            last_products = previous["products"]
+            # 状态来自别处，缓存的字段值元组不再可信
+            previous.pop("product_values", None)
+            for product_id, fields in (patch.get("products") or {}).items():
+                last = last_products.get(product_id)
+                if last is None:
+                    last_products[product_id] = _copy_product(fields)
+                else:
+                    last.update(_copy_product(fields))
+            if "product_ids" in patch:
+                for product_id in set(previous["product_ids"]) - set(patch["product_ids"]):
+                    last_products.pop(product_id, None)
+                previous["product_ids"] = list(patch["product_ids"])
+            previous["seq"] += 1
+
+        for room_id in delta.get("removed", []):
+            self._last.pop(room_id, None)
+        self.seq = delta["seq"]
+
+    def load(self, snapshot: Dict, room_seqs: Optional[Dict[str, int]] = None) -> Dict:
+        """Replace the tracked state with another encoder's snapshot.
+
+        Returns a delta that takes a mirror of the previous state to the
+        snapshot (every room in full, plus the rooms that disappeared), so
+        mirrors can be rebuilt with the same code path as ordinary deltas.
+        """
+        room_seqs = room_seqs or {}
+        tracked: Dict[str, Dict[str, Any]] = {}
+        patches: Dict[str, Dict] = {}
+        for room in snapshot["rooms"]:
+            room_id = room["id"]
+            patch = {field: room[field] for field in ROOM_FIELDS if field in room}
+            patch["products"] = {product["id"]: _copy_product(product) for product in room["products"]}
+            patch["product_ids"] = [product["id"] for product in room["products"]]
+            patches[room_id] = patch
+            tracked[room_id] = dict(
+                patch,
+                products={product_id: _copy_product(product) for product_id, product in patch["products"].items()},
+                product_ids=list(patch["product_ids"]),
+                seq=room_seqs.get(room_id, 0),
+            )
+
+        removed = [room_id for room_id in self._last if room_id not in tracked]
+        base_seq = self.seq
+        self._last = tracked
+        self.seq = snapshot["seq"]
+        return {
+            "version": PROTOCOL_VERSION,
+            "seq": self.seq,
+            "base_seq": base_seq,
+            "ts": time.time(),
+            "rooms": patches,
+            "removed": removed,
+        }
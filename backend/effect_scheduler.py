@@ -0,0 +1,159 @@
+import heapq
+import itertools
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+# 可随时间撤销的效果类型
+CONVERSION_OFFSET = "conversion_offset"  # 转化率加减（conversion_boost / conversion_penalty）
+SALES_MULTIPLIER = "sales_multiplier"  # 单个商品的销量倍数（product_sales_multiplier）
+
+# 转化率（叠加事件偏移后）的取值范围，Python tick、数组引擎和事件触发共用
+MIN_CONVERSION_RATE = 0.0
+MAX_CONVERSION_RATE = 1.0
+
+
+def clamp_conversion_rate(rate):
+    """Bound a conversion rate, or a NumPy array of them, to the range every engine and event uses."""
+    if isinstance(rate, np.ndarray):
+        return np.clip(rate, MIN_CONVERSION_RATE, MAX_CONVERSION_RATE)
+    return min(MAX_CONVERSION_RATE, max(MIN_CONVERSION_RATE, rate))
+
+
+class ActiveEffect:
+    __slots__ = ("id", "room_id", "event_id", "event_name", "kind", "value", "product_id", "started_at", "expires_at")
+
+    def __init__(self, effect_id, room_id, event_id, event_name, kind, value, product_id, started_at, expires_at):
+        self.id = effect_id
+        self.room_id = room_id
+        self.event_id = event_id
+        self.event_name = event_name
+        self.kind = kind
+        self.value = value
+        self.product_id = product_id
+        self.started_at = started_at
+        self.expires_at = expires_at
+
+    def to_dict(self, now: float) -> Dict:
+        return {
+            "id": self.id,
+            "room_id": self.room_id,
+            "event_id": self.event_id,
+            "event_name": self.event_name,
+            "kind": self.kind,
+            "value": self.value,
+            "product_id": self.product_id,
+            "remaining": max(0.0, self.expires_at - now),
+        }
+
+
+class ActiveEffects:
+    """Timed event effects with a min-heap of expiry times.
+
+    ``expire`` pops only the effects whose deadline has passed, so a tick
+    costs O(k log n) for k expiring effects no matter how many are still
+    waiting. The combined effect per room (conversion offset) and per
+    product (sales multiplier) is kept up to date on add and expiry, so
+    the simulation reads it with a dict lookup.
+
+    When ``track_changes`` is set, the keys whose combined value changed
+    are recorded until ``drain_changes`` is called, which lets an
+    array-backed engine patch only those entries.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._heap: List[Tuple[float, int, ActiveEffect]] = []
+        self._ids = itertools.count(1)
+        self._effects: Dict[int, ActiveEffect] = {}
+        self._by_key: Dict[Tuple, Dict[int, float]] = {}
+        self.conversion_offsets: Dict[str, float] = {}
+        self.sales_multipliers: Dict[Tuple[str, str], float] = {}
+        self.track_changes = False
+        self._changed_rooms: Set[str] = set()
+        self._changed_products: Set[Tuple[str, str]] = set()
+
+    def __len__(self):
+        return len(self._effects)
+
+    def add(
+        self,
+        room_id: str,
+        event_id: str,
+        event_name: str,
+        kind: str,
+        value: float,
+        duration: float,
+        product_id: Optional[str] = None,
+    ) -> ActiveEffect:
+        now = self.clock()
+        effect = ActiveEffect(next(self._ids), room_id, event_id, event_name, kind, value, product_id, now, now + duration)
+        self._effects[effect.id] = effect
+        heapq.heappush(self._heap, (effect.expires_at, effect.id, effect))
+        self._by_key.setdefault(self._key(effect), {})[effect.id] = value
+        self._recompute(effect)
+        return effect
+
+    def expire(self, now: Optional[float] = None) -> List[ActiveEffect]:
+        """Remove and return every effect whose expiry time has passed."""
+        now = self.clock() if now is None else now
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            _, effect_id, effect = heapq.heappop(self._heap)
+            if self._effects.pop(effect_id, None) is None:
+                continue
+            values = self._by_key[self._key(effect)]
+            del values[effect_id]
+            if not values:
+                del self._by_key[self._key(effect)]
+            self._recompute(effect)
+            expired.append(effect)
+        return expired
+
+    def conversion_offset(self, room_id: str) -> float:
+        return self.conversion_offsets.get(room_id, 0.0)
+
+    def sales_multiplier(self, room_id: str, product_id: str) -> float:
+        return self.sales_multipliers.get((room_id, product_id), 1.0)
+
+    def active(self, room_id: Optional[str] = None) -> List[Dict]:
+        now = self.clock()
+        return [
+            effect.to_dict(now)
+            for effect in self._effects.values()
+            if room_id is None or effect.room_id == room_id
+        ]
+
+    def drain_changes(self) -> Tuple[Set[str], Set[Tuple[str, str]]]:
+        rooms, products = self._changed_rooms, self._changed_products
+        self._changed_rooms, self._changed_products = set(), set()
+        return rooms, products
+
+    @staticmethod
+    def _key(effect: ActiveEffect) -> Tuple:
+        if effect.kind == SALES_MULTIPLIER:
+            return (SALES_MULTIPLIER, effect.room_id, effect.product_id)
+        return (effect.kind, effect.room_id)
+
+    def _recompute(self, effect: ActiveEffect):
+        # 同一直播间/商品上的多个效果：转化率偏移相加，销量倍数相乘
+        values = self._by_key.get(self._key(effect), {})
+        if effect.kind == SALES_MULTIPLIER:
+            key = (effect.room_id, effect.product_id)
+            if values:
+                multiplier = 1.0
+                for value in values.values():
+                    multiplier *= value
+                self.sales_multipliers[key] = multiplier
+            else:
+                self.sales_multipliers.pop(key, None)
+            if self.track_changes:
+                self._changed_products.add(key)
+        else:
+            if values:
+                self.conversion_offsets[effect.room_id] = sum(values.values())
+            else:
+                self.conversion_offsets.pop(effect.room_id, None)
+            if self.track_changes:
+                self._changed_rooms.add(effect.room_id)
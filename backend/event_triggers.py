@@ -1,9 +1,12 @@
 import random
-from datetime import datetime, timedelta
+from datetime import timedelta
 from typing import Dict, List, Optional, Any
 
 from pydantic import BaseModel
 
+from effect_scheduler import CONVERSION_OFFSET, SALES_MULTIPLIER, clamp_conversion_rate
+from replay import clock
+
 
 class EventTrigger(BaseModel):
     id: str
@@ -121,11 +124,12 @@ def get_all_events():
     return PREDEFINED_EVENTS
 
 
+# 按 id 索引的事件注册表
+EVENTS_BY_ID: Dict[str, EventTrigger] = {event.id: event for event in PREDEFINED_EVENTS}
+
+
 def get_event_by_id(event_id: str) -> Optional[EventTrigger]:
-    for event in PREDEFINED_EVENTS:
-        if event.id == event_id:
-            return event
-    return None
+    return EVENTS_BY_ID.get(event_id)
 
 
 # 仓库管理策略
@@ -158,15 +162,30 @@ LOGISTICS_METHODS = [
 ]
 
 
-def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs):
-    """Apply the effects of an event to a live room and generate appropriate logs"""
+def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs, active_effects=None, rng=random):
+    """Apply the effects of an event to a live room and generate appropriate logs
+
+    Conversion and sales-multiplier effects are also registered with
+    ``active_effects`` (an ``ActiveEffects`` scheduler) so the simulation
+    keeps applying them for ``duration`` seconds and then reverts them.
+    Viewer and stock changes are one-off and are not reverted.
+
+    Random draws come from ``rng`` (the ``random`` module by default) and
+    timestamps from the shared simulation clock, so seeded replays
+    reproduce the same logs. The logs are appended to ``agent_logs`` and
+    returned; only the ones created by this call are returned.
+    """
     
     effects = event.effects
     room_id = live_room.id
+    duration = effects.get("duration", 0)
+    timed = active_effects is not None and duration > 0
+    # 本次调用生成的日志，只返回这些，而不是共享日志存储末尾的条目
+    event_logs = []
     
     # Create log entry for the event
     log = {
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": clock.now().isoformat(),
         "room_id": room_id,
         "room_name": live_room.name,
         "action_type": "事件触发",
@@ -175,12 +194,12 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
         "color": "green" if event.type == "positive" else "red",
     }
     
-    agent_logs.append(log)
+    event_logs.append(log)
     
     # Apply viewer changes
     if "viewers_change" in effects:
         min_change, max_change = effects["viewers_change"]
-        viewer_change = random.randint(min_change, max_change)
+        viewer_change = rng.randint(min_change, max_change)
         live_room.viewers = max(100, live_room.viewers + viewer_change)
         
         # Log the viewer change
@@ -188,7 +207,7 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
         abs_change = abs(viewer_change)
         
         log = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": clock.now().isoformat(),
             "room_id": room_id,
             "room_name": live_room.name,
             "action_type": "观众变化",
@@ -196,17 +215,17 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
             "impact": f"当前观众数：{live_room.viewers}人",
             "color": "green" if viewer_change > 0 else "red",
         }
-        agent_logs.append(log)
+        event_logs.append(log)
         
         # 添加库存预测行为 - 观众变化触发
         if viewer_change > 2000:  # 大量观众涌入
             # 智能库存预测
-            strategy = random.choice(INVENTORY_STRATEGIES)
-            warehouse = random.choice(WAREHOUSE_LOCATIONS)
-            predicted_sales_increase = round(viewer_change * random.uniform(0.01, 0.05))
+            strategy = rng.choice(INVENTORY_STRATEGIES)
+            warehouse = rng.choice(WAREHOUSE_LOCATIONS)
+            predicted_sales_increase = round(viewer_change * rng.uniform(0.01, 0.05))
             
             log = {
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": clock.now().isoformat(),
                 "room_id": room_id,
                 "room_name": live_room.name,
                 "action_type": "库存预测",
@@ -214,15 +233,17 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
                 "impact": f"预计销量增加{predicted_sales_increase}件，已通知{warehouse}备货",
                 "color": "blue",
             }
-            agent_logs.append(log)
+            event_logs.append(log)
     
     # Apply conversion rate changes
     if "conversion_boost" in effects:
         boost = effects["conversion_boost"]
-        live_room.conversion_rate = min(0.2, live_room.conversion_rate + boost)
+        live_room.conversion_rate = clamp_conversion_rate(live_room.conversion_rate + boost)
+        if timed:
+            active_effects.add(room_id, event.id, event.name, CONVERSION_OFFSET, boost, duration)
         
         log = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": clock.now().isoformat(),
             "room_id": room_id,
             "room_name": live_room.name,
             "action_type": "转化率提升",
@@ -230,33 +251,35 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
             "impact": f"当前转化率：{live_room.conversion_rate*100:.1f}%",
             "color": "green",
         }
-        agent_logs.append(log)
+        event_logs.append(log)
         
         # 添加库存管理行为 - 转化率提升触发
         if boost >= 0.03:  # 显著转化率提升
-            strategy = random.choice(INVENTORY_STRATEGIES)
+            strategy = rng.choice(INVENTORY_STRATEGIES)
             for product in live_room.products[:2]:  # 对前两个产品进行库存调整
-                restock_amount = random.randint(100, 300)
-                eta_minutes = random.randint(15, 45)
-                eta_time = (datetime.now() + timedelta(minutes=eta_minutes)).strftime("%H:%M")
+                restock_amount = rng.randint(100, 300)
+                eta_minutes = rng.randint(15, 45)
+                eta_time = (clock.now() + timedelta(minutes=eta_minutes)).strftime("%H:%M")
                 
                 log = {
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": clock.now().isoformat(),
                     "room_id": room_id,
                     "room_name": live_room.name,
                     "action_type": "库存管理",
-                    "message": f"启动「{strategy}」，为{product['name']}增调{restock_amount}件库存",
+                    "message": f"启动「{strategy}」，为{product.name}增调{restock_amount}件库存",
                     "impact": f"预计{eta_time}前到达，确保直播间持续销售",
                     "color": "teal",
                 }
-                agent_logs.append(log)
+                event_logs.append(log)
     
     if "conversion_penalty" in effects:
         penalty = effects["conversion_penalty"]
-        live_room.conversion_rate = max(0.01, live_room.conversion_rate - penalty)
+        live_room.conversion_rate = clamp_conversion_rate(live_room.conversion_rate - penalty)
+        if timed:
+            active_effects.add(room_id, event.id, event.name, CONVERSION_OFFSET, -penalty, duration)
         
         log = {
-            "timestamp": datetime.now().isoformat(),
+            "timestamp": clock.now().isoformat(),
             "room_id": room_id,
             "room_name": live_room.name,
             "action_type": "转化率下降",
@@ -264,13 +287,13 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
             "impact": f"当前转化率：{live_room.conversion_rate*100:.1f}%",
             "color": "red",
         }
-        agent_logs.append(log)
+        event_logs.append(log)
         
         # 添加库存调整行为 - 转化率下降触发
         if penalty >= 0.03:  # 显著转化率下降
-            strategy = random.choice(INVENTORY_STRATEGIES)
+            strategy = rng.choice(INVENTORY_STRATEGIES)
             log = {
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": clock.now().isoformat(),
                 "room_id": room_id,
                 "room_name": live_room.name,
                 "action_type": "库存调整",
@@ -278,94 +301,94 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
                 "impact": f"暂缓部分商品补货计划，避免库存积压",
                 "color": "purple",
             }
-            agent_logs.append(log)
+            event_logs.append(log)
     
     # Apply stock changes
     if "stock_reduction" in effects:
         reduction_factor = effects["stock_reduction"]
         
         for product in live_room.products:
-            if product["stock_status"] == "充足":  # Only affect products with sufficient stock
-                original_stock = product["stock"]
-                product["stock"] = max(10, int(product["stock"] * (1 - reduction_factor)))
+            if product.stock_status == "充足":  # Only affect products with sufficient stock
+                original_stock = product.stock
+                product.stock = max(10, int(product.stock * (1 - reduction_factor)))
                 
                 # Update stock status
-                stock_percentage = product["stock"] / product["initial_stock"]
+                stock_percentage = product.stock / product.initial_stock
                 if stock_percentage < 0.1:
-                    product["stock_status"] = "告急"
+                    product.stock_status = "告急"
                 elif stock_percentage < 0.3:
-                    product["stock_status"] = "紧张"
+                    product.stock_status = "紧张"
                 
                 log = {
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": clock.now().isoformat(),
                     "room_id": room_id,
                     "room_name": live_room.name,
                     "action_type": "库存预警",
-                    "message": f"{product['name']} 库存急剧减少，从{original_stock}降至{product['stock']}",
-                    "impact": f"库存状态更新为：{product['stock_status']}",
+                    "message": f"{product.name} 库存急剧减少，从{original_stock}降至{product.stock}",
+                    "impact": f"库存状态更新为：{product.stock_status}",
                     "color": "red",
                 }
-                agent_logs.append(log)
+                event_logs.append(log)
                 
                 # 增强的AI仓库管理响应
-                if product["stock_status"] == "告急":
+                if product.stock_status == "告急":
                     # 选择策略和仓库
-                    strategy = random.choice(INVENTORY_STRATEGIES)
-                    warehouse = random.choice(WAREHOUSE_LOCATIONS)
-                    logistics = random.choice(LOGISTICS_METHODS)
+                    strategy = rng.choice(INVENTORY_STRATEGIES)
+                    warehouse = rng.choice(WAREHOUSE_LOCATIONS)
+                    logistics = rng.choice(LOGISTICS_METHODS)
                     
                     # 第一步：紧急调货
-                    restock_amount = random.randint(100, 500)
-                    eta_minutes = random.randint(15, 45)
-                    eta_time = (datetime.now() + timedelta(minutes=eta_minutes)).strftime("%H:%M")
+                    restock_amount = rng.randint(100, 500)
+                    eta_minutes = rng.randint(15, 45)
+                    eta_time = (clock.now() + timedelta(minutes=eta_minutes)).strftime("%H:%M")
                     
                     log = {
-                        "timestamp": datetime.now().isoformat(),
+                        "timestamp": clock.now().isoformat(),
                         "room_id": room_id,
                         "room_name": live_room.name,
                         "action_type": "紧急调货",
-                        "message": f"AI Agent启动「{strategy}」，从{warehouse}紧急调拨{product['name']} {restock_amount}件",
+                        "message": f"AI Agent启动「{strategy}」，从{warehouse}紧急调拨{product.name} {restock_amount}件",
                         "impact": f"通过{logistics}配送，预计{eta_time}前到达",
                         "color": "blue",
                     }
-                    agent_logs.append(log)
+                    event_logs.append(log)
                     
                     # 第二步：库存预测和长期计划
-                    future_days = random.randint(3, 7)
-                    future_stock = random.randint(500, 2000)
+                    future_days = rng.randint(3, 7)
+                    future_stock = rng.randint(500, 2000)
                     
                     log = {
-                        "timestamp": datetime.now().isoformat(),
+                        "timestamp": clock.now().isoformat(),
                         "room_id": room_id,
                         "room_name": live_room.name,
                         "action_type": "库存规划",
-                        "message": f"AI分析近期{product['name']}销售趋势，制定{future_days}天补货计划",
+                        "message": f"AI分析近期{product.name}销售趋势，制定{future_days}天补货计划",
                         "impact": f"已向供应商下单{future_stock}件，优化库存结构，防止再次短缺",
                         "color": "purple",
                     }
-                    agent_logs.append(log)
+                    event_logs.append(log)
                     
                     # 更新产品库存
-                    product["stock"] += restock_amount
+                    product.stock += restock_amount
                     
-                elif product["stock_status"] == "紧张":
+                elif product.stock_status == "紧张":
                     # 库存紧张但未告急的处理
-                    strategy = random.choice(INVENTORY_STRATEGIES)
-                    warehouse = random.choice(WAREHOUSE_LOCATIONS)
+                    strategy = rng.choice(INVENTORY_STRATEGIES)
+                    warehouse = rng.choice(WAREHOUSE_LOCATIONS)
                     
-                    restock_amount = random.randint(50, 200)
-                    product["stock"] += restock_amount
+                    restock_amount = rng.randint(50, 200)
+                    product.stock += restock_amount
                     
                     log = {
-                        "timestamp": datetime.now().isoformat(),
+                        "timestamp": clock.now().isoformat(),
                         "room_id": room_id,
                         "room_name": live_room.name,
                         "action_type": "库存补充",
-                        "message": f"AI Agent检测到{product['name']}库存偏低，启动「{strategy}」",
+                        "message": f"AI Agent检测到{product.name}库存偏低，启动「{strategy}」",
                         "impact": f"从{warehouse}调拨{restock_amount}件，确保销售持续性",
                         "color": "teal",
                     }
-                    agent_logs.append(log)
+                    event_logs.append(log)
     
     # Apply product sales multiplier
     if "product_sales_multiplier" in effects:
@@ -373,11 +396,13 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
         
         # Select a random product to boost
         if live_room.products:
-            product = random.choice(live_room.products)
-            product_name = product["name"]
+            product = rng.choice(live_room.products)
+            product_name = product.name
+            if timed:
+                active_effects.add(room_id, event.id, event.name, SALES_MULTIPLIER, multiplier, duration, product.id)
             
             log = {
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": clock.now().isoformat(),
                 "room_id": room_id,
                 "room_name": live_room.name,
                 "action_type": "销售预测",
@@ -385,13 +410,13 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
                 "impact": "AI Agent建议增加库存并提高曝光",
                 "color": "green",
             }
-            agent_logs.append(log)
+            event_logs.append(log)
             
             # 增强的AI营销和库存响应
             # 第一步：营销策略
-            discount = random.randint(5, 15)
+            discount = rng.randint(5, 15)
             log = {
-                "timestamp": datetime.now().isoformat(),
+                "timestamp": clock.now().isoformat(),
                 "room_id": room_id,
                 "room_name": live_room.name,
                 "action_type": "营销策略",
@@ -399,22 +424,22 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
                 "impact": "预计将进一步提升销量和转化率",
                 "color": "teal",
             }
-            agent_logs.append(log)
+            event_logs.append(log)
             
             # 第二步：库存准备
-            strategy = random.choice(INVENTORY_STRATEGIES)
-            warehouse = random.choice(WAREHOUSE_LOCATIONS)
-            logistics = random.choice(LOGISTICS_METHODS)
+            strategy = rng.choice(INVENTORY_STRATEGIES)
+            warehouse = rng.choice(WAREHOUSE_LOCATIONS)
+            logistics = rng.choice(LOGISTICS_METHODS)
             
             # 计算需要的库存量
-            predicted_sales = int(product["sales"] * multiplier * random.uniform(1.2, 2.0))
-            current_stock = product["stock"]
+            predicted_sales = int(product.sales * multiplier * rng.uniform(1.2, 2.0))
+            current_stock = product.stock
             
             if predicted_sales > current_stock:
                 needed_stock = predicted_sales - current_stock
                 
                 log = {
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": clock.now().isoformat(),
                     "room_id": room_id,
                     "room_name": live_room.name,
                     "action_type": "库存调度",
@@ -422,14 +447,14 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
                     "impact": f"启动「{strategy}」，从{warehouse}紧急调拨{needed_stock}件",
                     "color": "blue",
                 }
-                agent_logs.append(log)
+                event_logs.append(log)
                 
                 # 第三步：多仓协同
-                secondary_warehouse = random.choice([w for w in WAREHOUSE_LOCATIONS if w != warehouse])
-                secondary_amount = int(needed_stock * random.uniform(0.3, 0.5))
+                secondary_warehouse = rng.choice([w for w in WAREHOUSE_LOCATIONS if w != warehouse])
+                secondary_amount = int(needed_stock * rng.uniform(0.3, 0.5))
                 
                 log = {
-                    "timestamp": datetime.now().isoformat(),
+                    "timestamp": clock.now().isoformat(),
                     "room_id": room_id,
                     "room_name": live_room.name,
                     "action_type": "多仓协同",
@@ -437,9 +462,11 @@ def apply_event_effects(event: EventTrigger, live_room, global_stats, agent_logs
                     "impact": f"通过{logistics}加急配送，确保爆款商品充足供应",
                     "color": "purple",
                 }
-                agent_logs.append(log)
+                event_logs.append(log)
                 
                 # 更新产品库存
-                product["stock"] += (needed_stock + secondary_amount)
+                product.stock += (needed_stock + secondary_amount)
     
-    return agent_logs[-8:]  # Return the last 8 logs generated 
\ No newline at end of file
+    for log in event_logs:
+        agent_logs.append(log)
+    return event_logs
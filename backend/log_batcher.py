@@ -0,0 +1,66 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+class AgentLogBatcher:
+    """Collects agent logs and emits them in batches.
+
+    Logs added with ``add``/``extend`` are held until ``flush`` is awaited
+    (the simulation does this once per tick), ``max_size`` logs are pending,
+    or ``max_delay`` seconds have passed since the first pending log,
+    whichever comes first. Each emission carries at most ``max_size`` logs,
+    so the number of packets depends on tick rate, not on room count.
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[List[Dict]], Awaitable[None]],
+        max_size: int = 200,
+        max_delay: float = 0.5,
+    ):
+        if max_size <= 0:
+            raise ValueError("max_size must be positive")
+        self._emit = emit
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._pending: List[Dict] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, log: Dict):
+        self._pending.append(log)
+        self._schedule()
+
+    def extend(self, logs: List[Dict]):
+        self._pending.extend(logs)
+        self._schedule()
+
+    def _schedule(self):
+        if not self._pending:
+            return
+        loop = asyncio.get_running_loop()
+        if len(self._pending) >= self.max_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._start_flush)
+
+    def _start_flush(self):
+        self._timer = None
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """Emit everything pending, in chunks of at most ``max_size`` logs."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch = self._pending[:self.max_size]
+            del self._pending[:self.max_size]
+            try:
+                await self._emit(batch)
+            except Exception as e:
+                print(f"Error emitting agent log batch: {e}")
@@ -0,0 +1,168 @@
+from typing import Dict, Hashable, Iterator, List, Optional, Sequence, Tuple
+
+
+class _SeqIndex:
+    """Ordered list of log sequence numbers with O(1) amortized eviction from the head."""
+
+    __slots__ = ("seqs", "start")
+
+    def __init__(self):
+        self.seqs: List[int] = []
+        self.start = 0
+
+    def append(self, seq: int):
+        self.seqs.append(seq)
+
+    def evict(self, seq: int):
+        if self.start < len(self.seqs) and self.seqs[self.start] == seq:
+            self.start += 1
+            # 头部空洞过半时压缩一次，保持内存与存活条目数成正比
+            if self.start >= 64 and self.start * 2 >= len(self.seqs):
+                del self.seqs[:self.start]
+                self.start = 0
+
+    def __len__(self):
+        return len(self.seqs) - self.start
+
+
+class AgentLogStore:
+    """Fixed-capacity ring buffer of agent logs with secondary indexes.
+
+    Logs are kept in append order, which is also timestamp order, so time
+    ranges are found by binary search. Lookups by ``room_id``,
+    ``action_type`` or both go through per-key indexes of sequence numbers,
+    making a query cost O(log n + result size). Once ``capacity`` logs are
+    stored, each append evicts the oldest log and its index entries, so
+    memory stays flat however long the stream runs.
+
+    The store supports ``append``, ``len`` and list-style indexing/slicing
+    (``store[-50:]``) so it can be passed wherever a plain list was used.
+
+    ``append`` also stamps each log with a ``seq`` field, one above the
+    highest seen so far (``last_seq``). Logs that already carry one (mirrored
+    from the simulation owner or restored from a snapshot) keep it, so the
+    numbering stays the same on every worker and across owner changes.
+    """
+
+    def __init__(self, capacity: int = 10000):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._slots: List[Optional[Dict]] = [None] * capacity
+        self._next_seq = 0
+        self.last_seq = -1
+        self._by_room: Dict[Hashable, _SeqIndex] = {}
+        self._by_action: Dict[Hashable, _SeqIndex] = {}
+        self._by_room_action: Dict[Hashable, _SeqIndex] = {}
+
+    @property
+    def _oldest_seq(self) -> int:
+        return max(0, self._next_seq - self.capacity)
+
+    def _index_keys(self, log: Dict) -> Iterator[Tuple[Dict[Hashable, _SeqIndex], Hashable]]:
+        room_id = log.get("room_id")
+        action_type = log.get("action_type")
+        yield self._by_room, room_id
+        yield self._by_action, action_type
+        yield self._by_room_action, (room_id, action_type)
+
+    def append(self, log: Dict):
+        seq = self._next_seq
+        slot = seq % self.capacity
+
+        evicted = self._slots[slot]
+        if evicted is not None:
+            evicted_seq = seq - self.capacity
+            for index, key in self._index_keys(evicted):
+                entries = index.get(key)
+                if entries is not None:
+                    entries.evict(evicted_seq)
+                    if not entries:
+                        del index[key]
+
+        if "seq" in log:
+            self.last_seq = max(self.last_seq, log["seq"])
+        else:
+            self.last_seq += 1
+            log["seq"] = self.last_seq
+
+        self._slots[slot] = log
+        for index, key in self._index_keys(log):
+            entries = index.get(key)
+            if entries is None:
+                entries = index[key] = _SeqIndex()
+            entries.append(seq)
+        self._next_seq += 1
+
+    def _get(self, seq: int) -> Dict:
+        return self._slots[seq % self.capacity]
+
+    def __len__(self):
+        return self._next_seq - self._oldest_seq
+
+    def __iter__(self):
+        for seq in range(self._oldest_seq, self._next_seq):
+            yield self._get(seq)
+
+    def __getitem__(self, key):
+        seqs = range(self._oldest_seq, self._next_seq)[key]
+        if isinstance(key, slice):
+            return [self._get(seq) for seq in seqs]
+        return self._get(seqs)
+
+    def tail(self, limit: int) -> List[Dict]:
+        if limit <= 0:
+            return []
+        return self[-limit:]
+
+    def query(
+        self,
+        room_id: Optional[str] = None,
+        action_type: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: int = 50,
+    ) -> List[Dict]:
+        """Return up to ``limit`` of the newest matching logs, oldest first.
+
+        ``since``/``until`` are ISO timestamps compared against the log
+        ``timestamp`` field (inclusive on both ends).
+        """
+        if limit <= 0:
+            return []
+
+        seqs: Sequence[int]
+        if room_id is not None and action_type is not None:
+            index = self._by_room_action.get((room_id, action_type))
+        elif room_id is not None:
+            index = self._by_room.get(room_id)
+        elif action_type is not None:
+            index = self._by_action.get(action_type)
+        else:
+            index = None
+
+        if index is not None:
+            seqs, lo, hi = index.seqs, index.start, len(index.seqs)
+        elif room_id is None and action_type is None:
+            seqs, lo, hi = range(self._oldest_seq, self._next_seq), 0, len(self)
+        else:
+            return []
+
+        if since is not None:
+            lo = self._bisect_time(seqs, lo, hi, since, inclusive=False)
+        if until is not None:
+            hi = self._bisect_time(seqs, lo, hi, until, inclusive=True)
+
+        start = max(lo, hi - limit)
+        return [self._get(seqs[i]) for i in range(start, hi)]
+
+    def _bisect_time(self, seqs: Sequence[int], lo: int, hi: int, timestamp: str, inclusive: bool) -> int:
+        # inclusive=False: 第一个 timestamp >= 目标 的位置；inclusive=True: 第一个 timestamp > 目标 的位置
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self._get(seqs[mid])["timestamp"]
+            if value < timestamp or (inclusive and value == timestamp):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
@@ -1,25 +1,50 @@
 import asyncio
+import bisect
+import itertools
 import json
 import random
 import time
 import signal
 import sys
+import tempfile
+import uuid
 from datetime import datetime
 from typing import Dict, List, Optional
 
 import socketio
 import uvicorn
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, field_serializer
 from fastapi.staticfiles import StaticFiles
 import os
 
 # Import event triggers
 from event_triggers import get_all_events, get_event_by_id, apply_event_effects
+from delta_sync import ROOM_FIELDS, RoomChanges, RoomDeltaEncoder
+from log_store import AgentLogStore
+from log_batcher import AgentLogBatcher
+from effect_scheduler import CONVERSION_OFFSET, ActiveEffects, clamp_conversion_rate
+from tick_scheduler import SKIP, TickScheduler
+from sharded_engine import ShardedSimulation
+from vector_engine import VectorizedSimulation
+from timeseries_store import METRICS as HISTORY_METRICS, TimeSeriesStore
+from replay import EventTimeline, RandomStreams, clock
+from rolling_aggregates import WINDOW_FIELDS, LiveAggregates
+from anomaly_detector import AnomalyDetector
+from products import PRODUCT_FIELDS, TICK_PRODUCT_FIELDS, Product
+from state_snapshot import (
+    SNAPSHOT_RESTORE_SECONDS, SNAPSHOT_SECONDS, capture_state, paused_gc, read_snapshot, write_snapshot,
+)
+from subscriptions import ALL_ROOMS_CHANNEL, GLOBAL_CHANNEL, SubscriptionRegistry, binary_channel, room_channel
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, SIZE_BUCKETS, registry as metrics
+from message_bus import LocalBroker, OwnerLock, bus_kind, create_client_manager, create_state_bus, local_socket_path
+from wire_codec import MSGPACK_ENCODING, PROTOCOL_STRINGS, WireCodec, negotiate_encoding
 
 # Import chat router
 from app.routers import chat as chat_router # Assuming chat.py is in backend/app/routers/
+from app.chat_context import ChatContextBuilder
 
 # Initialize FastAPI app
 app = FastAPI(title="LivePulse.AI - Live Stream Sales Management")
@@ -39,14 +64,70 @@ app.add_middleware(
 # Include chat router
 app.include_router(chat_router.router, prefix="/api")
 
+# 运行指标，/metrics 以 Prometheus 文本格式输出
+TICK_DURATION = metrics.histogram(
+    "livepulse_tick_duration_seconds", "Duration of one simulate_data tick, split by phase", ("phase",)
+)
+EMIT_SERIALIZE_SECONDS = metrics.histogram(
+    "livepulse_emit_serialize_seconds", "Time spent serializing one emitted payload", ("event", "encoding")
+)
+EMIT_PAYLOAD_BYTES = metrics.histogram(
+    "livepulse_emit_payload_bytes", "Size of one emitted payload", ("event", "encoding"), buckets=SIZE_BUCKETS
+)
+EVENT_LOOP_LAG = metrics.histogram(
+    "livepulse_event_loop_lag_seconds", "How late a periodic event loop wake-up ran"
+)
+EVENT_APPLY_SECONDS = metrics.histogram(
+    "livepulse_event_apply_seconds", "Latency of apply_event_effects per event", ("event_id",)
+)
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", "0.5"))
+
+
+class InstrumentedJSON:
+    """``json`` stand-in handed to python-socketio so packet serialization is measured where it happens"""
+
+    loads = staticmethod(json.loads)
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        start = time.perf_counter()
+        text = json.dumps(obj, *args, **kwargs)
+        elapsed = time.perf_counter() - start
+        # 事件包为 [event, payload]；二进制包的 JSON 部分只是占位符，由 emit_to_channel 单独统计
+        if isinstance(obj, list) and obj and isinstance(obj[0], str):
+            payload = obj[1] if len(obj) > 1 else None
+            if not (isinstance(payload, dict) and payload.get("_placeholder")):
+                EMIT_SERIALIZE_SECONDS.observe(elapsed, event=obj[0], encoding="json")
+                EMIT_PAYLOAD_BYTES.observe(len(text), event=obj[0], encoding="json")
+        return text
+
+
+# 多进程模式：MESSAGE_BUS_URL 为 redis://...、local:///path/to.sock 或 memory://（测试用）
+# 持有文件锁的 worker 运行模拟，其余 worker 通过总线镜像状态并转发事件触发
+MESSAGE_BUS_URL = os.getenv("MESSAGE_BUS_URL")
+SIMULATION_LOCK_FILE = os.getenv(
+    "SIMULATION_LOCK_FILE", os.path.join(tempfile.gettempdir(), "livepulse-simulation.lock")
+)
+OWNER_RETRY_SECONDS = float(os.getenv("OWNER_RETRY_SECONDS", "2"))
+BUS_REQUEST_TIMEOUT = float(os.getenv("BUS_REQUEST_TIMEOUT", "5"))
+# 跟随者每 1/3 TTL 重发一次订阅兴趣，所有者丢弃超过 TTL 未刷新的（worker 已退出）
+BUS_INTEREST_TTL = float(os.getenv("BUS_INTEREST_TTL", "30"))
+state_bus = create_state_bus(MESSAGE_BUS_URL)
+owner_lock = OwnerLock(SIMULATION_LOCK_FILE) if state_bus is not None else None
+local_broker = None
+# 单进程模式下本进程即为模拟所有者
+is_simulation_owner = state_bus is None
+
 # Initialize Socket.IO server
 sio = socketio.AsyncServer(
+    client_manager=create_client_manager(MESSAGE_BUS_URL),
     async_mode="asgi",
     cors_allowed_origins="*",
     ping_timeout=20,
     ping_interval=25,
     max_http_buffer_size=1000000,
     always_connect=True,
+    json=InstrumentedJSON,
     logger=True,
     engineio_logger=True
 )
@@ -63,6 +144,8 @@ if os.path.exists(frontend_build_dir):
 
 # Data models
 class LiveRoom(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     id: str
     name: str
     host_name: str
@@ -70,21 +153,105 @@ class LiveRoom(BaseModel):
     sales: float = 0
     conversion_rate: float = 0
     health_status: str = "green"  # green, yellow, red
-    products: List[Dict] = []
+    products: List[Product] = []
     start_time: Optional[str] = None
+    windows: Dict[str, Dict[str, float]] = {}  # 滑动窗口销售额 / 转化数，按窗口标签（1m、5m）
+
+    @field_serializer("products")
+    def serialize_products(self, products: List[Product]) -> List[Dict]:
+        # 对外仍是商品字典
+        return [product.to_dict() for product in products]
 
 
+# 确定性回放：SIMULATION_SEED 为每个直播间派生独立随机流并改用模拟时钟（每个 tick 前进一个周期）；
+# SIMULATION_ACCELERATED 不等待直接连续运行 tick；SIMULATION_TIMELINE 为按模拟秒数触发的事件时间线（JSON）
+SIMULATION_SEED = os.getenv("SIMULATION_SEED")
+SIMULATION_ACCELERATED = os.getenv("SIMULATION_ACCELERATED", "false").lower() in ("1", "true", "yes")
+SIMULATION_START = os.getenv("SIMULATION_START")  # 模拟时钟起点（ISO 8601），默认当前时间
+SIMULATION_TIMELINE = os.getenv("SIMULATION_TIMELINE")
+SIMULATION_DURATION_SECONDS = float(os.getenv("SIMULATION_DURATION_SECONDS", "0"))  # 模拟时长，0 表示一直运行
+random_streams = RandomStreams(int(SIMULATION_SEED) if SIMULATION_SEED else None)
+clock.configure(
+    simulated=random_streams.seeded or SIMULATION_ACCELERATED,
+    start=datetime.fromisoformat(SIMULATION_START).timestamp() if SIMULATION_START else None,
+)
+event_timeline = EventTimeline.load(SIMULATION_TIMELINE) if SIMULATION_TIMELINE else None
+
 # In-memory data store
 live_rooms: Dict[str, LiveRoom] = {}
-agent_logs: List[Dict] = []
+# 环形缓冲区保存最近的 Agent 日志，容量可通过 AGENT_LOG_CAPACITY 配置
+agent_logs = AgentLogStore(capacity=int(os.getenv("AGENT_LOG_CAPACITY", "10000")))
 global_stats = {
     "total_sales": 0,
     "total_profit": 0,
     "active_rooms": 0,
     "inventory_health": "green",
-    "start_time": datetime.now().isoformat(),
+    "start_time": clock.now().isoformat(),
 }
 
+# 模拟规模与引擎：python（逐房间循环）、vectorized（NumPy 批量计算）或 sharded（多进程分片）
+SIMULATION_ROOMS = int(os.getenv("SIMULATION_ROOMS", "5"))
+SIMULATION_PRODUCTS_PER_ROOM = int(os.getenv("SIMULATION_PRODUCTS_PER_ROOM", "0"))  # 0 表示每个直播间随机 3-6 个商品
+SIMULATION_ENGINE = os.getenv("SIMULATION_ENGINE", "python")
+SIMULATION_SHARDS = int(os.getenv("SIMULATION_SHARDS", "0"))  # sharded 引擎的进程数，0 表示 CPU 核数
+simulation_engine = None
+
+# tick 频率与超时策略（skip / catch_up）；Python 引擎每处理这么多直播间让出一次事件循环
+SIMULATION_TICK_SECONDS = float(os.getenv("SIMULATION_TICK_SECONDS", "2"))
+SIMULATION_TICK_POLICY = os.getenv("SIMULATION_TICK_POLICY", SKIP)
+SIMULATION_MAX_CATCH_UP = int(os.getenv("SIMULATION_MAX_CATCH_UP", "3"))
+SIMULATION_SLICE_ROOMS = max(1, int(os.getenv("SIMULATION_SLICE_ROOMS", "500")))
+tick_scheduler = None
+
+# 直播间与商品指标的历史时间序列（按时间滚动的列式分段文件），HISTORY_DIR 为空时关闭
+HISTORY_DIR = os.getenv("HISTORY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "history"))
+HISTORY_SEGMENT_SECONDS = float(os.getenv("HISTORY_SEGMENT_SECONDS", "3600"))
+HISTORY_RETENTION_HOURS = float(os.getenv("HISTORY_RETENTION_HOURS", "24"))
+# 预计算的汇总层级（秒），查询按请求的分辨率选用最粗的合适层级
+HISTORY_ROLLUPS = tuple(float(width) for width in os.getenv("HISTORY_ROLLUPS", "10,60,600").split(",") if width.strip())
+HISTORY_DEFAULT_WINDOW_SECONDS = float(os.getenv("HISTORY_DEFAULT_WINDOW_SECONDS", "3600"))
+history_store = None
+
+# 状态快照：定期保存直播间、全局统计与最近日志，启动时优先从快照恢复；SNAPSHOT_PATH 为空时关闭
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "snapshot.msgpack"))
+SNAPSHOT_INTERVAL_SECONDS = float(os.getenv("SNAPSHOT_INTERVAL_SECONDS", "30"))
+SNAPSHOT_LOGS = int(os.getenv("SNAPSHOT_LOGS", "1000"))
+
+# 记录已广播给客户端的直播间状态，每个 tick 只发送变化的字段
+room_delta_encoder = RoomDeltaEncoder()
+# 自上次广播以来改动过的直播间与商品，广播时只比对这些
+room_changes = RoomChanges()
+
+# 带持续时间的事件效果（转化率偏移、商品销量倍数），到期自动撤销
+active_effects = ActiveEffects(clock=clock.monotonic)
+
+# 滑动窗口聚合：直播间、商品与全局最近 ROLLING_WINDOWS 秒的销售额与转化数，随销售增量更新
+ROLLING_WINDOWS = tuple(int(window) for window in os.getenv("ROLLING_WINDOWS", "60,300").split(",") if window.strip())
+ROLLING_BUCKET_SECONDS = float(os.getenv("ROLLING_BUCKET_SECONDS", "10"))
+live_aggregates = LiveAggregates(ROLLING_WINDOWS, ROLLING_BUCKET_SECONDS, clock=clock.monotonic)
+
+# 流式异常检测：直播间观众数变化、单 tick 销售额与商品库存变化的 EWMA 均值 / 方差，|z| 超过阈值生成异常流量日志
+anomaly_detector = AnomalyDetector(
+    alpha=float(os.getenv("ANOMALY_ALPHA", "0.1")),
+    threshold=float(os.getenv("ANOMALY_Z_THRESHOLD", "4")),
+    warmup=int(os.getenv("ANOMALY_WARMUP_TICKS", "10")),
+    cooldown=int(os.getenv("ANOMALY_COOLDOWN_TICKS", "5")),
+)
+
+# 聊天提示词所需的数据摘要，由每个 tick 的增量更新维护，挂到 app.state 供 chat 路由读取
+chat_context = ChatContextBuilder(
+    global_stats,
+    token_budget=int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "1200")),
+    max_rooms=int(os.getenv("CHAT_CONTEXT_MAX_ROOMS", "20")),
+)
+app.state.chat_context = chat_context
+
+# 客户端按直播间订阅，只推送其关注的直播间数据与日志
+subscriptions = SubscriptionRegistry()
+
+# 每个客户端在 connect 时协商的负载编码（json / msgpack）
+client_encodings: Dict[str, str] = {}
+
 
 # WebSocket connection manager
 class ConnectionManager:
@@ -125,6 +292,15 @@ class ConnectionManager:
 
 manager = ConnectionManager()
 
+metrics.gauge(
+    "livepulse_socketio_clients", "Connected Socket.IO clients by payload encoding", ("encoding",),
+    callback=lambda: {
+        (encoding,): sum(1 for value in client_encodings.values() if value == encoding)
+        for encoding in ("json", MSGPACK_ENCODING)
+    },
+)
+metrics.gauge("livepulse_ws_clients", "Connected /ws clients", callback=lambda: manager.connection_count)
+
 
 # API Routes
 @app.get("/")
@@ -144,9 +320,107 @@ async def get_live_room(room_id: str):
     return live_rooms[room_id]
 
 
+@app.get("/live-rooms/{room_id}/history")
+async def get_room_history(
+    room_id: str,
+    metrics: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    resolution: Optional[float] = None,
+    max_points: int = 360,
+):
+    """Time-bucketed min/max/avg/last of a room's viewers, sales and conversion rate"""
+    return await query_history({
+        "table": "rooms", "room_id": room_id, "metrics": metrics,
+        "since": since, "until": until, "resolution": resolution, "max_points": max_points,
+    })
+
+
+@app.get("/live-rooms/{room_id}/products/{product_id}/history")
+async def get_product_history(
+    room_id: str,
+    product_id: str,
+    metrics: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    resolution: Optional[float] = None,
+    max_points: int = 360,
+):
+    """Time-bucketed min/max/avg/last of a product's stock and sales"""
+    return await query_history({
+        "table": "products", "room_id": room_id, "product_id": product_id, "metrics": metrics,
+        "since": since, "until": until, "resolution": resolution, "max_points": max_points,
+    })
+
+
+async def query_history(args: Dict):
+    """Validate a history request and run it against the store off the event loop"""
+    if not is_simulation_owner:
+        return await forward_to_owner("history", args)
+    if history_store is None:
+        return {"error": "History is disabled"}
+    table, room_id, product_id = args["table"], args["room_id"], args.get("product_id")
+    room = live_rooms.get(room_id)
+    if room is None:
+        return {"error": "Room not found"}
+    if product_id is not None and not any(product.id == product_id for product in room.products):
+        return {"error": "Product not found"}
+
+    requested = [metric.strip() for metric in (args.get("metrics") or "").split(",") if metric.strip()]
+    unknown = [metric for metric in requested if metric not in HISTORY_METRICS[table]]
+    if unknown:
+        return {"error": f"Unknown metrics {unknown}, expected some of {list(HISTORY_METRICS[table])}"}
+    try:
+        until = datetime.fromisoformat(args["until"]).timestamp() if args.get("until") else clock.time()
+        since = (
+            datetime.fromisoformat(args["since"]).timestamp() if args.get("since")
+            else until - HISTORY_DEFAULT_WINDOW_SECONDS
+        )
+    except ValueError:
+        return {"error": "Invalid timestamp, expected ISO 8601"}
+    if since >= until:
+        return {"error": "since must be earlier than until"}
+    resolution = args.get("resolution") or (until - since) / max(1, args.get("max_points") or 360)
+    if resolution <= 0:
+        return {"error": "resolution must be positive"}
+
+    result = await asyncio.get_running_loop().run_in_executor(None, lambda: history_store.query(
+        table, room_id, product_id, requested or None, start=since, end=until, resolution=resolution,
+    ))
+    response = {"room_id": room_id}
+    if product_id is not None:
+        response["product_id"] = product_id
+    response.update(
+        since=datetime.fromtimestamp(since).isoformat(),
+        until=datetime.fromtimestamp(until).isoformat(),
+        resolution=result["resolution"],
+        source=result["source"],
+        timestamps=[datetime.fromtimestamp(ts).isoformat() for ts in result["timestamps"]],
+        series=result["series"],
+    )
+    return response
+
+
 @app.get("/agent-logs")
-async def get_agent_logs(limit: int = 50):
-    return agent_logs[-limit:]
+async def get_agent_logs(
+    limit: int = 50,
+    room_id: Optional[str] = None,
+    action_type: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    try:
+        since = datetime.fromisoformat(since).isoformat() if since else None
+        until = datetime.fromisoformat(until).isoformat() if until else None
+    except ValueError:
+        return {"error": "Invalid timestamp, expected ISO 8601"}
+    return agent_logs.query(room_id=room_id, action_type=action_type, since=since, until=until, limit=limit)
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus text exposition of the server's runtime metrics"""
+    return PlainTextResponse(metrics.render(), media_type=METRICS_CONTENT_TYPE)
 
 
 @app.get("/global-stats")
@@ -160,9 +434,52 @@ async def get_events():
     return get_all_events()
 
 
+@app.get("/active-effects")
+async def get_active_effects(room_id: Optional[str] = None):
+    """List timed event effects that are still in force"""
+    if not is_simulation_owner:
+        return await forward_to_owner("active_effects", {"room_id": room_id})
+    return active_effects.active(room_id)
+
+
+def apply_event(event, room_id: str) -> List[Dict]:
+    """Apply one event to one room and return its logs, without broadcasting anything"""
+    room = live_rooms[room_id]
+    viewers = room.viewers
+    with EVENT_APPLY_SECONDS.time(event_id=event.id):
+        raw_event_logs = apply_event_effects(
+            event, room, global_stats, agent_logs, active_effects, rng=random_streams.stream("events")
+        )
+    live_aggregates.record_viewers(room.viewers - viewers)
+    room_changes.mark_room(room_id)
+    if simulation_engine is not None:
+        simulation_engine.mark_dirty(room_id)
+    
+    processed_event_logs = []
+    if raw_event_logs: # Ensure there are logs to process
+        for log_entry in raw_event_logs:
+            # Assuming log_entry is a dict. If it's an object, attribute access would be needed.
+            # This modification will affect the log_entry in the global agent_logs list
+            # if apply_event_effects appends references to the same objects it returns.
+            log_entry['source'] = 'triggered_event_effect'
+            processed_event_logs.append(log_entry)
+    return processed_event_logs
+
+
+async def broadcast_event_results(event_logs: List[Dict]):
+    """One coalesced state + log broadcast after any number of applied events"""
+    await broadcast_room_updates()
+    await broadcast_global_stats()
+    if event_logs:
+        log_batcher.extend(event_logs)
+        await log_batcher.flush()
+
+
 @app.post("/trigger-event/{event_id}")
 async def trigger_event(event_id: str, room_id: str = None):
     """Trigger a specific event in a specific room or random room"""
+    if not is_simulation_owner:
+        return await forward_to_owner("trigger_event", {"event_id": event_id, "room_id": room_id})
     event = get_event_by_id(event_id)
     if not event:
         return {"error": "Event not found"}
@@ -172,30 +489,46 @@ async def trigger_event(event_id: str, room_id: str = None):
     
     # If no room_id specified, choose a random room
     if not room_id:
-        room_id = random.choice(list(live_rooms.keys()))
+        room_id = random_streams.stream("events").choice(list(live_rooms.keys()))
     
     room = live_rooms[room_id]
     
-    # Apply the event effects
-    raw_event_logs = apply_event_effects(event, room, global_stats, agent_logs)
+    # Apply the event effects, then emit the updated data and logs
+    event_logs = apply_event(event, room_id)
+    await broadcast_event_results(event_logs)
     
-    processed_event_logs = []
-    if raw_event_logs: # Ensure there are logs to process
-        for log_entry in raw_event_logs:
-            # Assuming log_entry is a dict. If it's an object, attribute access would be needed.
-            # This modification will affect the log_entry in the global agent_logs list
-            # if apply_event_effects appends references to the same objects it returns.
-            log_entry['source'] = 'triggered_event_effect'
-            processed_event_logs.append(log_entry)
+    return {"success": True, "message": f"Event '{event.name}' triggered in room '{room.name}'"}
+
+
+class EventTriggerRequest(BaseModel):
+    event_id: str
+    room_id: Optional[str] = None  # None 表示随机选择直播间
+
+
+@app.post("/trigger-events")
+async def trigger_events(requests: List[EventTriggerRequest]):
+    """Trigger many events at once, broadcasting the resulting state a single time"""
+    if not is_simulation_owner:
+        return await forward_to_owner("trigger_events", {"requests": [request.model_dump() for request in requests]})
+    room_ids = list(live_rooms.keys())
+    results = []
+    event_logs = []
+    for request in requests:
+        event = get_event_by_id(request.event_id)
+        if not event:
+            results.append({"event_id": request.event_id, "room_id": request.room_id, "error": "Event not found"})
+            continue
+        if request.room_id and request.room_id not in live_rooms:
+            results.append({"event_id": request.event_id, "room_id": request.room_id, "error": "Room not found"})
+            continue
+        room_id = request.room_id or random_streams.stream("events").choice(room_ids)
+        event_logs.extend(apply_event(event, room_id))
+        results.append({"event_id": event.id, "room_id": room_id, "success": True})
     
-    # Emit the updated data and logs
-    await sio.emit("live_rooms", [room.model_dump() for room in live_rooms.values()])
-    await sio.emit("global_stats", global_stats)
-    if processed_event_logs:
-        for log in processed_event_logs:
-            await sio.emit("agent_log", log)
+    await broadcast_event_results(event_logs)
     
-    return {"success": True, "message": f"Event '{event.name}' triggered in room '{room.name}'"}
+    triggered = sum(1 for result in results if result.get("success"))
+    return {"success": triggered > 0, "triggered": triggered, "results": results}
 
 
 # WebSocket endpoint for real-time updates
@@ -210,39 +543,373 @@ async def websocket_endpoint(websocket: WebSocket):
         manager.disconnect(websocket)
 
 
+async def emit_to_channel(event: str, payload, channel: str):
+    """Emit to the JSON and MessagePack variants of a channel, encoding each only if someone listens"""
+    if subscriptions.has_subscribers(channel):
+        await sio.emit(event, payload, room=channel)
+    encoded_channel = binary_channel(channel)
+    if subscriptions.has_subscribers(encoded_channel):
+        await sio.emit(event, encode_msgpack(event, payload), room=encoded_channel)
+
+
+async def emit_to_client(sid: str, event: str, payload):
+    if client_encodings.get(sid) == MSGPACK_ENCODING:
+        payload = encode_msgpack(event, payload)
+    await sio.emit(event, payload, to=sid)
+
+
+def encode_msgpack(event: str, payload) -> bytes:
+    start = time.perf_counter()
+    data = wire_codec.encode(payload)
+    EMIT_SERIALIZE_SECONDS.observe(time.perf_counter() - start, event=event, encoding=MSGPACK_ENCODING)
+    EMIT_PAYLOAD_BYTES.observe(len(data), event=event, encoding=MSGPACK_ENCODING)
+    return data
+
+
+def client_channel(sid: str, channel: str) -> str:
+    return binary_channel(channel) if client_encodings.get(sid) == MSGPACK_ENCODING else channel
+
+
+async def join_channel(sid: str, channel: str):
+    channel = client_channel(sid, channel)
+    if subscriptions.subscribe(sid, channel):
+        await sio.enter_room(sid, channel)
+        await publish_interest()
+
+
+async def leave_channel(sid: str, channel: str):
+    channel = client_channel(sid, channel)
+    if subscriptions.unsubscribe(sid, channel):
+        await sio.leave_room(sid, channel)
+        await publish_interest()
+
+
+async def emit_log_batch(batch: List[Dict]):
+    chat_context.note_logs(batch)
+    await emit_to_channel("agent_logs_batch", batch, ALL_ROOMS_CHANNEL)
+
+    # 按直播间拆分，只发给订阅了该直播间的客户端
+    logs_by_room: Dict[str, List[Dict]] = {}
+    for log in batch:
+        logs_by_room.setdefault(log.get("room_id"), []).append(log)
+    for room_id in subscriptions.watched_rooms(logs_by_room):
+        await emit_to_channel("agent_logs_batch", logs_by_room[room_id], room_channel(room_id))
+    await publish_state({"type": "logs", "logs": batch})
+
+
+# 每个 tick / 事件产生的日志合并为一次 agent_logs_batch 推送
+log_batcher = AgentLogBatcher(
+    emit_log_batch,
+    max_size=int(os.getenv("AGENT_LOG_BATCH_SIZE", "200")),
+    max_delay=float(os.getenv("AGENT_LOG_BATCH_DELAY", "0.5")),
+)
+
+
+async def broadcast_room_updates():
+    """Emit only the rooms and product fields that changed since the last broadcast"""
+    delta = room_delta_encoder.diff(live_rooms, room_changes)
+    if not delta:
+        return
+    chat_context.apply_delta(delta)
+    await publish_state({"type": "delta", "delta": delta})
+    await emit_to_channel("live_rooms_delta", delta, ALL_ROOMS_CHANNEL)
+    for room_id in subscriptions.watched_rooms(delta["rooms"]):
+        await emit_to_channel("room_delta", room_delta_encoder.room_delta(room_id, delta), room_channel(room_id))
+
+
+async def broadcast_global_stats():
+    await publish_state({"type": "global_stats", "global_stats": global_stats})
+    await emit_to_channel("global_stats", global_stats, GLOBAL_CHANNEL)
+
+
 # Socket.IO events
 @sio.event
-async def connect(sid, environ):
-    print(f"Client connected: {sid}")
-    # Send initial data
-    await sio.emit('live_rooms', [room.model_dump() for room in live_rooms.values()], to=sid)
-    await sio.emit('global_stats', global_stats, to=sid)
-    await sio.emit('agent_logs', agent_logs[-50:], to=sid)  # Send last 50 logs
+async def connect(sid, environ, auth=None):
+    # 默认 JSON；客户端可在 auth 或查询参数中声明 encoding=msgpack 改用二进制编码
+    encoding = negotiate_encoding(environ, auth)
+    client_encodings[sid] = encoding
+    print(f"Client connected: {sid} (encoding: {encoding})")
+    if encoding == MSGPACK_ENCODING:
+        # 字符串表本身以 JSON 发送，客户端据此解码后续的二进制负载
+        await sio.emit('wire_string_table', wire_codec.table(), to=sid)
+    # 所有客户端都接收 global_stats；直播间数据需通过 subscribe 订阅
+    await join_channel(sid, GLOBAL_CHANNEL)
+    await emit_to_client(sid, 'global_stats', global_stats)
+
+
+def _requested_room_ids(data) -> List[str]:
+    if not isinstance(data, dict):
+        return []
+    room_ids = data.get("room_ids") or []
+    if isinstance(room_ids, str):
+        room_ids = [room_ids]
+    return [room_id for room_id in room_ids if isinstance(room_id, str)]
+
+
+@sio.event
+async def subscribe(sid, data=None):
+    """Subscribe to all rooms (``{"all": true}``) or to specific rooms (``{"room_ids": [...]}``)"""
+    data = data or {}
+    if data.get("all"):
+        await join_channel(sid, ALL_ROOMS_CHANNEL)
+        await emit_to_client(sid, 'live_rooms_snapshot', room_delta_encoder.snapshot())
+        await emit_to_client(sid, 'agent_logs', agent_logs.tail(50))  # Send last 50 logs
+
+    for room_id in _requested_room_ids(data):
+        if room_id not in live_rooms:
+            continue
+        await join_channel(sid, room_channel(room_id))
+        snapshot = room_delta_encoder.room_snapshot(room_id)
+        if snapshot:
+            await emit_to_client(sid, 'room_snapshot', snapshot)
+        await emit_to_client(sid, 'agent_logs', agent_logs.query(room_id=room_id, limit=50))
+
+
+@sio.event
+async def unsubscribe(sid, data=None):
+    data = data or {}
+    if data.get("all"):
+        await leave_channel(sid, ALL_ROOMS_CHANNEL)
+    for room_id in _requested_room_ids(data):
+        await leave_channel(sid, room_channel(room_id))
+
+
+@sio.event
+async def resync(sid, data=None):
+    # 客户端检测到 seq 断档时请求完整快照
+    room_id = data.get("room_id") if isinstance(data, dict) else None
+    if room_id:
+        snapshot = room_delta_encoder.room_snapshot(room_id)
+        if snapshot:
+            await emit_to_client(sid, 'room_snapshot', snapshot)
+    else:
+        await emit_to_client(sid, 'live_rooms_snapshot', room_delta_encoder.snapshot())
 
 
 @sio.event
 async def disconnect(sid):
+    subscriptions.drop(sid)
+    client_encodings.pop(sid, None)
+    await publish_interest()
     print(f"Client disconnected: {sid}")
 
 
+# Multi-worker mode
+# 所有者：运行模拟，把每次广播的 delta / global_stats / 日志发布到总线，并执行转发来的命令
+# 跟随者：用总线消息镜像 live_rooms、global_stats、agent_logs，为本进程的客户端和 REST 读取提供一致的状态
+pending_replies: Dict[str, asyncio.Future] = {}
+published_interest: Optional[set] = None
+published_interest_at = 0.0
+
+
+async def publish_state(message: Dict):
+    if state_bus is not None and is_simulation_owner:
+        await state_bus.publish(message)
+
+
+async def publish_interest(force: bool = False):
+    """Tell the owner which channels this worker's clients watch, whenever that set changes (or ``force``)"""
+    global published_interest, published_interest_at
+    if state_bus is None or is_simulation_owner:
+        return
+    channels = subscriptions.local_channels()
+    if force or channels != published_interest:
+        published_interest = channels
+        published_interest_at = time.monotonic()
+        await state_bus.publish({"type": "interest", "channels": sorted(channels)})
+
+
+async def forward_to_owner(command: str, args: Dict):
+    """Run a command on the simulation owner and return its result"""
+    request_id = uuid.uuid4().hex
+    future = asyncio.get_running_loop().create_future()
+    pending_replies[request_id] = future
+    try:
+        await state_bus.publish({"type": "command", "command": command, "args": args, "request_id": request_id})
+        return await asyncio.wait_for(future, timeout=BUS_REQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        return {"error": "Simulation owner did not respond"}
+    finally:
+        pending_replies.pop(request_id, None)
+
+
+async def run_owner_command(command: str, args: Dict):
+    if command == "trigger_event":
+        return await trigger_event(args["event_id"], args.get("room_id"))
+    if command == "trigger_events":
+        return await trigger_events([EventTriggerRequest(**request) for request in args["requests"]])
+    if command == "active_effects":
+        return active_effects.active(args.get("room_id"))
+    if command == "history":
+        return await query_history(args)
+    return {"error": f"Unknown command '{command}'"}
+
+
+async def publish_snapshot():
+    await publish_state({
+        "type": "snapshot",
+        "snapshot": room_delta_encoder.snapshot(),
+        "room_seqs": room_delta_encoder.room_seqs(),
+        "global_stats": global_stats,
+        "logs": agent_logs.tail(int(os.getenv("BUS_SYNC_LOGS", "200"))),
+    })
+
+
+def mirror_delta(delta: Dict):
+    """Apply an owner delta (already applied to room_delta_encoder) to the mirrored LiveRoom objects"""
+    for room_id in delta["rooms"]:
+        room = room_delta_encoder.room_state(room_id)
+        room["products"] = [Product.from_dict(product) for product in room["products"]]
+        live_rooms[room_id] = LiveRoom.model_construct(**room)
+    for room_id in delta.get("removed", []):
+        live_rooms.pop(room_id, None)
+    chat_context.apply_delta(delta)
+
+
+def mirror_logs(logs: List[Dict]):
+    # 按所有者分配的 seq 去重：模拟时钟下同一时间戳的日志很多，时间戳无法区分
+    latest = agent_logs.last_seq
+    new_logs = [log for log in logs if log["seq"] > latest]
+    for log in new_logs:
+        agent_logs.append(log)
+    chat_context.note_logs(new_logs)
+
+
+async def handle_owner_message(message: Dict):
+    kind = message.get("type")
+    if kind == "command":
+        result = await run_owner_command(message["command"], message.get("args") or {})
+        await publish_state({
+            "type": "reply", "request_id": message["request_id"], "result": result,
+        })
+    elif kind == "interest":
+        subscriptions.set_remote(message["worker"], message.get("channels") or ())
+    elif kind == "sync_request":
+        subscriptions.set_remote(message["worker"], message.get("channels") or ())
+        await publish_snapshot()
+    elif kind == "worker_stopped":
+        subscriptions.drop_remote(message["worker"])
+
+
+async def handle_follower_message(message: Dict):
+    kind = message.get("type")
+    if kind == "delta":
+        delta = message["delta"]
+        if delta["base_seq"] != room_delta_encoder.seq:
+            # 漏掉了增量（刚启动或总线重连），请求完整快照
+            await request_sync()
+            return
+        room_delta_encoder.apply(delta)
+        mirror_delta(delta)
+    elif kind == "snapshot":
+        mirror_delta(room_delta_encoder.load(message["snapshot"], message.get("room_seqs")))
+        global_stats.clear()
+        global_stats.update(message["global_stats"])
+        mirror_logs(message.get("logs") or [])
+    elif kind == "global_stats":
+        global_stats.clear()
+        global_stats.update(message["global_stats"])
+    elif kind == "logs":
+        mirror_logs(message["logs"])
+    elif kind == "reply":
+        future = pending_replies.get(message["request_id"])
+        if future is not None and not future.done():
+            future.set_result(message["result"])
+    elif kind in ("bus_connected", "owner_changed"):
+        await request_sync()
+
+
+async def request_sync():
+    global published_interest, published_interest_at
+    published_interest = subscriptions.local_channels()
+    published_interest_at = time.monotonic()
+    await state_bus.publish({"type": "sync_request", "channels": sorted(published_interest)})
+
+
+async def listen_state_bus():
+    async for message in state_bus.listen():
+        try:
+            if is_simulation_owner:
+                await handle_owner_message(message)
+            else:
+                await handle_follower_message(message)
+        except Exception as e:
+            print(f"Error handling bus message {message.get('type')}: {e}")
+
+
+async def become_simulation_owner():
+    global is_simulation_owner, local_broker
+    if bus_kind(MESSAGE_BUS_URL) == "local":
+        local_broker = LocalBroker(local_socket_path(MESSAGE_BUS_URL))
+        await local_broker.start()
+    is_simulation_owner = True
+    print(f"This worker (pid {os.getpid()}) now owns the simulation.")
+    app.state.simulation_task = asyncio.create_task(simulate_data())
+    await state_bus.publish({"type": "owner_changed"})
+
+
+async def run_cluster():
+    """Claim the simulation lock when it is free; until then run as a follower"""
+    # 监听器订阅完成后收到 bus_connected，再请求快照，确保不会错过所有者的回复
+    app.state.bus_listener_task = asyncio.create_task(listen_state_bus())
+    while running:
+        if not is_simulation_owner and owner_lock.acquire():
+            await become_simulation_owner()
+        if is_simulation_owner:
+            for worker in subscriptions.expire_remote(BUS_INTEREST_TTL):
+                print(f"[BUS] Dropped subscriptions of worker {worker} (no refresh in {BUS_INTEREST_TTL:g}s)")
+        elif time.monotonic() - published_interest_at >= BUS_INTEREST_TTL / 3:
+            await publish_interest(force=True)
+        await asyncio.sleep(OWNER_RETRY_SECONDS)
+
+
+async def leave_cluster():
+    """Let the owner drop this worker's subscriptions right away instead of waiting for them to expire"""
+    if state_bus is None or is_simulation_owner:
+        return
+    try:
+        await state_bus.publish({"type": "worker_stopped"})
+    except Exception as e:
+        print(f"Error announcing worker shutdown: {e}")
+
+
 # Data simulation functions
-def generate_random_product(product_id: str, category: str) -> Dict:
-    # Define food-specific categories and names
-    food_categories = {
-        "snacks": ["什锦饼干礼盒", "进口巧克力", "网红辣条", "坚果大礼包", "薯片零食"],
-        "drinks": ["有机牛奶", "果汁饮料", "气泡水", "咖啡豆", "茶叶礼盒"],
-        "fresh": ["新鲜水果拼盘", "有机蔬菜", "生鲜海鲜", "冷鲜肉品", "乳制品"],
-        "instant": ["速食拌饭", "方便面", "即食麦片", "速食汤品", "冻干食品"],
-        "specialty": ["手工水饺", "风味香肠", "地方特产", "传统糕点", "调味酱料"]
-    }
-    
+# Define food-specific categories and names
+FOOD_CATEGORIES = {
+    "snacks": ["什锦饼干礼盒", "进口巧克力", "网红辣条", "坚果大礼包", "薯片零食"],
+    "drinks": ["有机牛奶", "果汁饮料", "气泡水", "咖啡豆", "茶叶礼盒"],
+    "fresh": ["新鲜水果拼盘", "有机蔬菜", "生鲜海鲜", "冷鲜肉品", "乳制品"],
+    "instant": ["速食拌饭", "方便面", "即食麦片", "速食汤品", "冻干食品"],
+    "specialty": ["手工水饺", "风味香肠", "地方特产", "传统糕点", "调味酱料"]
+}
+
+# Food-specific attributes
+PRODUCT_SIZES = ["小份", "标准", "家庭装", "派对装", "礼盒装"]
+PRODUCT_FLAVORS = ["原味", "香辣", "海苔", "芝士", "五香", "咖喱", "酱香", "甜辣", "麻辣", "清淡"]
+
+# Food-themed room names
+FOOD_ROOM_THEMES = [
+    "深夜食堂 - 宵夜美食汇",
+    "环球零食发现之旅",
+    "健康轻食料理坊",
+    "烘焙甜蜜时光屋",
+    "妈妈的味道 - 家常菜精选"
+]
+
+# Virtual host names themed around food
+VIRTUAL_HOST_NAMES = [
+    "食神小当家",
+    "味蕾探险家Alice",
+    "美食达人小K",
+    "烹饪大师阿福",
+    "甜点魔法师Lila"
+]
+
+
+def generate_random_product(product_id: str, category: str, rng=random) -> Product:
     # Select a random subcategory and its items
-    subcategory = random.choice(list(food_categories.keys()))
-    product_names = food_categories[subcategory]
-    
-    # Food-specific attributes
-    sizes = ["小份", "标准", "家庭装", "派对装", "礼盒装"]
-    flavors = ["原味", "香辣", "海苔", "芝士", "五香", "咖喱", "酱香", "甜辣", "麻辣", "清淡"]
+    subcategory = rng.choice(list(FOOD_CATEGORIES.keys()))
+    product_names = FOOD_CATEGORIES[subcategory]
     
     # Generate price and stock appropriate for food items
     base_price = {
@@ -254,231 +921,607 @@ def generate_random_product(product_id: str, category: str) -> Dict:
     }
     
     price_range = base_price.get(subcategory, (20, 100))
-    price = random.uniform(*price_range)
-    stock = random.randint(100, 1000)  # Food items typically need more stock
+    price = rng.uniform(*price_range)
+    stock = rng.randint(100, 1000)  # Food items typically need more stock
     
-    return {
-        "id": product_id,
-        "name": f"{random.choice(product_names)}",  # Remove the ID suffix for more natural names
-        "price": round(price, 2),
-        "original_price": round(price * random.uniform(1.1, 1.3), 2),
-        "stock": stock,
-        "initial_stock": stock,
-        "sales": 0,
-        "size": random.choice(sizes),
-        "color": random.choice(flavors),  # Using flavors instead of colors
-        "predicted_sales": 0,
-        "stock_status": "充足",
-        "ai_actions": [],
-    }
+    return Product(
+        id=product_id,
+        name=f"{rng.choice(product_names)}",  # Remove the ID suffix for more natural names
+        price=round(price, 2),
+        original_price=round(price * rng.uniform(1.1, 1.3), 2),
+        stock=stock,
+        initial_stock=stock,
+        sales=0,
+        size=rng.choice(PRODUCT_SIZES),
+        color=rng.choice(PRODUCT_FLAVORS),  # Using flavors instead of colors
+        predicted_sales=0,
+        stock_status="充足",
+    )
 
 
 def create_live_rooms():
-    # Food-themed room names
-    food_room_themes = [
-        "深夜食堂 - 宵夜美食汇",
-        "环球零食发现之旅",
-        "健康轻食料理坊",
-        "烘焙甜蜜时光屋",
-        "妈妈的味道 - 家常菜精选"
-    ]
-    
-    # Virtual host names themed around food
-    virtual_host_names = [
-        "食神小当家",
-        "味蕾探险家Alice",
-        "美食达人小K",
-        "烹饪大师阿福",
-        "甜点魔法师Lila"
-    ]
-    
-    for i in range(5):  # Create 5 live rooms
+    for i in range(SIMULATION_ROOMS):  # Create 5 live rooms by default
         room_id = f"room_{i+1}"
+        rng = random_streams.room(room_id)
         
-        # Each room gets a unique theme and host
-        room_name = food_room_themes[i]
-        host_name = virtual_host_names[i]
+        # Each room gets a unique theme and host; themes repeat with a suffix beyond the first 5
+        room_name = FOOD_ROOM_THEMES[i % len(FOOD_ROOM_THEMES)]
+        host_name = VIRTUAL_HOST_NAMES[i % len(VIRTUAL_HOST_NAMES)]
+        if i >= len(FOOD_ROOM_THEMES):
+            room_name = f"{room_name} #{i // len(FOOD_ROOM_THEMES) + 1}"
         
         # Generate 3-6 food products for each room
+        product_count = SIMULATION_PRODUCTS_PER_ROOM or rng.randint(3, 6)
         products = [
-            generate_random_product(f"prod_{i+1}_{j+1}", "food")
-            for j in range(random.randint(3, 6))
+            generate_random_product(f"prod_{i+1}_{j+1}", "food", rng)
+            for j in range(product_count)
         ]
         
         live_rooms[room_id] = LiveRoom(
             id=room_id,
             name=room_name,
             host_name=host_name,
-            viewers=random.randint(1000, 10000),
+            viewers=rng.randint(1000, 10000),
             sales=0,
-            conversion_rate=random.uniform(0.01, 0.05),
+            conversion_rate=rng.uniform(0.01, 0.05),
             health_status="green",
             products=products,
-            start_time=datetime.now().isoformat(),
+            start_time=clock.now().isoformat(),
         )
     
     global_stats["active_rooms"] = len(live_rooms)
 
 
+def capture_snapshot() -> Dict:
+    with SNAPSHOT_SECONDS.time(phase="capture"):
+        return capture_state(
+            list(live_rooms.values()),
+            [field for field in LiveRoom.model_fields if field != "products"],
+            PRODUCT_FIELDS,
+            global_stats,
+            agent_logs.tail(SNAPSHOT_LOGS),
+        )
+
+
+def restore_snapshot() -> bool:
+    """Load live rooms, global stats and recent logs from SNAPSHOT_PATH; False if there is nothing usable"""
+    if not SNAPSHOT_PATH or not os.path.exists(SNAPSHOT_PATH):
+        return False
+    start = time.perf_counter()
+    try:
+        state = read_snapshot(SNAPSHOT_PATH)
+    except Exception as e:
+        print(f"Could not read snapshot {SNAPSHOT_PATH}, creating new rooms: {e}")
+        return False
+    if not state["rooms"]:
+        return False
+
+    live_rooms.clear()
+    with paused_gc():
+        for room in state["rooms"]:
+            # 快照由本服务写出，跳过校验以加快恢复
+            room["products"] = [Product.from_dict(product) for product in room["products"]]
+            live_rooms[room["id"]] = LiveRoom.model_construct(**room)
+    global_stats.update(state["global_stats"])
+    global_stats["active_rooms"] = len(live_rooms)
+    for log in state["logs"]:
+        agent_logs.append(log)
+
+    elapsed = time.perf_counter() - start
+    SNAPSHOT_RESTORE_SECONDS.set(elapsed)
+    saved_at = datetime.fromtimestamp(state["saved_at"]).isoformat()
+    print(f"Restored {len(live_rooms)} rooms and {len(state['logs'])} logs from snapshot of {saved_at} in {elapsed * 1000:.0f} ms.")
+    return True
+
+
+# 后台线程中最近一次的快照写入；线程无法取消，关闭时要等它写完
+snapshot_write: Optional[asyncio.Future] = None
+
+
+async def save_snapshot():
+    global snapshot_write
+    state = capture_snapshot()
+    snapshot_write = asyncio.get_running_loop().run_in_executor(None, write_snapshot, SNAPSHOT_PATH, state)
+    # shield：取消 run_snapshots 时不取消这个 future，关闭流程仍能等到写入结束
+    await asyncio.shield(snapshot_write)
+
+
+async def stop_snapshots():
+    """Stop the periodic snapshots and wait for a write already running in the executor"""
+    task = getattr(app.state, "snapshot_task", None)
+    if task is not None:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        app.state.snapshot_task = None
+    if snapshot_write is not None:
+        try:
+            await snapshot_write
+        except Exception as e:
+            print(f"Error writing snapshot {SNAPSHOT_PATH}: {e}")
+
+
+async def run_snapshots():
+    """Snapshot the state every SNAPSHOT_INTERVAL_SECONDS; serialization and disk I/O run off the event loop"""
+    while running:
+        await asyncio.sleep(SNAPSHOT_INTERVAL_SECONDS)
+        try:
+            await save_snapshot()
+        except Exception as e:
+            print(f"Error writing snapshot {SNAPSHOT_PATH}: {e}")
+
+
+ACTION_COLORS = {
+    "销售预测": "green",
+    "库存预警": "orange",
+    "仓储管理": "blue",
+    "舆情分析": "purple",
+    "营销策略": "teal",
+    "异常流量": "red",
+}
+
+
 def generate_agent_log(room_id: str, action_type: str, message: str, impact: str = None):
     room = live_rooms.get(room_id)
     if not room:
         return
     
-    action_colors = {
-        "销售预测": "green",
-        "库存预警": "orange",
-        "仓储管理": "blue",
-        "舆情分析": "purple",
-        "营销策略": "teal",
-        "异常流量": "red",
-    }
-    
     log = {
-        "timestamp": datetime.now().isoformat(),
+        "timestamp": clock.now().isoformat(),
         "room_id": room_id,
         "room_name": room.name,
         "action_type": action_type,
         "message": message,
         "impact": impact,
-        "color": action_colors.get(action_type, "gray"),
+        "color": ACTION_COLORS.get(action_type, "gray"),
     }
     
     agent_logs.append(log)
     return log
 
 
-async def simulate_data():
-    global running
-    create_live_rooms()
+# AI 洞察日志模板：(action_type, message, impact)
+INSIGHT_TYPES = [
+    ("销售预测", "预计未来1小时销售额将增长20%", "销售预测调整"),
+    ("舆情分析", "直播间氛围活跃，用户评价正面", "直播间健康度保持绿色"),
+    ("营销策略", "建议开展限时促销活动", "预期提升转化率5%"),
+]
+
+# 仓储管理日志模板：(message 模板, impact)
+WAREHOUSE_ACTIONS = [
+    ("智能补货系统监测到 {} 库存水平健康，无需额外操作。", "库存状态良好"),
+    ("正在对 {} 的仓储流程进行例行优化检查。", "流程优化"),
+    ("AI分析了 {} 的出库效率，建议调整拣货路径。", "效率提升建议"),
+    ("根据销售趋势，已为 {} 预留额外存储空间。", "空间预留")
+]
+
+def build_wire_codec() -> WireCodec:
+    """String table for MessagePack clients: field names plus the vocabulary repeated every tick"""
+    codec = WireCodec(PROTOCOL_STRINGS)
+    codec.extend(ROOM_FIELDS)
+    codec.extend(PRODUCT_FIELDS)
+    codec.extend(global_stats)
+    codec.extend(("avg_conversion_rate", "green", "yellow", "red", "gray"))
+    codec.extend(("windows",) + live_aggregates.rooms.labels + WINDOW_FIELDS)
+    codec.extend(f"{field}_per_min" for field in WINDOW_FIELDS)
+    codec.extend(FOOD_ROOM_THEMES)
+    codec.extend(VIRTUAL_HOST_NAMES)
+    codec.extend(name for names in FOOD_CATEGORIES.values() for name in names)
+    codec.extend(PRODUCT_SIZES)
+    codec.extend(PRODUCT_FLAVORS)
+    codec.extend(("充足", "紧张", "告急"))
+    for action_type, color in ACTION_COLORS.items():
+        codec.extend((action_type, color))
+    for insight in INSIGHT_TYPES:
+        codec.extend(insight)
+    codec.extend(impact for _, impact in WAREHOUSE_ACTIONS)
+    codec.extend(("事件结束", "直播间转化率恢复正常", "商品销量恢复正常水平", "triggered_event_effect"))
+    return codec
+
+
+# 表在启动时固定，连接后的客户端拿到的下标始终有效
+wire_codec = build_wire_codec()
+
+
+def traffic_anomaly_log(room_id: str, z_score: float):
+    direction = "激增" if z_score > 0 else "骤降"
+    return generate_agent_log(
+        room_id,
+        "异常流量",
+        f"检测到直播间观众{direction}，偏离近期波动 z={z_score:+.1f}",
+        f"当前观众数：{live_rooms[room_id].viewers}人，AI助手正在分析原因"
+    )
+
+
+def sales_anomaly_log(room_id: str, z_score: float):
+    direction = "异常升高" if z_score > 0 else "骤降"
+    return generate_agent_log(
+        room_id,
+        "异常流量",
+        f"检测到直播间销售额{direction}，偏离近期波动 z={z_score:+.1f}",
+        f"累计销售额：¥{live_rooms[room_id].sales:.2f}，AI助手正在分析原因"
+    )
+
+
+def stock_anomaly_log(room_id: str, product: Product, z_score: float):
+    direction = "异常增加" if z_score > 0 else "异常减少"
+    return generate_agent_log(
+        room_id,
+        "异常流量",
+        f"{product.name} 库存{direction}，偏离近期波动 z={z_score:+.1f}",
+        f"当前库存：{product.stock}件"
+    )
+
+
+def stock_warning_log(room_id: str, product: Product):
+    if product.stock_status == "告急":
+        return generate_agent_log(
+            room_id,
+            "库存预警",
+            f"{product.name} 库存告急，仅剩{product.stock}件！",
+            "库存健康度调为红色"
+        )
+    return generate_agent_log(
+        room_id,
+        "库存预警",
+        f"{product.name} 库存偏低，当前{product.stock}件",
+        "建议及时补货以维持销售"
+    )
+
+
+def warehouse_log(room_id: str, product_name: str, action):
+    action_template, impact = action
+    return generate_agent_log(
+        room_id,
+        "仓储管理", # 确保 action_type 与前端 PREDEFINED_CATEGORIES 匹配
+        action_template.format(product_name),
+        impact
+    )
+
+
+def fire_timeline_events() -> List[Dict]:
+    """Apply the timeline events that are due at the current simulated time"""
+    if event_timeline is None:
+        return []
+    logs = []
+    for entry in event_timeline.due(clock.elapsed()):
+        event = get_event_by_id(entry["event_id"])
+        if not event:
+            print(f"Timeline event '{entry['event_id']}' not found, skipping")
+            continue
+        room_id = entry.get("room_id") or random_streams.stream("events").choice(list(live_rooms.keys()))
+        if room_id not in live_rooms:
+            print(f"Timeline room '{room_id}' not found, skipping event '{event.id}'")
+            continue
+        logs += apply_event(event, room_id)
+    return logs
+
+
+def expire_event_effects() -> List[Dict]:
+    """Revert timed event effects whose duration has passed, returning one log per expired effect"""
+    logs = []
+    for effect in active_effects.expire():
+        impact = "直播间转化率恢复正常" if effect.kind == CONVERSION_OFFSET else "商品销量恢复正常水平"
+        logs.append(generate_agent_log(
+            effect.room_id,
+            "事件结束",
+            f"事件「{effect.event_name}」的影响已结束",
+            impact,
+        ))
+    return [log for log in logs if log]
+
+
+def simulate_tick(room_ids: Optional[List[str]] = None) -> List[Dict]:
+    """Advance every room (or just ``room_ids``) by one tick with the per-room Python loop, returning the generated logs"""
+    logs = []
+    # 本批直播间的异常检测输入，循环结束后一次性检测
+    checked_ids = []
+    checked_rooms = []
+    room_amounts = []
+    stock = []
+    for room_id in live_rooms.keys() if room_ids is None else room_ids:
+        room = live_rooms.get(room_id)
+        if room is None:
+            continue
+        checked_ids.append(room_id)
+        checked_rooms.append(room)
+        room_changes.mark_fields(room_id)
+        rng = random_streams.room(room_id)
+        # Simulate viewer count changes
+        viewer_change = rng.randint(-100, 200)
+        viewers = room.viewers
+        room.viewers = max(100, room.viewers + viewer_change)
+        live_aggregates.record_viewers(room.viewers - viewers)
+        
+        # Simulate product sales
+        room_conversions = 0
+        room_amount = 0.0
+        for product in room.products:
+            if product.stock > 0:
+                status = product.stock_status
+                sales_count = rng.randint(0, 3)
+                if active_effects.sales_multipliers:
+                    sales_count = int(sales_count * active_effects.sales_multiplier(room_id, product.id))
+                if sales_count > product.stock:
+                    sales_count = product.stock
+                
+                product.stock -= sales_count
+                product.sales += sales_count
+                sales_amount = sales_count * product.price
+                room.sales += sales_amount
+                if sales_count:
+                    live_aggregates.record_product_sale(room_id, product.id, sales_count, sales_amount)
+                    room_conversions += sales_count
+                    room_amount += sales_amount
+                global_stats["total_sales"] += sales_amount
+                global_stats["total_profit"] += sales_amount * 0.3  # Assume 30% profit margin
+                
+                # Update stock status
+                stock_percentage = product.stock / product.initial_stock
+                if stock_percentage < 0.1:
+                    product.stock_status = "告急"
+                    if rng.random() < 0.3:  # 30% chance to generate a warning
+                        logs.append(stock_warning_log(room_id, product))
+                elif stock_percentage < 0.3:
+                    product.stock_status = "紧张"
+                    if rng.random() < 0.2:  # 20% chance to generate a warning
+                        logs.append(stock_warning_log(room_id, product))
+                else:
+                    product.stock_status = "充足"
+                if sales_count or product.stock_status != status:
+                    room_changes.mark_product(room_id, product, TICK_PRODUCT_FIELDS)
+        
+        if room_conversions:
+            live_aggregates.record_room_sales(room_id, room_conversions, room_amount)
+        room_amounts.append(room_amount)
+        stock += [product.stock for product in room.products]
+
+        # Update room conversion rate（累计转化数增量维护，不再逐商品求和）
+        if room.viewers > 0:
+            total_sales = live_aggregates.room_conversions.get(room_id, 0)
+            room.conversion_rate = clamp_conversion_rate(
+                total_sales / room.viewers + active_effects.conversion_offset(room_id)
+            )
+        
+        # Generate AI insights
+        if rng.random() < 0.1:  # 10% chance to generate insights
+            logs.append(generate_agent_log(room_id, *rng.choice(INSIGHT_TYPES)))
+
+        # 模拟生成仓储管理相关的日志
+        if rng.random() < 0.08:  # 8% 的概率生成仓储管理日志
+            # 随机选择一个商品进行仓储管理日志生成
+            if room.products:
+                target_product_name = rng.choice(room.products).name
+                logs.append(warehouse_log(room_id, target_product_name, rng.choice(WAREHOUSE_ACTIONS)))
+
+    if checked_ids:
+        anomalies = anomaly_detector.check(
+            anomaly_detector.room_slots(checked_ids),
+            [room.viewers for room in checked_rooms],
+            room_amounts,
+            anomaly_detector.products_slots(checked_ids, checked_rooms),
+            stock,
+        )
+        product_ends = list(itertools.accumulate(len(room.products) for room in checked_rooms))
+
+        def product_at(index: int):
+            room_index = bisect.bisect_right(product_ends, index)
+            start = product_ends[room_index - 1] if room_index else 0
+            return checked_ids[room_index], checked_rooms[room_index].products[index - start]
+
+        logs += anomaly_logs(anomalies, checked_ids, product_at)
+    return [log for log in logs if log]
+
+
+def simulate_tick_vectorized(engine) -> List[Dict]:
+    """Advance every room by one tick with the NumPy engine, returning the generated logs"""
+    result = engine.tick()
+    engine.write_back()
+    changed = engine.changed_products
+    room_changes.mark_fields()
+    room_changes.mark_products(engine.products, engine.product_room_ids, changed, TICK_PRODUCT_FIELDS)
+    sold = engine.last_sold[changed]
+    live_aggregates.record_products(
+        engine, engine.products, engine.product_room_id, changed, sold, sold * engine.price[changed]
+    )
+    live_aggregates.set_totals(int(engine.viewers.sum()), float(engine.room_sales.sum()))
+
+    global_stats["total_sales"] += result.sales_amount
+    global_stats["total_profit"] += result.sales_amount * 0.3  # Assume 30% profit margin
+    return engine_tick_logs(engine, result)
+
+
+async def simulate_tick_sharded(engine) -> List[Dict]:
+    """Advance every shard by one tick and merge the shards' partial aggregates into global_stats"""
+    results = await engine.tick()
+    room_changes.mark_fields()
+    for shard, result in zip(engine.shards, results):
+        room_changes.mark_products(shard.products, shard.product_rooms, result.changed_products, TICK_PRODUCT_FIELDS)
+    for shard, (changed, sold, amounts) in zip(engine.shards, engine.tick_sales):
+        live_aggregates.record_products(shard.index, shard.products, shard.product_room_id, changed, sold, amounts)
+    live_aggregates.set_totals(engine.aggregates["viewers"], engine.aggregates["room_sales"])
+    sales_amount = engine.aggregates["sales_amount"]
+    global_stats["total_sales"] += sales_amount
+    global_stats["total_profit"] += sales_amount * 0.3  # Assume 30% profit margin
+
+    logs = []
+    for shard, result in zip(engine.shards, results):
+        logs += engine_tick_logs(shard, result)
+    return logs
+
+
+def engine_tick_logs(engine, result) -> List[Dict]:
+    """Build the logs for a tick result whose indexes point into ``engine.room_ids`` / ``engine.products``"""
+    logs = anomaly_logs(
+        result.anomalies, engine.room_ids, lambda index: (engine.product_room_id(index), engine.products[index])
+    )
+    for product_index in result.stock_warnings.tolist():
+        logs.append(stock_warning_log(engine.product_room_id(product_index), engine.products[product_index]))
+    for room_index, insight_index in zip(result.insight_rooms.tolist(), result.insight_choices.tolist()):
+        logs.append(generate_agent_log(engine.room_ids[room_index], *INSIGHT_TYPES[insight_index]))
+    for product_index, action_index in zip(result.warehouse_products.tolist(), result.warehouse_choices.tolist()):
+        logs.append(warehouse_log(
+            engine.product_room_id(product_index),
+            engine.products[product_index].name,
+            WAREHOUSE_ACTIONS[action_index],
+        ))
+    return [log for log in logs if log]
+
+
+def anomaly_logs(anomalies, room_ids: List[str], product_at) -> List[Dict]:
+    """Build the 异常流量 logs for ``anomalies``; ``product_at(index)`` returns the ``(room_id, product)`` of a product position"""
+    logs = []
+    for room_index, z_score in zip(anomalies.viewer_rooms.tolist(), anomalies.viewer_scores.tolist()):
+        logs.append(traffic_anomaly_log(room_ids[room_index], z_score))
+    for room_index, z_score in zip(anomalies.sales_rooms.tolist(), anomalies.sales_scores.tolist()):
+        logs.append(sales_anomaly_log(room_ids[room_index], z_score))
+    for product_index, z_score in zip(anomalies.stock_products.tolist(), anomalies.stock_scores.tolist()):
+        logs.append(stock_anomaly_log(*product_at(product_index), z_score))
+    return logs
+
+
+def history_values(engine) -> Optional[Dict]:
+    """The vectorized engine's arrays already hold this tick's metrics in live_rooms order"""
+    if not isinstance(engine, VectorizedSimulation) or engine.room_ids != list(live_rooms):
+        return None
+    return {
+        "viewers": engine.viewers,
+        "sales": engine.room_sales,
+        "conversion_rate": engine.conversion_rate,
+        "stock": engine.stock,
+        "product_sales": engine.sales,
+    }
+
+
+async def simulate_tick_sliced() -> List[Dict]:
+    """Run the Python tick a slice of rooms at a time, yielding to the event loop between slices"""
+    room_ids = list(live_rooms.keys())
+    logs = []
+    for start in range(0, len(room_ids), SIMULATION_SLICE_ROOMS):
+        logs += simulate_tick(room_ids[start:start + SIMULATION_SLICE_ROOMS])
+        await asyncio.sleep(0)
+    return logs
+
+
+async def run_simulation_tick():
+    # Update each live room
+    tick_start = time.perf_counter()
+    live_aggregates.advance()
+    tick_logs = fire_timeline_events()
+    tick_logs += expire_event_effects()
+    if isinstance(simulation_engine, ShardedSimulation):
+        tick_logs += await simulate_tick_sharded(simulation_engine)
+    elif simulation_engine is not None:
+        tick_logs += simulate_tick_vectorized(simulation_engine)
+        await asyncio.sleep(0)
+    else:
+        tick_logs += await simulate_tick_sliced()
+    live_aggregates.publish(live_rooms, global_stats, room_changes)
+    simulated_at = time.perf_counter()
+
+    # 只在事件循环里拷贝本 tick 的数值，写盘交给后台线程
+    if history_store is not None:
+        history_store.append_tick(live_rooms, ts=clock.time(), values=history_values(simulation_engine))
+    history_at = time.perf_counter()
+
+    log_batcher.extend(tick_logs)
+    await log_batcher.flush()
+    logs_sent_at = time.perf_counter()
     
-    # 存储上一次的观众数，用于检测异常流量
-    previous_viewers = {room_id: room.viewers for room_id, room in live_rooms.items()}
+    # Update global stats（总观众数与总销售额增量维护，不再逐房间求和）
+    total_viewers = live_aggregates.viewers
+    total_sales = live_aggregates.room_sales
+    if total_viewers > 0:
+        global_stats["avg_conversion_rate"] = total_sales / total_viewers
+    
+    # Emit updated data
+    await broadcast_room_updates()
+    await broadcast_global_stats()
+    tick_end = time.perf_counter()
+
+    TICK_DURATION.observe(simulated_at - tick_start, phase="simulate")
+    TICK_DURATION.observe(history_at - simulated_at, phase="history")
+    TICK_DURATION.observe(logs_sent_at - history_at, phase="logs")
+    TICK_DURATION.observe(tick_end - logs_sent_at, phase="broadcast")
+    TICK_DURATION.observe(tick_end - tick_start, phase="total")
+    clock.advance(SIMULATION_TICK_SECONDS)
+
+
+async def simulate_data():
+    global simulation_engine, tick_scheduler, history_store
+    # 接管模拟的 worker 沿用已镜像的直播间状态；否则优先从快照热启动
+    if not live_rooms and not restore_snapshot():
+        create_live_rooms()
+    live_aggregates.load(live_rooms)
+    # 新建、快照恢复或接管来的直播间，第一次广播做全量比对
+    room_changes.mark_everything()
+    if SNAPSHOT_PATH and SNAPSHOT_INTERVAL_SECONDS > 0:
+        app.state.snapshot_task = asyncio.create_task(run_snapshots())
+    if HISTORY_DIR and history_store is None:
+        history_store = TimeSeriesStore(
+            HISTORY_DIR,
+            segment_seconds=HISTORY_SEGMENT_SECONDS,
+            retention_seconds=HISTORY_RETENTION_HOURS * 3600 if HISTORY_RETENTION_HOURS > 0 else None,
+            rollups=HISTORY_ROLLUPS,
+        )
+
+    if SIMULATION_ENGINE == "vectorized":
+        simulation_engine = VectorizedSimulation(
+            live_rooms,
+            rng=random_streams.numpy("engine"),
+            active_effects=active_effects,
+            anomaly_detector=anomaly_detector,
+        )
+        print(f"Using vectorized simulation engine for {len(live_rooms)} rooms.")
+    elif SIMULATION_ENGINE == "sharded":
+        simulation_engine = ShardedSimulation(
+            live_rooms,
+            shards=SIMULATION_SHARDS or None,
+            active_effects=active_effects,
+            seed=random_streams.numpy_seed("engine"),
+            anomaly_settings=anomaly_detector.settings,
+        )
+        print(f"Using sharded simulation engine: {len(live_rooms)} rooms across {simulation_engine.shard_count} processes.")
     
+    # 按绝对截止时间固定频率运行，tick 耗时不会累积成漂移；加速模式下不等待
+    max_ticks = None
+    if SIMULATION_DURATION_SECONDS > 0:
+        max_ticks = max(1, round(SIMULATION_DURATION_SECONDS / SIMULATION_TICK_SECONDS))
+    tick_scheduler = TickScheduler(
+        run_simulation_tick,
+        period=SIMULATION_TICK_SECONDS,
+        policy=SIMULATION_TICK_POLICY,
+        max_catch_up=SIMULATION_MAX_CATCH_UP,
+        name="simulation tick",
+        accelerated=SIMULATION_ACCELERATED,
+        max_ticks=max_ticks,
+    )
+    if running:
+        wall_start = time.perf_counter()
+        await tick_scheduler.run()
+        if max_ticks is not None and tick_scheduler.ticks >= max_ticks:
+            print_replay_summary(time.perf_counter() - wall_start)
+
+
+def print_replay_summary(wall_seconds: float):
+    """Print how a bounded (SIMULATION_DURATION_SECONDS) run went"""
+    simulated = tick_scheduler.ticks * SIMULATION_TICK_SECONDS
+    print(
+        f"Simulation finished: {tick_scheduler.ticks} ticks, {simulated:.0f}s simulated in {wall_seconds:.2f}s "
+        f"({simulated / wall_seconds if wall_seconds > 0 else 0:.1f}x), seed={random_streams.seed}, "
+        f"total_sales={global_stats['total_sales']:.2f}"
+    )
+
+
+async def monitor_event_loop_lag():
+    """Sleep for a fixed interval and record how late each wake-up is"""
+    loop = asyncio.get_running_loop()
     while running:
-        try:
-            # Update each live room
-            for room_id, room in live_rooms.items():
-                # Simulate viewer count changes
-                viewer_change = random.randint(-100, 200)
-                room.viewers = max(100, room.viewers + viewer_change)
-                
-                # 检测异常流量
-                if room_id in previous_viewers:
-                    viewer_change_percentage = (room.viewers - previous_viewers[room_id]) / previous_viewers[room_id] * 100
-                    
-                    # 如果观众数变化超过15%，生成异常流量日志
-                    if abs(viewer_change_percentage) > 15:
-                        direction = "激增" if viewer_change_percentage > 0 else "骤降"
-                        log = generate_agent_log(
-                            room_id,
-                            "异常流量",
-                            f"检测到直播间观众{direction}，变化幅度{abs(viewer_change_percentage):.1f}%",
-                            f"当前观众数：{room.viewers}人，AI助手正在分析原因"
-                        )
-                        if log:
-                            await sio.emit("agent_log", log)
-                
-                # 更新上一次的观众数
-                previous_viewers[room_id] = room.viewers
-                
-                # Simulate product sales
-                for product in room.products:
-                    if product["stock"] > 0:
-                        sales_count = random.randint(0, 3)
-                        if sales_count > product["stock"]:
-                            sales_count = product["stock"]
-                        
-                        product["stock"] -= sales_count
-                        product["sales"] += sales_count
-                        sales_amount = sales_count * product["price"]
-                        room.sales += sales_amount
-                        global_stats["total_sales"] += sales_amount
-                        global_stats["total_profit"] += sales_amount * 0.3  # Assume 30% profit margin
-                        
-                        # Update stock status
-                        stock_percentage = product["stock"] / product["initial_stock"]
-                        if stock_percentage < 0.1:
-                            product["stock_status"] = "告急"
-                            if random.random() < 0.3:  # 30% chance to generate a warning
-                                log = generate_agent_log(
-                                    room_id,
-                                    "库存预警",
-                                    f"{product['name']} 库存告急，仅剩{product['stock']}件！",
-                                    "库存健康度调为红色"
-                                )
-                                if log:
-                                    await sio.emit("agent_log", log)
-                        elif stock_percentage < 0.3:
-                            product["stock_status"] = "紧张"
-                            if random.random() < 0.2:  # 20% chance to generate a warning
-                                log = generate_agent_log(
-                                    room_id,
-                                    "库存预警",
-                                    f"{product['name']} 库存偏低，当前{product['stock']}件",
-                                    "建议及时补货以维持销售"
-                                )
-                                if log:
-                                    await sio.emit("agent_log", log)
-                        else:
-                            product["stock_status"] = "充足"
-                
-                # Update room conversion rate
-                if room.viewers > 0:
-                    total_sales = sum(p["sales"] for p in room.products)
-                    room.conversion_rate = total_sales / room.viewers
-                
-                # Generate AI insights
-                if random.random() < 0.1:  # 10% chance to generate insights
-                    insight_types = [
-                        ("销售预测", "预计未来1小时销售额将增长20%", "销售预测调整"),
-                        ("舆情分析", "直播间氛围活跃，用户评价正面", "直播间健康度保持绿色"),
-                        ("营销策略", "建议开展限时促销活动", "预期提升转化率5%"),
-                    ]
-                    insight = random.choice(insight_types)
-                    log = generate_agent_log(room_id, *insight)
-                    if log:
-                        await sio.emit("agent_log", log)
-
-                # 模拟生成仓储管理相关的日志
-                if random.random() < 0.08:  # 8% 的概率生成仓储管理日志
-                    management_actions = [
-                        ("智能补货系统监测到 {} 库存水平健康，无需额外操作。", "库存状态良好"),
-                        ("正在对 {} 的仓储流程进行例行优化检查。", "流程优化"),
-                        ("AI分析了 {} 的出库效率，建议调整拣货路径。", "效率提升建议"),
-                        ("根据销售趋势，已为 {} 预留额外存储空间。", "空间预留")
-                    ]
-                    # 随机选择一个商品进行仓储管理日志生成
-                    if room.products:
-                        target_product_name = random.choice(room.products)["name"]
-                        action_template, impact_template = random.choice(management_actions)
-                        message = action_template.format(target_product_name)
-                        impact = impact_template
-
-                        log = generate_agent_log(
-                            room_id,
-                            "仓储管理", # 确保 action_type 与前端 PREDEFINED_CATEGORIES 匹配
-                            message,
-                            impact
-                        )
-                        if log:
-                            await sio.emit("agent_log", log)
-            
-            # Update global stats
-            total_viewers = sum(room.viewers for room in live_rooms.values())
-            total_sales = sum(room.sales for room in live_rooms.values())
-            if total_viewers > 0:
-                global_stats["avg_conversion_rate"] = total_sales / total_viewers
-            
-            # Emit updated data
-            await sio.emit("live_rooms", [room.model_dump() for room in live_rooms.values()])
-            await sio.emit("global_stats", global_stats)
-            
-            await asyncio.sleep(2)  # Update every 2 seconds
-            
-        except Exception as e:
-            print(f"Error in simulation: {str(e)}")
-            await asyncio.sleep(5)  # Wait 5 seconds before retrying
+        expected = loop.time() + EVENT_LOOP_LAG_INTERVAL
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - expected))
 
 
 @app.on_event("startup")
@@ -487,6 +1530,11 @@ async def startup_event():
     # loop = asyncio.get_event_loop() # No longer needed
     global running
     running = True # Ensure running is true at startup
+    app.state.loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+    if state_bus is not None:
+        app.state.cluster_task = asyncio.create_task(run_cluster())
+        print(f"Multi-worker mode on {bus_kind(MESSAGE_BUS_URL)} bus, worker pid {os.getpid()}.")
+        return
     app.state.simulation_task = asyncio.create_task(simulate_data())
     print("Data simulation task started.")
 
@@ -497,6 +1545,8 @@ async def shutdown_event():
     # global loop # No longer needed
     print("服务器正在关闭 (shutdown_event)...")
     running = False # Signal the simulation loop to stop
+    if tick_scheduler is not None:
+        tick_scheduler.stop()
 
     if hasattr(app.state, "simulation_task") and app.state.simulation_task:
         print("Waiting for simulation task to complete...")
@@ -512,6 +1562,29 @@ async def shutdown_event():
                 print("Simulation task successfully cancelled.")
         except Exception as e:
             print(f"Error during simulation task shutdown: {e}")
+    if isinstance(simulation_engine, ShardedSimulation):
+        simulation_engine.close()
+    if history_store is not None:
+        history_store.close()
+
+    # 模拟停止后保存最终快照，下次启动从这里恢复；先停掉周期快照，避免旧状态在最终快照之后落盘
+    await stop_snapshots()
+    if SNAPSHOT_PATH and is_simulation_owner and live_rooms:
+        try:
+            size = write_snapshot(SNAPSHOT_PATH, capture_snapshot())
+            print(f"Saved snapshot of {len(live_rooms)} rooms to {SNAPSHOT_PATH} ({size} bytes).")
+        except Exception as e:
+            print(f"Error writing snapshot {SNAPSHOT_PATH}: {e}")
+
+    await leave_cluster()
+    for task_name in ("loop_lag_task", "cluster_task", "bus_listener_task"):
+        task = getattr(app.state, task_name, None)
+        if task is not None:
+            task.cancel()
+    if local_broker is not None:
+        await local_broker.close()
+    if owner_lock is not None:
+        owner_lock.release()
     
     # Remove manual loop stop, Uvicorn handles its own loop.
     # if loop and loop.is_running():
@@ -0,0 +1,352 @@
+import asyncio
+import json
+import os
+import pickle
+import socket
+import struct
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import urlparse
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+# 每个进程的标识；每个 StateBus 在此基础上再加实例后缀，用于忽略自己发出的消息
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+SOCKETIO_CHANNEL = "livepulse:socketio"  # Socket.IO 跨进程广播
+STATE_CHANNEL = "livepulse:state"  # 模拟状态、事件触发等应用消息
+
+# 本地总线重连间隔（秒）
+RECONNECT_DELAY = 0.5
+
+_FRAME_HEADER = struct.Struct(">I")
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(_FRAME_HEADER.size)
+    return await reader.readexactly(_FRAME_HEADER.unpack(header)[0])
+
+
+def _frame(body: bytes) -> bytes:
+    return _FRAME_HEADER.pack(len(body)) + body
+
+
+class MemoryTransport:
+    """In-process pub/sub: every subscriber queue of a channel gets every message. Used in tests.
+
+    Like ``UnixSocketTransport``, a new subscriber queue starts with
+    ``None`` to signal that it is connected.
+    """
+
+    def __init__(self):
+        self._queues: Dict[str, List[asyncio.Queue]] = {}
+
+    async def publish(self, channel: str, message: Any):
+        for queue in self._queues.get(channel, ()):
+            queue.put_nowait(message)
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        queue.put_nowait(None)
+        self._queues.setdefault(channel, []).append(queue)
+        return queue
+
+
+class LocalBroker:
+    """Fan-out server on a Unix socket: each frame received is written to every connection.
+
+    Hosted by whichever worker holds the simulation lock, so the local bus
+    needs no extra process. Workers reconnect on their own if the owner
+    goes away and another worker takes over.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: set = set()
+
+    async def start(self):
+        # 持有锁的进程才会启动 broker，残留的 socket 文件可以安全删除
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o600)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                frame = _frame(await _read_frame(reader))
+                for target in list(self._writers):
+                    try:
+                        target.write(frame)
+                    except Exception:
+                        self._writers.discard(target)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._writers):
+                writer.close()
+            self._writers.clear()
+            await self._server.wait_closed()
+            self._server = None
+
+
+class UnixSocketTransport:
+    """Client side of ``LocalBroker``; channels are multiplexed over one connection per process.
+
+    Messages are pickled, like python-socketio's Redis manager does, so
+    binary payloads survive the trip. Publishing while disconnected drops
+    the message; after each (re)connect every subscriber queue receives
+    ``None`` so the application can resync what it missed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queues: Dict[str, List[asyncio.Queue]] = {}
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task: Optional[asyncio.Task] = None
+        self._connected = asyncio.Event()
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_unix_connection(self.path)
+            except (FileNotFoundError, ConnectionError, OSError):
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+            self._connected.set()
+            # 通知所有订阅者已（重新）连接：None 让应用层重新同步状态
+            for queues in self._queues.values():
+                for queue in queues:
+                    queue.put_nowait(None)
+            try:
+                while True:
+                    channel, message = pickle.loads(await _read_frame(reader))
+                    self._dispatch_local(channel, message)
+            except (asyncio.IncompleteReadError, ConnectionError, OSError):
+                print(f"[BUS] Lost connection to local broker {self.path}, reconnecting")
+            finally:
+                self._connected.clear()
+                self._writer = None
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    def _dispatch_local(self, channel: str, message: Any):
+        for queue in self._queues.get(channel, ()):
+            queue.put_nowait(message)
+
+    async def wait_connected(self, timeout: Optional[float] = None):
+        self._ensure_started()
+        await asyncio.wait_for(self._connected.wait(), timeout)
+
+    async def publish(self, channel: str, message: Any):
+        self._ensure_started()
+        if self._writer is None:
+            return
+        self._writer.write(_frame(pickle.dumps((channel, message))))
+        await self._writer.drain()
+
+    def subscribe(self, channel: str) -> asyncio.Queue:
+        self._ensure_started()
+        queue: asyncio.Queue = asyncio.Queue()
+        self._queues.setdefault(channel, []).append(queue)
+        return queue
+
+
+class TransportPubSubManager(AsyncPubSubManager):
+    """python-socketio client manager on top of a memory or Unix socket transport."""
+
+    name = "livepulse"
+
+    def __init__(self, transport, channel: str = SOCKETIO_CHANNEL, write_only: bool = False, logger=None):
+        self.transport = transport
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    async def _publish(self, data):
+        await self.transport.publish(self.channel, data)
+
+    async def _listen(self):
+        queue = self.transport.subscribe(self.channel)
+        while True:
+            yield await queue.get()
+
+
+def _new_worker_id() -> str:
+    return f"{WORKER_ID}:{uuid.uuid4().hex[:8]}"
+
+
+class StateBus:
+    """Application messages between workers (state deltas, trigger commands, replies).
+
+    Every message is a JSON-compatible dict stamped with the sender's
+    ``worker`` id; ``listen`` skips the worker's own messages and yields
+    ``{"type": "bus_connected"}`` whenever the transport (re)connects.
+    The id is per bus instance (``worker_id``, unique by default), so
+    several buses can share one transport inside a process.
+    """
+
+    def __init__(self, transport, channel: str = STATE_CHANNEL, worker_id: Optional[str] = None):
+        self.transport = transport
+        self.channel = channel
+        self.worker_id = worker_id or _new_worker_id()
+        self._queue: Optional[asyncio.Queue] = None
+
+    async def publish(self, message: Dict[str, Any]):
+        message = dict(message, worker=self.worker_id)
+        await self.transport.publish(self.channel, json.dumps(message))
+
+    async def listen(self) -> AsyncIterator[Dict[str, Any]]:
+        if self._queue is None:
+            self._queue = self.transport.subscribe(self.channel)
+        while True:
+            message = await self._queue.get()
+            if message is None:
+                yield {"type": "bus_connected"}
+                continue
+            message = json.loads(message)
+            if message.get("worker") != self.worker_id:
+                yield message
+
+
+class RedisStateBus(StateBus):
+    def __init__(self, url: str, channel: str = STATE_CHANNEL, worker_id: Optional[str] = None):
+        try:
+            from redis import asyncio as aioredis
+        except ImportError:
+            raise RuntimeError('MESSAGE_BUS_URL uses redis but the redis package is not installed (pip install redis)')
+
+        self.redis = aioredis.Redis.from_url(url)
+        self.channel = channel
+        self.worker_id = worker_id or _new_worker_id()
+
+    async def publish(self, message: Dict[str, Any]):
+        message = dict(message, worker=self.worker_id)
+        await self.redis.publish(self.channel, json.dumps(message))
+
+    async def listen(self) -> AsyncIterator[Dict[str, Any]]:
+        pubsub = self.redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        async for raw in pubsub.listen():
+            if raw["type"] == "subscribe":
+                # 订阅确认（redis-py 断线重连后也会重新订阅），此后发布的消息都能收到
+                yield {"type": "bus_connected"}
+                continue
+            if raw["type"] != "message":
+                continue
+            message = json.loads(raw["data"])
+            if message.get("worker") != self.worker_id:
+                yield message
+
+
+_transports: Dict[str, Any] = {}
+
+
+def bus_kind(url: Optional[str]) -> Optional[str]:
+    """``None`` (single process), ``memory``, ``local`` (Unix socket) or ``redis``."""
+    if not url:
+        return None
+    scheme = urlparse(url).scheme
+    if scheme in ("redis", "rediss"):
+        return "redis"
+    if scheme in ("memory", "local"):
+        return scheme
+    raise ValueError(f"Unsupported MESSAGE_BUS_URL scheme '{scheme}' (expected memory://, local:///path or redis://)")
+
+
+def local_socket_path(url: str) -> str:
+    return urlparse(url).path or "/tmp/livepulse-bus.sock"
+
+
+def get_transport(url: str):
+    transport = _transports.get(url)
+    if transport is None:
+        if bus_kind(url) == "memory":
+            transport = MemoryTransport()
+        else:
+            transport = UnixSocketTransport(local_socket_path(url))
+        _transports[url] = transport
+    return transport
+
+
+def create_client_manager(url: Optional[str]):
+    """Socket.IO client manager for ``MESSAGE_BUS_URL``, or None for the default in-process manager."""
+    kind = bus_kind(url)
+    if kind is None:
+        return None
+    if kind == "redis":
+        return socketio.AsyncRedisManager(url, channel=SOCKETIO_CHANNEL)
+    return TransportPubSubManager(get_transport(url))
+
+
+def create_state_bus(url: Optional[str]) -> Optional[StateBus]:
+    kind = bus_kind(url)
+    if kind is None:
+        return None
+    if kind == "redis":
+        return RedisStateBus(url)
+    return StateBus(get_transport(url))
+
+
+class OwnerLock:
+    """Non-blocking exclusive file lock; the worker holding it runs the simulation."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        if self._file is not None:
+            return True
+        lock_file = open(self.path, "a+")
+        try:
+            _lock(lock_file)
+        except OSError:
+            lock_file.close()
+            return False
+        self._file = lock_file
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        try:
+            _unlock(self._file)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+try:
+    import fcntl
+
+    def _lock(lock_file):
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(lock_file):
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+except ImportError:  # Windows
+    import msvcrt
+
+    def _lock(lock_file):
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def _unlock(lock_file):
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,109 @@
+import sys
+from operator import attrgetter
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# 商品字段名，顺序即对外 JSON 与快照行的列顺序
+PRODUCT_FIELDS = (
+    "id", "name", "price", "original_price", "stock", "initial_stock", "sales",
+    "size", "color", "predicted_sales", "stock_status", "ai_actions",
+)
+
+# 取值重复度高的字符串字段，构造时驻留，所有商品共享同一个对象
+_INTERNED_FIELDS = ("name", "size", "color", "stock_status")
+
+# 模拟 tick 会改写的商品字段（Python 循环与数组引擎相同）
+TICK_PRODUCT_FIELDS = ("stock", "sales", "stock_status")
+
+product_values = attrgetter(*PRODUCT_FIELDS)
+
+
+class Product:
+    """One product of a live room, as a ``__slots__`` record.
+
+    Replaces the per-product dict: the fields are fixed slots, repeated
+    strings (name, size, flavor in ``color``, stock status) are interned
+    and an empty ``ai_actions`` is a shared empty tuple, so a product
+    costs a fraction of the dict's memory and the tick reads and writes
+    plain attributes. ``windows`` holds the rolling-window values once
+    ``LiveAggregates.publish`` has set them.
+
+    ``to_dict`` is the view clients and the API see; it has the same keys
+    as the old dict, ``windows`` only once set.
+    """
+
+    __slots__ = PRODUCT_FIELDS + ("windows",)
+
+    def __init__(
+        self,
+        id: str,
+        name: str,
+        price: float,
+        original_price: float,
+        stock: int,
+        initial_stock: int,
+        sales: int = 0,
+        size: str = "",
+        color: str = "",
+        predicted_sales: int = 0,
+        stock_status: str = "充足",
+        ai_actions: Tuple = (),
+        windows: Optional[Dict] = None,
+    ):
+        self.id = id
+        self.name = sys.intern(name)
+        self.price = price
+        self.original_price = original_price
+        self.stock = stock
+        self.initial_stock = initial_stock
+        self.sales = sales
+        self.size = sys.intern(size)
+        self.color = sys.intern(color)
+        self.predicted_sales = predicted_sales
+        self.stock_status = sys.intern(stock_status)
+        self.ai_actions = tuple(ai_actions) if ai_actions else ()
+        self.windows = windows
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Product":
+        """Build a product from its dict form (snapshots, mirrored state); unknown keys are ignored."""
+        return cls(**{key: data[key] for key in Product.__slots__ if key in data})
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        """``(field, value)`` pairs in ``to_dict`` order, without building the dict."""
+        yield from zip(PRODUCT_FIELDS, product_values(self))
+        if self.windows is not None:
+            yield "windows", self.windows
+
+    def to_dict(self) -> Dict[str, Any]:
+        # 字面量构造比按字段名循环快数倍，/live-rooms 每个商品都要调用一次
+        data = {
+            "id": self.id,
+            "name": self.name,
+            "price": self.price,
+            "original_price": self.original_price,
+            "stock": self.stock,
+            "initial_stock": self.initial_stock,
+            "sales": self.sales,
+            "size": self.size,
+            "color": self.color,
+            "predicted_sales": self.predicted_sales,
+            "stock_status": self.stock_status,
+            "ai_actions": list(self.ai_actions),
+        }
+        if self.windows is not None:
+            data["windows"] = self.windows
+        return data
+
+    def __reduce__(self):
+        # 分片进程的传输与 deepcopy 只带一行字段值
+        return Product, product_values(self) + (self.windows,)
+
+    def __eq__(self, other):
+        if not isinstance(other, Product):
+            return NotImplemented
+        return product_values(self) == product_values(other) and self.windows == other.windows
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Product(id={self.id!r}, name={self.name!r}, stock={self.stock}, sales={self.sales})"
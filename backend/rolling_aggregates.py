@@ -0,0 +1,322 @@
+import math
+import time
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Sequence, Set
+
+import numpy as np
+
+from timeseries_store import rollup_label
+
+WINDOW_FIELDS = ("sales", "conversions")
+DEFAULT_WINDOWS = (60, 300)
+DEFAULT_BUCKET_SECONDS = 10.0
+INITIAL_CAPACITY = 64
+
+
+class RollingWindows:
+    """Sliding-window sums for a growing set of keys over one bucketed ring.
+
+    Time is cut into buckets of ``bucket_seconds``. Every key has a row in
+    a ring of closed buckets, deep enough for the longest window, plus the
+    open bucket that new values go into. For each window the sum of its
+    closed buckets is kept per key, so adding a value and reading a window
+    sum are both O(1). When the clock enters a new bucket, the open bucket
+    is folded into the ring and the buckets that fall out of each window
+    are subtracted, with one vectorized pass per bucket boundary instead
+    of per value.
+
+    A window of ``w`` seconds is the sum of the last ``w / bucket_seconds``
+    closed buckets, so window values change only when a bucket closes.
+    Slots whose sums changed then are collected until ``drain_touched``,
+    so publishers revisit only those keys, once per bucket.
+
+    ``add`` is for single values from Python loops; ``add_many`` takes
+    NumPy arrays of slots and values from the array engines.
+    """
+
+    def __init__(
+        self,
+        windows: Sequence[int] = DEFAULT_WINDOWS,
+        bucket_seconds: float = DEFAULT_BUCKET_SECONDS,
+        fields: Sequence[str] = WINDOW_FIELDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        windows = tuple(sorted(set(int(window) for window in windows)))
+        if not windows:
+            raise ValueError("At least one window is required")
+        for window in windows:
+            if window % bucket_seconds:
+                raise ValueError(f"Window {window}s must be a multiple of the {bucket_seconds}s bucket")
+        self.windows = windows
+        self.labels = tuple(rollup_label(window) for window in windows)
+        self.bucket_seconds = bucket_seconds
+        self.fields = tuple(fields)
+        self.clock = clock
+        # 每个窗口累计的已关闭 bucket 数；环深度多留一格，新 bucket 写入前被移出的 bucket 已从所有窗口扣除
+        self._closed_buckets = [int(window // bucket_seconds) for window in windows]
+        self._depth = max(self._closed_buckets) + 1
+        self._bucket = self._bucket_index()
+
+        self.index: Dict[Hashable, int] = {}
+        self.keys: List[Hashable] = []
+        self._capacity = INITIAL_CAPACITY
+        self._ring = np.zeros((len(self.fields), self._capacity, self._depth))
+        self._closed = np.zeros((len(windows), len(self.fields), self._capacity))
+        # 当前 bucket：Python 循环写列表（单次加法最便宜），数组引擎写 NumPy 数组，关闭时合并。
+        # open_bucket 的各列表对象在整个生命周期内不变，热循环可以直接按槽位累加
+        self.open_bucket: List[List[float]] = [[0.0] * self._capacity for _ in self.fields]
+        self._open_array = np.zeros((len(self.fields), self._capacity))
+        self._touched: Set[int] = set()
+
+    def _bucket_index(self) -> int:
+        return int(self.clock() // self.bucket_seconds)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def slot(self, key: Hashable) -> int:
+        slot = self.index.get(key)
+        if slot is None:
+            slot = self.index[key] = len(self.keys)
+            self.keys.append(key)
+            if slot >= self._capacity:
+                self._grow()
+        return slot
+
+    def slots(self, keys: Iterable[Hashable]) -> np.ndarray:
+        return np.fromiter((self.slot(key) for key in keys), dtype=np.int64)
+
+    def _grow(self):
+        capacity = self._capacity * 2
+        ring = np.zeros((len(self.fields), capacity, self._depth))
+        ring[:, :self._capacity] = self._ring
+        closed = np.zeros((len(self.windows), len(self.fields), capacity))
+        closed[:, :, :self._capacity] = self._closed
+        pending_array = np.zeros((len(self.fields), capacity))
+        pending_array[:, :self._capacity] = self._open_array
+        for pending in self.open_bucket:
+            pending.extend([0.0] * (capacity - self._capacity))
+        self._ring, self._closed, self._open_array = ring, closed, pending_array
+        self._capacity = capacity
+
+    def add(self, slot: int, *values: float):
+        for pending, value in zip(self.open_bucket, values):
+            pending[slot] += value
+
+    def add_many(self, slots: np.ndarray, *values: np.ndarray):
+        """Add per-slot values; ``slots`` may repeat (e.g. several products of one room)."""
+        if not len(slots):
+            return
+        for field, value in enumerate(values):
+            np.add.at(self._open_array[field], slots, value)
+
+    def closing(self) -> bool:
+        """Whether the next ``advance`` will close the open bucket."""
+        return self._bucket_index() > self._bucket
+
+    def open_totals(self) -> List[float]:
+        """Per-field sum of the open bucket over all keys."""
+        return [math.fsum(values) + float(self._open_array[field].sum()) for field, values in enumerate(self.open_bucket)]
+
+    def advance(self) -> bool:
+        """Close the buckets the clock has moved past; call before adding values for a new tick.
+
+        Returns whether any bucket was closed.
+        """
+        bucket = self._bucket_index()
+        steps = bucket - self._bucket
+        if steps <= 0:
+            return False
+        count = len(self.keys)
+        pending = np.asarray(self.open_bucket, dtype=np.float64)[:, :count] + self._open_array[:, :count]
+        self._touched.update(np.flatnonzero(pending.any(axis=0)).tolist())
+        if steps > self._depth:
+            # 停顿超过整个环：所有窗口都已过期
+            self._touched.update(np.flatnonzero(self._closed[:, :, :count].any(axis=(0, 1))).tolist())
+            self._ring[:] = 0.0
+            self._closed[:] = 0.0
+        else:
+            for step in range(steps):
+                closing = self._bucket + step
+                column = closing % self._depth
+                self._ring[:, :count, column] = pending if step == 0 else 0.0
+                for index, closed_buckets in enumerate(self._closed_buckets):
+                    dropped = self._ring[:, :count, (closing - closed_buckets) % self._depth]
+                    self._closed[index, :, :count] += self._ring[:, :count, column] - dropped
+                    self._touched.update(np.flatnonzero(dropped.any(axis=0)).tolist())
+        self._bucket = bucket
+        for values in self.open_bucket:
+            values[:] = [0.0] * self._capacity
+        self._open_array[:] = 0.0
+        return True
+
+    def sums(self, slot: int) -> List[List[float]]:
+        """Window sums of one slot, ``[window][field]``."""
+        return self._closed[:, :, slot].tolist()
+
+    def values(self, slots: Sequence[int]) -> List[Dict[str, Dict[str, float]]]:
+        """Window sums and per-minute rates of each slot, keyed by window label (``1m``, ``5m``)."""
+        slots = np.asarray(slots, dtype=np.int64)
+        # 反复加减的浮点累积误差在这里截断
+        totals = np.round(np.maximum(self._closed[:, :, slots], 0.0), 2)
+        minutes = np.array(self.windows, dtype=np.float64)[:, None, None] / 60
+        rates = np.round(totals / minutes, 2)
+        totals, rates = totals.tolist(), rates.tolist()
+        names = [(field, f"{field}_per_min") for field in self.fields]
+        return [
+            {
+                label: {
+                    name: value
+                    for (total_name, rate_name), field_totals, field_rates in zip(names, totals[window], rates[window])
+                    for name, value in ((total_name, field_totals[index]), (rate_name, field_rates[index]))
+                }
+                for window, label in enumerate(self.labels)
+            }
+            for index in range(len(slots))
+        ]
+
+    def drain_touched(self) -> Set[int]:
+        touched, self._touched = self._touched, set()
+        return touched
+
+
+class LiveAggregates:
+    """Running totals and sliding-window sales for rooms, products and the whole app.
+
+    Sales are recorded as they happen: the Python tick reports each
+    product sale and one summary per room, the array engines report the
+    per-product units and amounts of a tick. Totals that ``global_stats``
+    needs (viewers, room sales) and each room's cumulative conversions are
+    kept up to date incrementally, so no tick has to rescan rooms or
+    products. ``publish`` writes the window values into the rooms and
+    products whose sums changed and into ``global_stats["windows"]``.
+    """
+
+    def __init__(
+        self,
+        windows: Sequence[int] = DEFAULT_WINDOWS,
+        bucket_seconds: float = DEFAULT_BUCKET_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rooms = RollingWindows(windows, bucket_seconds, clock=clock)
+        self.products = RollingWindows(windows, bucket_seconds, clock=clock)
+        self.overall = RollingWindows(windows, bucket_seconds, clock=clock)
+        self.overall.slot("all")
+        self.viewers = 0
+        self.room_sales = 0.0
+        self.room_conversions: Dict[str, int] = {}
+        self._engine_slots: Dict[Hashable, tuple] = {}
+        # 每个直播间 product_id -> 商品对象，商品列表被替换时重建
+        self._room_products: Dict[Hashable, tuple] = {}
+        self._product_index = self.products.index
+        self._product_bucket_sales, self._product_bucket_conversions = self.products.open_bucket
+        self._room_index = self.rooms.index
+        self._room_bucket_sales, self._room_bucket_conversions = self.rooms.open_bucket
+
+    def load(self, live_rooms: Dict):
+        """Take the running totals from the current rooms and drop window values left over from a snapshot."""
+        self.viewers = sum(room.viewers for room in live_rooms.values())
+        self.room_sales = sum(room.sales for room in live_rooms.values())
+        self.room_conversions = {
+            room_id: sum(product.sales for product in room.products) for room_id, room in live_rooms.items()
+        }
+        self._room_products = {}
+        for room_id, room in live_rooms.items():
+            room.windows = {}
+            for product in room.products:
+                product.windows = None
+            self._products_by_id(room_id, room.products)
+
+    def _products_by_id(self, room_id: Hashable, products: List) -> Dict:
+        cached = self._room_products.get(room_id)
+        if cached is None or cached[0] is not products or cached[1] != len(products):
+            cached = (products, len(products), {product.id: product for product in products})
+            self._room_products[room_id] = cached
+        return cached[2]
+
+    def advance(self):
+        # 全局 bucket 就是所有直播间 bucket 之和，关闭时一次折算，销售发生时不必再累加一份
+        if self.rooms.closing():
+            self.overall.add(0, *self.rooms.open_totals())
+        self.rooms.advance()
+        self.products.advance()
+        self.overall.advance()
+
+    def record_viewers(self, change: int):
+        self.viewers += change
+
+    def record_product_sale(self, room_id: str, product_id: str, conversions: int, amount: float):
+        # 逐笔调用的热路径：直接写当前 bucket 的列表
+        key = (room_id, product_id)
+        slot = self._product_index.get(key)
+        if slot is None:
+            slot = self.products.slot(key)
+        self._product_bucket_sales[slot] += amount
+        self._product_bucket_conversions[slot] += conversions
+
+    def record_room_sales(self, room_id: str, conversions: int, amount: float):
+        """One room's sales for a tick, after its products were recorded with ``record_product_sale``."""
+        slot = self._room_index.get(room_id)
+        if slot is None:
+            slot = self.rooms.slot(room_id)
+        self._room_bucket_sales[slot] += amount
+        self._room_bucket_conversions[slot] += conversions
+        self.room_conversions[room_id] = self.room_conversions.get(room_id, 0) + conversions
+        self.room_sales += amount
+
+    def record_products(self, owner: Hashable, products: List, product_room_id, indexes, sold, amounts):
+        """Record one tick of an array engine: units ``sold`` and ``amounts`` of the products at ``indexes``.
+
+        ``owner`` identifies the engine or shard; its mapping from product
+        index to window slots is rebuilt only when it hands over a different
+        ``products`` list.
+        """
+        cached = self._engine_slots.get(owner)
+        if cached is None or cached[0] is not products:
+            room_ids = [product_room_id(index) for index in range(len(products))]
+            product_slots = self.products.slots(
+                (room_id, product.id) for room_id, product in zip(room_ids, products)
+            )
+            cached = self._engine_slots[owner] = (products, product_slots, self.rooms.slots(room_ids))
+        _, product_slots, room_slots = cached
+        selling = np.flatnonzero(sold)
+        if not len(selling):
+            return
+        indexes = np.asarray(indexes)[selling]
+        sold = np.asarray(sold)[selling].astype(np.float64)
+        amounts = np.asarray(amounts, dtype=np.float64)[selling]
+        self.products.add_many(product_slots[indexes], amounts, sold)
+        self.rooms.add_many(room_slots[indexes], amounts, sold)
+
+    def set_totals(self, viewers: int, room_sales: float):
+        """Totals computed by an array engine in the same pass as the tick."""
+        self.viewers = viewers
+        self.room_sales = room_sales
+
+    def publish(self, live_rooms: Dict, global_stats: Dict, changes=None):
+        """Write the window values that changed since the last call; a no-op until the next bucket closes.
+
+        The rooms and products written are marked on ``changes`` (a
+        ``RoomChanges``) when given.
+        """
+        rooms = self.rooms
+        slots = sorted(rooms.drain_touched())
+        for slot, values in zip(slots, rooms.values(slots)):
+            room = live_rooms.get(rooms.keys[slot])
+            if room is not None:
+                room.windows = values
+                if changes is not None:
+                    changes.mark_fields(rooms.keys[slot])
+        products = self.products
+        slots = sorted(products.drain_touched())
+        for slot, values in zip(slots, products.values(slots)):
+            room_id, product_id = products.keys[slot]
+            room = live_rooms.get(room_id)
+            if room is None:
+                continue
+            product = self._products_by_id(room_id, room.products).get(product_id)
+            if product is not None:
+                product.windows = values
+                if changes is not None:
+                    changes.mark_product(room_id, product, ("windows",))
+        if self.overall.drain_touched() or "windows" not in global_stats:
+            global_stats["windows"] = self.overall.values([0])[0]
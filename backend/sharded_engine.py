@@ -0,0 +1,380 @@
+import asyncio
+import multiprocessing
+import os
+import signal
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+
+from anomaly_detector import Anomalies, AnomalyDetector
+from products import Product
+from vector_engine import STOCK_STATUSES, VectorizedSimulation
+
+# 分片进程中只保留模拟所需的字段
+SHARD_ROOM_FIELDS = ("viewers", "sales", "conversion_rate", "products")
+
+
+class ShardRoom:
+    """Minimal stand-in for ``LiveRoom`` inside a shard process."""
+
+    __slots__ = SHARD_ROOM_FIELDS
+
+    def __init__(self, viewers, sales, conversion_rate, products):
+        self.viewers = viewers
+        self.sales = sales
+        self.conversion_rate = conversion_rate
+        self.products = products
+
+
+class _ShardEffects:
+    """Shard-local copy of the coordinator's combined event effects, fed by ``update``."""
+
+    def __init__(self):
+        self.conversion_offsets: Dict[str, float] = {}
+        self.sales_multipliers: Dict[Tuple[str, str], float] = {}
+        self.track_changes = False
+        self._changed_rooms: Set[str] = set()
+        self._changed_products: Set[Tuple[str, str]] = set()
+
+    def update(self, offsets: Dict[str, float], multipliers: Dict[Tuple[str, str], float]):
+        for room_id, offset in offsets.items():
+            if offset:
+                self.conversion_offsets[room_id] = offset
+            else:
+                self.conversion_offsets.pop(room_id, None)
+            self._changed_rooms.add(room_id)
+        for key, multiplier in multipliers.items():
+            if multiplier != 1.0:
+                self.sales_multipliers[key] = multiplier
+            else:
+                self.sales_multipliers.pop(key, None)
+            self._changed_products.add(key)
+
+    def conversion_offset(self, room_id: str) -> float:
+        return self.conversion_offsets.get(room_id, 0.0)
+
+    def sales_multiplier(self, room_id: str, product_id: str) -> float:
+        return self.sales_multipliers.get((room_id, product_id), 1.0)
+
+    def drain_changes(self):
+        rooms, products = self._changed_rooms, self._changed_products
+        self._changed_rooms, self._changed_products = set(), set()
+        return rooms, products
+
+
+class ShardTickResult(NamedTuple):
+    """One shard's tick: new room scalars, changed products, log triggers and partial aggregates.
+
+    Room arrays are in the shard's room order, product indexes are into the
+    shard's flat product list.
+    """
+
+    viewers: np.ndarray
+    room_sales: np.ndarray
+    conversion_rate: np.ndarray
+    changed_products: np.ndarray
+    product_stock: np.ndarray
+    product_sales: np.ndarray
+    product_status: np.ndarray
+    product_sold: np.ndarray
+    product_amounts: np.ndarray
+    sales_amount: float
+    viewers_total: int
+    room_sales_total: float
+    anomalies: Anomalies
+    stock_warnings: np.ndarray
+    insight_rooms: np.ndarray
+    insight_choices: np.ndarray
+    warehouse_products: np.ndarray
+    warehouse_choices: np.ndarray
+
+
+def _room_payload(room) -> Dict:
+    return {
+        "viewers": room.viewers,
+        "sales": room.sales,
+        "conversion_rate": room.conversion_rate,
+        # Product 记录按字段值行序列化，分片进程收到的是独立副本
+        "products": list(room.products),
+    }
+
+
+def _shard_main(conn, room_states: Dict[str, Dict], seed, anomaly_settings: Dict):
+    """Shard process: owns a slice of the rooms and advances them with the vectorized engine."""
+    # Ctrl+C 会发给整个进程组，分片进程由协调进程负责停止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    rooms = {room_id: ShardRoom(**state) for room_id, state in room_states.items()}
+    effects = _ShardEffects()
+    engine = VectorizedSimulation(
+        rooms,
+        rng=np.random.default_rng(seed),
+        active_effects=effects,
+        anomaly_detector=AnomalyDetector(**anomaly_settings),
+    )
+    while True:
+        try:
+            command, payload = conn.recv()
+        except EOFError:  # 协调进程已退出
+            break
+        if command == "stop":
+            break
+        refresh, offsets, multipliers = payload
+        for room_id, state in refresh.items():
+            room = rooms[room_id]
+            for field, value in state.items():
+                setattr(room, field, value)
+            engine.mark_dirty(room_id)
+        effects.update(offsets, multipliers)
+
+        result = engine.tick()
+        changed = engine.changed_products
+        conn.send(ShardTickResult(
+            viewers=engine.viewers,
+            room_sales=engine.room_sales,
+            conversion_rate=engine.conversion_rate,
+            changed_products=changed,
+            product_stock=engine.stock[changed],
+            product_sales=engine.sales[changed],
+            product_status=engine.status[changed],
+            product_sold=engine.last_sold[changed],
+            product_amounts=engine.last_sold[changed] * engine.price[changed],
+            sales_amount=result.sales_amount,
+            viewers_total=int(engine.viewers.sum()),
+            room_sales_total=float(engine.room_sales.sum()),
+            anomalies=result.anomalies,
+            stock_warnings=result.stock_warnings,
+            insight_rooms=result.insight_rooms,
+            insight_choices=result.insight_choices,
+            warehouse_products=result.warehouse_products,
+            warehouse_choices=result.warehouse_choices,
+        ))
+        # 分片进程内的房间对象只需在下次 refresh 前保持与数组一致
+        engine.write_back()
+    conn.close()
+
+
+class _Shard:
+    def __init__(self, index: int, room_ids: List[str], rooms: List, context, seed, anomaly_settings: Dict):
+        self.index = index
+        self.room_ids = room_ids
+        self.reindex(rooms)
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_shard_main,
+            args=(
+                child_conn,
+                {room_id: _room_payload(room) for room_id, room in zip(room_ids, rooms)},
+                seed,
+                anomaly_settings,
+            ),
+            name=f"simulation-shard-{index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def reindex(self, rooms: List):
+        """Rebuild the flat product list, e.g. after an event replaced a room's products."""
+        self.rooms = rooms
+        self.products: List[Product] = [product for room in rooms for product in room.products]
+        self.product_rooms: List[str] = [
+            room_id for room_id, room in zip(self.room_ids, rooms) for _ in room.products
+        ]
+
+    def product_room_id(self, product_index: int) -> str:
+        return self.product_rooms[product_index]
+
+    def tick(self, request) -> ShardTickResult:
+        self.conn.send(("tick", request))
+        return self.conn.recv()
+
+
+class ShardedSimulation:
+    """Coordinator for a simulation split across worker processes.
+
+    Rooms are partitioned into ``shards`` contiguous slices; each shard
+    process runs a ``VectorizedSimulation`` over its slice. A tick sends
+    every shard its pending inputs at once and waits for all replies in
+    parallel, so the per-room work runs on as many cores as there are
+    shards. The coordinator then copies the results into the ``LiveRoom``
+    objects and merges the shards' partial aggregates into
+    ``aggregates`` (sales amount, total viewers, total room sales).
+    ``tick_sales`` holds, per shard, the product indexes, units and
+    amounts sold in the last tick.
+
+    Event triggers are routed to the shard owning the room: ``mark_dirty``
+    queues the room's current state to be sent with that shard's next
+    tick. A room changed while a tick is in flight keeps its new state
+    and is refreshed on the following tick. Timed effects from
+    ``active_effects`` are forwarded the same way.
+
+    Each shard scores its own rooms with an ``AnomalyDetector`` built from
+    ``anomaly_settings``; its state lives in the shard process and starts
+    over (warm-up included) when the shards are reloaded.
+    """
+
+    def __init__(
+        self,
+        live_rooms: Dict,
+        shards: Optional[int] = None,
+        active_effects=None,
+        seed=None,
+        start_method: str = "spawn",
+        anomaly_settings: Optional[Dict] = None,
+    ):
+        self.live_rooms = live_rooms
+        self.active_effects = active_effects
+        if active_effects is not None:
+            active_effects.track_changes = True
+        self.shard_count = max(1, min(shards or os.cpu_count() or 1, len(live_rooms) or 1))
+        self._context = multiprocessing.get_context(start_method)
+        self._seed_sequence = np.random.SeedSequence(seed)
+        self.anomaly_settings = anomaly_settings or {}
+        self._dirty: Set[str] = set()
+        self._in_flight = False
+        self._dirty_in_flight: Set[str] = set()
+        self.aggregates = {"sales_amount": 0.0, "viewers": 0, "room_sales": 0.0}
+        self.tick_sales: List[Tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        self.shards: List[_Shard] = []
+        self.load(live_rooms)
+
+    def load(self, live_rooms: Dict):
+        self.close()
+        self.live_rooms = live_rooms
+        room_ids = list(live_rooms.keys())
+        bounds = np.linspace(0, len(room_ids), self.shard_count + 1).astype(int)
+        seeds = self._seed_sequence.spawn(self.shard_count)
+        self.shards = []
+        self.room_shard: Dict[str, int] = {}
+        for index in range(self.shard_count):
+            shard_room_ids = room_ids[bounds[index]:bounds[index + 1]]
+            rooms = [live_rooms[room_id] for room_id in shard_room_ids]
+            self.shards.append(
+                _Shard(index, shard_room_ids, rooms, self._context, seeds[index], self.anomaly_settings)
+            )
+            for room_id in shard_room_ids:
+                self.room_shard[room_id] = index
+        self.room_ids = room_ids
+        self._dirty.clear()
+        if self.active_effects is not None:
+            self.active_effects.drain_changes()
+            self._initial_effects = (
+                dict(self.active_effects.conversion_offsets),
+                dict(self.active_effects.sales_multipliers),
+            )
+        else:
+            self._initial_effects = ({}, {})
+
+    def close(self):
+        for shard in self.shards:
+            try:
+                shard.conn.send(("stop", None))
+            except (BrokenPipeError, OSError):
+                pass
+        for shard in self.shards:
+            shard.process.join(timeout=2)
+            if shard.process.is_alive():
+                shard.process.terminate()
+            shard.conn.close()
+        self.shards = []
+
+    def mark_dirty(self, room_id: str):
+        self._dirty.add(room_id)
+        if self._in_flight:
+            self._dirty_in_flight.add(room_id)
+
+    def _requests(self) -> List[Tuple[Dict, Dict, Dict]]:
+        requests = [({}, {}, {}) for _ in self.shards]
+        for room_id in self._dirty:
+            index = self.room_shard.get(room_id)
+            if index is not None:
+                requests[index][0][room_id] = _room_payload(self.live_rooms[room_id])
+        self._dirty.clear()
+        for shard, (refresh, _, _) in zip(self.shards, requests):
+            if refresh:
+                shard.reindex([self.live_rooms[room_id] for room_id in shard.room_ids])
+
+        offsets, multipliers = self._initial_effects
+        self._initial_effects = ({}, {})
+        if self.active_effects is not None:
+            changed_rooms, changed_products = self.active_effects.drain_changes()
+            offsets = dict(offsets, **{room_id: self.active_effects.conversion_offset(room_id) for room_id in changed_rooms})
+            multipliers = dict(multipliers)
+            for key in changed_products:
+                multipliers[key] = self.active_effects.sales_multiplier(*key)
+        for room_id, offset in offsets.items():
+            index = self.room_shard.get(room_id)
+            if index is not None:
+                requests[index][1][room_id] = offset
+        for key, multiplier in multipliers.items():
+            index = self.room_shard.get(key[0])
+            if index is not None:
+                requests[index][2][key] = multiplier
+        return requests
+
+    async def tick(self) -> List[ShardTickResult]:
+        """Advance every shard by one tick; waits in worker threads so the event loop stays free."""
+        if set(self.live_rooms) != set(self.room_ids):
+            self.load(self.live_rooms)
+        loop = asyncio.get_running_loop()
+        requests = self._requests()
+        self._in_flight = True
+        try:
+            results = await asyncio.gather(*(
+                loop.run_in_executor(None, shard.tick, request)
+                for shard, request in zip(self.shards, requests)
+            ))
+        finally:
+            self._in_flight = False
+        self._write_back(results)
+        return results
+
+    def _write_back(self, results: List[ShardTickResult]):
+        skipped = self._dirty_in_flight
+        self._dirty_in_flight = set()
+        aggregates = {"sales_amount": 0.0, "viewers": 0, "room_sales": 0.0}
+        tick_sales = []
+        for shard, result in zip(self.shards, results):
+            for room_id, room, viewers, sales, conversion_rate in zip(
+                shard.room_ids,
+                shard.rooms,
+                result.viewers.tolist(),
+                result.room_sales.tolist(),
+                result.conversion_rate.tolist(),
+            ):
+                if room_id in skipped:
+                    continue
+                room.viewers = viewers
+                room.sales = sales
+                room.conversion_rate = conversion_rate
+            for product_index, stock, sales, status in zip(
+                result.changed_products.tolist(),
+                result.product_stock.tolist(),
+                result.product_sales.tolist(),
+                result.product_status.tolist(),
+            ):
+                if shard.product_rooms[product_index] in skipped:
+                    continue
+                product = shard.products[product_index]
+                product.stock = stock
+                product.sales = sales
+                product.stock_status = STOCK_STATUSES[status]
+            # 被跳过的直播间下个 tick 会用协调进程的状态覆盖分片，本 tick 的销量不计入，
+            # 总销售额与滑动窗口都不计，合计值取直播间保留下来的状态
+            if skipped:
+                kept = np.array(
+                    [shard.product_rooms[index] not in skipped for index in result.changed_products.tolist()],
+                    dtype=bool,
+                )
+                amounts = result.product_amounts[kept]
+                aggregates["sales_amount"] += float(amounts.sum())
+                aggregates["viewers"] += sum(room.viewers for room in shard.rooms)
+                aggregates["room_sales"] += sum(room.sales for room in shard.rooms)
+                tick_sales.append((result.changed_products[kept], result.product_sold[kept], amounts))
+            else:
+                aggregates["sales_amount"] += result.sales_amount
+                aggregates["viewers"] += result.viewers_total
+                aggregates["room_sales"] += result.room_sales_total
+                tick_sales.append((result.changed_products, result.product_sold, result.product_amounts))
+        self.aggregates = aggregates
+        self.tick_sales = tick_sales
@@ -0,0 +1,104 @@
+import gc
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from operator import attrgetter
+from typing import Dict, List, Sequence
+
+import msgpack
+
+from metrics import SIZE_BUCKETS, registry as metrics
+
+SNAPSHOT_VERSION = 1
+
+SNAPSHOT_SECONDS = metrics.histogram(
+    "livepulse_snapshot_seconds", "Time spent on one state snapshot", ("phase",)
+)
+SNAPSHOT_BYTES = metrics.histogram(
+    "livepulse_snapshot_bytes", "Size of the written state snapshots", buckets=SIZE_BUCKETS
+)
+SNAPSHOT_RESTORE_SECONDS = metrics.gauge(
+    "livepulse_snapshot_restore_seconds", "How long restoring the state snapshot took at startup"
+)
+
+
+@contextmanager
+def paused_gc():
+    """Pause the cyclic GC: building tens of thousands of small containers otherwise triggers repeated full collections."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def capture_state(
+    rooms: Sequence, room_fields: Sequence[str], product_fields: Sequence[str], global_stats: Dict, logs: List[Dict]
+) -> Dict:
+    """Copy the state to snapshot into plain lists, column names stored once.
+
+    Runs on the event loop so the copy is consistent with one tick.
+    Products are ``Product`` records, stored as value rows of
+    ``product_fields``. The copy shares only the log dicts and product
+    field values with the live state, which the app replaces rather than
+    mutates.
+    """
+    get_fields = attrgetter(*room_fields)
+    get_product = attrgetter(*product_fields)
+    with paused_gc():
+        return {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "room_fields": list(room_fields),
+            "rooms": [get_fields(room) for room in rooms],
+            "product_fields": list(product_fields),
+            "products": [[get_product(product) for product in room.products] for room in rooms],
+            "global_stats": dict(global_stats),
+            "logs": logs,
+        }
+
+
+def write_snapshot(path: str, state: Dict) -> int:
+    """Serialize ``state`` with MessagePack and atomically replace ``path``; returns the size in bytes."""
+    with SNAPSHOT_SECONDS.time(phase="write"):
+        data = msgpack.packb(state, use_bin_type=True)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # 先写临时文件并落盘，再原子替换，崩溃时旧快照仍然完整；
+        # 每次写入用各自的临时文件，同时进行的两次写入不会互相截断
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    SNAPSHOT_BYTES.observe(len(data))
+    return len(data)
+
+
+def read_snapshot(path: str) -> Dict:
+    """Load a snapshot written by ``write_snapshot``, with rooms and products turned back into dicts."""
+    with open(path, "rb") as f:
+        data = f.read()
+    with paused_gc():
+        state = msgpack.unpackb(data, raw=False, strict_map_key=False)
+        if state.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version {state.get('version')}")
+        room_fields = state["room_fields"]
+        product_fields = state["product_fields"]
+        rooms = []
+        for values, products in zip(state["rooms"], state["products"]):
+            room = dict(zip(room_fields, values))
+            room["products"] = [
+                product if isinstance(product, dict) else dict(zip(product_fields, product)) for product in products
+            ]
+            rooms.append(room)
+        state["rooms"] = rooms
+    return state
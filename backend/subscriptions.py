@@ -0,0 +1,105 @@
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Set
+
+# Socket.IO room names used as broadcast channels
+GLOBAL_CHANNEL = "global"  # global_stats summary, every client joins on connect
+ALL_ROOMS_CHANNEL = "rooms:all"  # full live_rooms deltas and all agent logs
+
+
+def room_channel(room_id: str) -> str:
+    return f"room:{room_id}"
+
+
+def binary_channel(channel: str) -> str:
+    """Socket.IO room carrying the MessagePack variant of ``channel``."""
+    return f"{channel}#msgpack"
+
+
+class SubscriptionRegistry:
+    """Book-keeping of which clients watch which channels.
+
+    Socket.IO rooms do the actual fan-out; this registry only counts
+    subscribers per channel so the broadcaster can skip encoding and
+    emitting updates for rooms nobody is watching.
+
+    With several workers, each worker reports the channels its own
+    clients watch (``local_channels``) and the simulation owner records
+    them with ``set_remote``, so it keeps emitting to channels whose
+    subscribers are connected elsewhere. Workers re-send their channels
+    periodically; ``expire_remote`` forgets workers that stopped doing
+    so (e.g. crashed without saying goodbye).
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._by_sid: Dict[str, Set[str]] = {}
+        self._counts: Counter = Counter()
+        self._remote: Dict[str, Set[str]] = {}
+        self._remote_counts: Counter = Counter()
+        self._remote_seen: Dict[str, float] = {}
+
+    def subscribe(self, sid: str, channel: str) -> bool:
+        channels = self._by_sid.setdefault(sid, set())
+        if channel in channels:
+            return False
+        channels.add(channel)
+        self._counts[channel] += 1
+        return True
+
+    def unsubscribe(self, sid: str, channel: str) -> bool:
+        channels = self._by_sid.get(sid)
+        if not channels or channel not in channels:
+            return False
+        channels.remove(channel)
+        self._release(channel)
+        return True
+
+    def drop(self, sid: str) -> List[str]:
+        channels = self._by_sid.pop(sid, set())
+        for channel in channels:
+            self._release(channel)
+        return list(channels)
+
+    def _release(self, channel: str):
+        self._counts[channel] -= 1
+        if self._counts[channel] <= 0:
+            del self._counts[channel]
+
+    def has_subscribers(self, channel: str) -> bool:
+        return channel in self._counts or channel in self._remote_counts
+
+    def channels(self, sid: str) -> Set[str]:
+        return set(self._by_sid.get(sid, ()))
+
+    def local_channels(self) -> Set[str]:
+        return set(self._counts)
+
+    def set_remote(self, worker: str, channels: Iterable[str]):
+        self.drop_remote(worker)
+        channels = set(channels)
+        if channels:
+            self._remote[worker] = channels
+            self._remote_counts.update(channels)
+            self._remote_seen[worker] = self.clock()
+
+    def drop_remote(self, worker: str):
+        self._remote_seen.pop(worker, None)
+        self._remote_counts.subtract(self._remote.pop(worker, ()))
+        self._remote_counts += Counter()  # 去掉计数为 0 的频道
+
+    def expire_remote(self, max_age: float) -> List[str]:
+        """Drop the channels of workers not refreshed in the last ``max_age`` seconds; return those workers."""
+        cutoff = self.clock() - max_age
+        expired = [worker for worker, seen in self._remote_seen.items() if seen < cutoff]
+        for worker in expired:
+            self.drop_remote(worker)
+        return expired
+
+    def watched_rooms(self, room_ids: Iterable[str]) -> List[str]:
+        """Return the room ids from ``room_ids`` that have at least one per-room subscriber, in any encoding."""
+        return [
+            room_id
+            for room_id in room_ids
+            if self.has_subscribers(room_channel(room_id)) or self.has_subscribers(binary_channel(room_channel(room_id)))
+        ]
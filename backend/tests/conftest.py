@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "test")
+# 不在导入时打开历史存储或快照文件
+os.environ["HISTORY_DIR"] = ""
+os.environ["SNAPSHOT_PATH"] = ""
+
+import main  # noqa: E402
+from anomaly_detector import AnomalyDetector  # noqa: E402
+from delta_sync import RoomChanges, RoomDeltaEncoder  # noqa: E402
+from effect_scheduler import ActiveEffects  # noqa: E402
+from log_store import AgentLogStore  # noqa: E402
+from replay import RandomStreams  # noqa: E402
+from rolling_aggregates import LiveAggregates  # noqa: E402
+
+SEED = 20240601
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(monkeypatch):
+    """Fresh module-level state in ``main`` for every test, seeded rooms built on demand."""
+    monkeypatch.setattr(main, "random_streams", RandomStreams(SEED))
+    monkeypatch.setattr(main, "active_effects", ActiveEffects())
+    monkeypatch.setattr(main, "live_aggregates", LiveAggregates())
+    monkeypatch.setattr(main, "anomaly_detector", AnomalyDetector())
+    monkeypatch.setattr(main, "agent_logs", AgentLogStore(capacity=10000))
+    monkeypatch.setattr(main, "room_delta_encoder", RoomDeltaEncoder())
+    monkeypatch.setattr(main, "room_changes", RoomChanges())
+    monkeypatch.setattr(main, "simulation_engine", None)
+    monkeypatch.setattr(main, "global_stats", dict(main.global_stats, total_sales=0, total_profit=0))
+    main.live_rooms.clear()
+    yield
+    main.live_rooms.clear()
+
+
+@pytest.fixture
+def build_rooms(monkeypatch):
+    def build(rooms: int = 5, products: int = 0):
+        monkeypatch.setattr(main, "SIMULATION_ROOMS", rooms)
+        monkeypatch.setattr(main, "SIMULATION_PRODUCTS_PER_ROOM", products)
+        main.live_rooms.clear()
+        main.create_live_rooms()
+        main.live_aggregates.load(main.live_rooms)
+        return main.live_rooms
+
+    return build
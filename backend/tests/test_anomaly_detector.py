@@ -0,0 +1,30 @@
+import numpy as np
+
+from anomaly_detector import SALES_MIN_STD, EwmaDetector
+
+SLOTS = np.arange(1)
+
+
+def feed(detector, values):
+    flagged = []
+    for tick, value in enumerate(values):
+        positions, _ = detector.update(SLOTS, np.array([value]))
+        if len(positions):
+            flagged.append(tick)
+    return flagged
+
+
+def test_first_sales_after_quiet_ticks_are_not_flagged():
+    detector = EwmaDetector(warmup=10, min_std=SALES_MIN_STD)
+    # 开卖前的安静 tick 方差为 0，不计入预热
+    flagged = feed(detector, [0.0] * 30 + [300.0, 0.0, 450.0, 120.0])
+    assert flagged == []
+    assert detector.warm[0] < detector.warmup
+
+
+def test_spike_flagged_once_warmed_up_on_varying_samples():
+    detector = EwmaDetector(warmup=10, min_std=SALES_MIN_STD)
+    rng = np.random.default_rng(7)
+    normal = list(rng.normal(200.0, 20.0, 40))
+    flagged = feed(detector, [0.0] * 5 + normal + [2000.0])
+    assert flagged == [5 + len(normal)]
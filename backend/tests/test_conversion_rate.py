@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+import main
+from effect_scheduler import CONVERSION_OFFSET, MAX_CONVERSION_RATE, MIN_CONVERSION_RATE
+from event_triggers import get_event_by_id
+from vector_engine import VectorizedSimulation
+
+
+@pytest.mark.parametrize("offset, expected", [(5.0, MAX_CONVERSION_RATE), (-5.0, MIN_CONVERSION_RATE)])
+def test_engines_share_the_conversion_clamp(build_rooms, offset, expected):
+    rooms = build_rooms(rooms=3, products=2)
+    for room_id in rooms:
+        main.active_effects.add(room_id, "test", "test", CONVERSION_OFFSET, offset, 60)
+
+    main.simulate_tick()
+    assert [room.conversion_rate for room in rooms.values()] == [expected] * 3
+
+    engine = VectorizedSimulation(rooms, rng=np.random.default_rng(1), active_effects=main.active_effects)
+    engine.tick()
+    engine.write_back()
+    assert [room.conversion_rate for room in rooms.values()] == [expected] * 3
+
+
+@pytest.mark.parametrize("event_id, start, expected", [
+    ("host_performance", 0.99, MAX_CONVERSION_RATE),
+    ("host_mistake", 0.001, MIN_CONVERSION_RATE),
+])
+def test_event_conversion_effects_use_the_same_clamp(build_rooms, event_id, start, expected):
+    rooms = build_rooms(rooms=1)
+    room = rooms["room_1"]
+    room.conversion_rate = start
+    main.apply_event(get_event_by_id(event_id), "room_1")
+    assert room.conversion_rate == expected
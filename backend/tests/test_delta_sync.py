@@ -0,0 +1,83 @@
+import numpy as np
+
+import main
+from delta_sync import RoomDeltaEncoder
+from event_triggers import get_event_by_id
+from rolling_aggregates import LiveAggregates
+from vector_engine import VectorizedSimulation
+
+
+def rooms_with_actions(build_rooms):
+    rooms = build_rooms(rooms=3, products=4)
+    rooms["room_1"].products[0].ai_actions = ("限时折扣",)
+    return rooms
+
+
+def test_no_patches_after_load(build_rooms):
+    rooms = rooms_with_actions(build_rooms)
+    leader = RoomDeltaEncoder()
+    leader.diff(rooms)
+
+    follower = RoomDeltaEncoder()
+    follower.load(leader.snapshot(), leader.room_seqs())
+    assert follower.diff(rooms) is None
+
+
+def test_no_patches_after_apply(build_rooms):
+    rooms = rooms_with_actions(build_rooms)
+    leader = RoomDeltaEncoder()
+    follower = RoomDeltaEncoder()
+    follower.apply(leader.diff(rooms))
+    assert follower.diff(rooms) is None
+
+
+def test_patch_after_load_holds_only_changed_fields(build_rooms):
+    rooms = rooms_with_actions(build_rooms)
+    leader = RoomDeltaEncoder()
+    leader.diff(rooms)
+    follower = RoomDeltaEncoder()
+    follower.load(leader.snapshot())
+
+    product = rooms["room_1"].products[0]
+    product.stock -= 1
+    delta = follower.diff(rooms)
+    assert delta["rooms"] == {"room_1": {"products": {product.id: {"stock": product.stock}}}}
+
+    # 之后走缓存路径，ai_actions 仍以列表发送
+    product.ai_actions = ("限时折扣", "加推")
+    delta = follower.diff(rooms)
+    assert delta["rooms"]["room_1"]["products"][product.id] == {"ai_actions": ["限时折扣", "加推"]}
+    assert follower.room_state("room_1")["products"][0] == product.to_dict()
+
+
+def test_marked_diff_matches_full_scan(monkeypatch, build_rooms):
+    now = [0.0]
+    monkeypatch.setattr(main, "live_aggregates", LiveAggregates(windows=(60,), bucket_seconds=10.0, clock=lambda: now[0]))
+    rooms = build_rooms(rooms=6, products=4)
+    main.live_aggregates.load(rooms)
+    engine = VectorizedSimulation(rooms, rng=np.random.default_rng(3), active_effects=main.active_effects)
+    full = RoomDeltaEncoder()
+
+    def compare():
+        marked_delta = main.room_delta_encoder.diff(rooms, main.room_changes)
+        full_delta = full.diff(rooms)
+        assert (marked_delta or {}).get("rooms") == (full_delta or {}).get("rooms")
+
+    compare()
+    for _ in range(3):
+        main.simulate_tick()
+        compare()
+    monkeypatch.setattr(main, "simulation_engine", engine)
+    main.apply_event(get_event_by_id("stock_shortage"), "room_2")
+    compare()
+    for _ in range(3):
+        now[0] += 2.0
+        main.live_aggregates.advance()
+        main.simulate_tick_vectorized(engine)
+        compare()
+    now[0] += 10.0
+    main.live_aggregates.advance()
+    main.live_aggregates.publish(rooms, main.global_stats, main.room_changes)
+    compare()
+
+    assert main.room_delta_encoder.snapshot()["rooms"] == full.snapshot()["rooms"]
@@ -0,0 +1,40 @@
+import asyncio
+
+import main
+from event_triggers import get_event_by_id
+
+
+def capture_broadcast(monkeypatch):
+    sent = []
+
+    async def broadcast_event_results(event_logs):
+        sent.extend(event_logs)
+
+    monkeypatch.setattr(main, "broadcast_event_results", broadcast_event_results)
+    return sent
+
+
+def test_bulk_trigger_emits_each_log_once(monkeypatch, build_rooms):
+    build_rooms()
+    # 先让日志存储里有无关的 tick 日志，确保它们不会被当作事件日志再发一遍
+    main.simulate_tick()
+    earlier = main.agent_logs.tail(10000)
+    sent = capture_broadcast(monkeypatch)
+
+    requests = [main.EventTriggerRequest(event_id="host_performance", room_id="room_1")] * 3
+    result = asyncio.run(main.trigger_events(requests))
+
+    assert result["triggered"] == 3
+    assert len({id(log) for log in sent}) == len(sent)
+    assert not any(log is old for log in sent for old in earlier)
+    assert all(log["source"] == "triggered_event_effect" for log in sent)
+    assert not any("source" in log for log in earlier)
+
+
+def test_apply_event_effects_returns_only_its_own_logs(build_rooms):
+    room = build_rooms()["room_1"]
+    main.simulate_tick()
+    before = len(main.agent_logs)
+    logs = main.apply_event(get_event_by_id("stock_shortage"), room.id)
+    assert len(main.agent_logs) == before + len(logs)
+    assert main.agent_logs.tail(len(logs)) == logs
@@ -0,0 +1,230 @@
+import asyncio
+
+import pytest
+
+import main
+from delta_sync import RoomDeltaEncoder
+from log_store import AgentLogStore
+from message_bus import MemoryTransport, StateBus
+from subscriptions import SubscriptionRegistry, room_channel
+
+
+@pytest.fixture
+def cluster(monkeypatch):
+    """``main`` and a peer worker sharing one in-memory state bus."""
+    transport = MemoryTransport()
+    monkeypatch.setattr(main, "state_bus", StateBus(transport))
+    monkeypatch.setattr(main, "subscriptions", SubscriptionRegistry())
+    monkeypatch.setattr(main, "pending_replies", {})
+    monkeypatch.setattr(main, "published_interest", None)
+    return StateBus(transport)
+
+
+def set_role(monkeypatch, owner: bool):
+    monkeypatch.setattr(main, "is_simulation_owner", owner)
+
+
+async def next_message(peer, queue, kind):
+    # peer.listen() 在后台收集消息，这里按类型等下一条
+    while True:
+        message = await asyncio.wait_for(queue.get(), timeout=1.0)
+        if message["type"] == kind:
+            return message
+
+
+async def run_with_peer(peer, scenario):
+    queue = asyncio.Queue()
+
+    async def collect():
+        async for message in peer.listen():
+            queue.put_nowait(message)
+
+    # 先让 peer 订阅，main 连接后发出的消息它都能收到；两边都订阅后再开始场景
+    tasks = [asyncio.create_task(collect())]
+    await asyncio.sleep(0)
+    tasks.append(asyncio.create_task(main.listen_state_bus()))
+    await asyncio.sleep(0)
+    try:
+        return await scenario(queue)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def until(predicate):
+    for _ in range(100):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not reached")
+
+
+def owner_rooms(build_rooms):
+    # 所有者的直播间；跟随者（main）从空状态开始镜像
+    rooms = dict(build_rooms(rooms=3, products=2))
+    main.live_rooms.clear()
+    return rooms
+
+
+def test_buses_on_one_transport_see_each_other(cluster):
+    bus = main.state_bus
+    assert bus.worker_id != cluster.worker_id
+
+    async def scenario(queue):
+        await bus.publish({"type": "ping"})
+        return await next_message(cluster, queue, "ping")
+
+    assert asyncio.run(run_with_peer(cluster, scenario))["worker"] == bus.worker_id
+
+
+def test_follower_mirrors_owner_delta(monkeypatch, cluster, build_rooms):
+    set_role(monkeypatch, owner=False)
+    rooms = owner_rooms(build_rooms)
+    encoder = RoomDeltaEncoder()
+
+    async def scenario(queue):
+        await cluster.publish({"type": "delta", "delta": encoder.diff(rooms)})
+        await until(lambda: len(main.live_rooms) == 3)
+        rooms["room_2"].products[0].stock -= 1
+        await cluster.publish({"type": "delta", "delta": encoder.diff(rooms)})
+        await until(lambda: main.room_delta_encoder.seq == encoder.seq)
+
+    asyncio.run(run_with_peer(cluster, scenario))
+    assert main.live_rooms["room_2"].products[0].stock == rooms["room_2"].products[0].stock
+    assert main.room_delta_encoder.snapshot()["rooms"] == encoder.snapshot()["rooms"]
+
+
+def test_follower_requests_sync_once_subscribed(monkeypatch, cluster):
+    set_role(monkeypatch, owner=False)
+    main.subscriptions.subscribe("sid", room_channel("room_1"))
+
+    async def scenario(queue):
+        return await next_message(cluster, queue, "sync_request")
+
+    request = asyncio.run(run_with_peer(cluster, scenario))
+    assert request["channels"] == [room_channel("room_1")]
+
+
+def test_follower_requests_sync_after_gap(monkeypatch, cluster, build_rooms):
+    set_role(monkeypatch, owner=False)
+    rooms = owner_rooms(build_rooms)
+    encoder = RoomDeltaEncoder()
+    encoder.diff(rooms)  # 跟随者错过了第一个 delta
+    rooms["room_1"].viewers += 10
+
+    async def scenario(queue):
+        await next_message(cluster, queue, "sync_request")  # 连接时的同步请求
+        await cluster.publish({"type": "delta", "delta": encoder.diff(rooms)})
+        request = await next_message(cluster, queue, "sync_request")
+        await cluster.publish({
+            "type": "snapshot",
+            "snapshot": encoder.snapshot(),
+            "room_seqs": encoder.room_seqs(),
+            "global_stats": {"total_sales": 42},
+            "logs": [],
+        })
+        await until(lambda: main.room_delta_encoder.seq == encoder.seq)
+        return request
+
+    request = asyncio.run(run_with_peer(cluster, scenario))
+    assert request["worker"] == main.state_bus.worker_id
+    assert main.live_rooms["room_1"].viewers == rooms["room_1"].viewers
+    assert main.global_stats == {"total_sales": 42}
+
+
+def test_follower_mirrors_logs_sharing_a_timestamp(monkeypatch, cluster):
+    set_role(monkeypatch, owner=False)
+    owner_logs = AgentLogStore()
+    # 模拟时钟下同一 tick 的日志时间戳相同
+    logs = [{"timestamp": "2024-06-01T00:00:00", "room_id": f"room_{i}", "message": str(i)} for i in range(6)]
+    for log in logs:
+        owner_logs.append(log)
+
+    async def scenario(queue):
+        await cluster.publish({"type": "logs", "logs": logs[:3]})
+        await cluster.publish({"type": "logs", "logs": logs[3:]})
+        # 重新同步的快照与已镜像的日志重叠
+        await cluster.publish({
+            "type": "snapshot",
+            "snapshot": RoomDeltaEncoder().snapshot(),
+            "global_stats": {"synced": True},
+            "logs": owner_logs.tail(4),
+        })
+        await until(lambda: main.global_stats.get("synced"))
+
+    asyncio.run(run_with_peer(cluster, scenario))
+    assert [log["message"] for log in main.agent_logs] == [str(i) for i in range(6)]
+    assert main.agent_logs.last_seq == owner_logs.last_seq
+
+
+def test_owner_replies_to_forwarded_trigger_event(monkeypatch, cluster, build_rooms):
+    set_role(monkeypatch, owner=True)
+    build_rooms(rooms=2)
+
+    async def scenario(queue):
+        await cluster.publish({
+            "type": "command",
+            "command": "trigger_event",
+            "args": {"event_id": "host_performance", "room_id": "room_1"},
+            "request_id": "r1",
+        })
+        return await next_message(cluster, queue, "reply")
+
+    reply = asyncio.run(run_with_peer(cluster, scenario))
+    assert reply["request_id"] == "r1"
+    assert reply["result"]["success"] is True
+
+
+def test_follower_trigger_event_waits_for_owner_reply(monkeypatch, cluster):
+    set_role(monkeypatch, owner=False)
+
+    async def scenario(queue):
+        forwarded = asyncio.create_task(main.trigger_event("host_performance", "room_1"))
+        command = await next_message(cluster, queue, "command")
+        await cluster.publish({"type": "reply", "request_id": command["request_id"], "result": {"success": True}})
+        return command, await forwarded
+
+    command, result = asyncio.run(run_with_peer(cluster, scenario))
+    assert command["args"] == {"event_id": "host_performance", "room_id": "room_1"}
+    assert result == {"success": True}
+
+
+def test_interest_reaches_owner(monkeypatch, cluster):
+    set_role(monkeypatch, owner=True)
+    channel = room_channel("room_1")
+
+    async def scenario(queue):
+        await cluster.publish({"type": "interest", "channels": [channel]})
+        await until(lambda: main.subscriptions.has_subscribers(channel))
+        await cluster.publish({"type": "interest", "channels": []})
+        await until(lambda: not main.subscriptions.has_subscribers(channel))
+
+    asyncio.run(run_with_peer(cluster, scenario))
+
+
+def test_stopped_worker_interest_dropped(monkeypatch, cluster):
+    set_role(monkeypatch, owner=True)
+    channel = room_channel("room_1")
+
+    async def scenario(queue):
+        await cluster.publish({"type": "interest", "channels": [channel]})
+        await until(lambda: main.subscriptions.has_subscribers(channel))
+        await cluster.publish({"type": "worker_stopped"})
+        await until(lambda: not main.subscriptions.has_subscribers(channel))
+
+    asyncio.run(run_with_peer(cluster, scenario))
+
+
+def test_unrefreshed_remote_interest_expires():
+    now = [0.0]
+    registry = SubscriptionRegistry(clock=lambda: now[0])
+    registry.set_remote("a", [room_channel("room_1")])
+    registry.set_remote("b", [room_channel("room_1"), room_channel("room_2")])
+    now[0] = 20.0
+    registry.set_remote("a", [room_channel("room_1")])  # 只有 a 刷新了
+    now[0] = 35.0
+
+    assert registry.expire_remote(30.0) == ["b"]
+    assert registry.has_subscribers(room_channel("room_1"))
+    assert not registry.has_subscribers(room_channel("room_2"))
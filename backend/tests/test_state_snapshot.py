@@ -0,0 +1,65 @@
+import asyncio
+import os
+import threading
+import time
+
+import msgpack
+
+import main
+from state_snapshot import read_snapshot, write_snapshot
+
+
+def test_concurrent_writes_leave_one_complete_snapshot(tmp_path):
+    path = str(tmp_path / "snapshot.msgpack")
+    states = [{"version": 1, "writer": writer, "payload": [writer] * 50000} for writer in range(4)]
+
+    errors = []
+
+    def write(state):
+        try:
+            for _ in range(5):
+                write_snapshot(path, state)
+        except Exception as e:  # 线程里的异常不会让测试失败，收集起来再断言
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(state,)) for state in states]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    with open(path, "rb") as f:
+        state = msgpack.unpackb(f.read(), raw=False)
+    assert state in states
+    assert os.listdir(tmp_path) == ["snapshot.msgpack"]
+
+
+def test_shutdown_waits_for_running_snapshot_write(monkeypatch, tmp_path, build_rooms):
+    build_rooms(rooms=2, products=2)
+    path = str(tmp_path / "snapshot.msgpack")
+    monkeypatch.setattr(main, "SNAPSHOT_PATH", path)
+    monkeypatch.setattr(main, "snapshot_write", None)
+    monkeypatch.setattr(main.app.state, "snapshot_task", None, raising=False)
+    started = threading.Event()
+    writes = []
+
+    def slow_write(path, state):
+        started.set()
+        time.sleep(0.2)
+        writes.append("periodic")
+        return write_snapshot(path, state)
+
+    monkeypatch.setattr(main, "write_snapshot", slow_write)
+
+    async def scenario():
+        main.app.state.snapshot_task = asyncio.create_task(main.save_snapshot())
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        await main.stop_snapshots()
+        # 周期写入结束后才轮到最终快照
+        writes.append("final")
+
+    asyncio.run(scenario())
+    assert writes == ["periodic", "final"]
+    assert main.app.state.snapshot_task is None
+    assert len(read_snapshot(path)["rooms"]) == 2
@@ -0,0 +1,139 @@
+import asyncio
+import traceback
+from typing import Awaitable, Callable, Optional
+
+from metrics import registry as metrics
+
+# 超时策略：skip 丢弃错过的 tick 并对齐到下一个周期；catch_up 立即补跑错过的 tick（有上限）
+SKIP = "skip"
+CATCH_UP = "catch_up"
+POLICIES = (SKIP, CATCH_UP)
+
+TICK_LATENESS = metrics.histogram(
+    "livepulse_tick_lateness_seconds", "How long after its scheduled deadline a tick started"
+)
+TICK_OVERRUNS = metrics.counter(
+    "livepulse_tick_overruns_total", "Ticks that finished after the next tick was due"
+)
+TICKS_SKIPPED = metrics.counter(
+    "livepulse_ticks_skipped_total", "Scheduled ticks dropped by the skip policy or the catch-up limit"
+)
+TICK_ERRORS = metrics.counter(
+    "livepulse_tick_errors_total", "Ticks that raised an exception"
+)
+
+
+class TickScheduler:
+    """Runs an async ``tick`` callback at a fixed rate against absolute deadlines.
+
+    Deadlines are ``start + n * period`` on the event loop clock, so the
+    time a tick takes does not push later ticks back. A tick that is still
+    running when the next deadline passes is an overrun. With ``skip``
+    the missed deadlines are dropped and the scheduler waits for the next
+    one on the grid. With ``catch_up`` the missed ticks run back to back,
+    at most ``max_catch_up`` of them; any older backlog is dropped.
+
+    An exception in ``tick`` is printed with its traceback and counted,
+    and the scheduler carries on at the next deadline.
+
+    With ``accelerated`` there are no deadlines: ticks run back to back,
+    only yielding to the event loop between them, so a simulation on a
+    simulated clock runs as fast as the CPU allows. ``max_ticks`` stops
+    the scheduler after that many ticks.
+    """
+
+    def __init__(
+        self,
+        tick: Callable[[], Awaitable[None]],
+        period: float = 2.0,
+        policy: str = SKIP,
+        max_catch_up: int = 3,
+        name: str = "tick",
+        accelerated: bool = False,
+        max_ticks: Optional[int] = None,
+    ):
+        if period <= 0:
+            raise ValueError("period must be positive")
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown tick policy '{policy}', expected one of {POLICIES}")
+        self.tick = tick
+        self.period = period
+        self.policy = policy
+        self.max_catch_up = max(0, max_catch_up)
+        self.name = name
+        self.accelerated = accelerated
+        self.max_ticks = max_ticks
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.errors = 0
+        self._stop_event: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._stop_event is not None and not self._stop_event.is_set()
+
+    def stop(self):
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        deadline = loop.time()
+        while not self._stop_event.is_set():
+            if self.max_ticks is not None and self.ticks >= self.max_ticks:
+                self._stop_event.set()
+                break
+            started = loop.time()
+            if not self.accelerated:
+                TICK_LATENESS.observe(max(0.0, started - deadline))
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                TICK_ERRORS.inc()
+                print(f"Error in {self.name} #{self.ticks}: {e}")
+                traceback.print_exc()
+            self.ticks += 1
+
+            if self.accelerated:
+                await asyncio.sleep(0)
+                continue
+            finished = loop.time()
+            deadline = self._next_deadline(deadline, started, finished)
+            delay = deadline - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._stop_event.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                # 补跑时也让出一次事件循环，避免连续 tick 饿死 I/O
+                await asyncio.sleep(0)
+
+    def _next_deadline(self, deadline: float, started: float, finished: float) -> float:
+        deadline += self.period
+        if finished <= deadline:
+            return deadline
+
+        # 已错过的截止时间个数（包括刚刚错过的这一个）
+        missed = int((finished - deadline) // self.period) + 1
+        # 补跑中的 tick 本来就晚于截止时间开始，不算新的超时
+        if started < deadline:
+            self.overruns += 1
+            TICK_OVERRUNS.inc()
+            print(
+                f"{self.name} overrun: tick took {finished - started:.3f}s "
+                f"(period {self.period:.3f}s), {missed} deadline(s) missed, policy={self.policy}"
+            )
+        if self.policy == SKIP:
+            dropped = missed
+        else:
+            dropped = max(0, missed - self.max_catch_up)
+        if dropped:
+            self.skipped += dropped
+            TICKS_SKIPPED.inc(dropped)
+        return deadline + dropped * self.period
@@ -0,0 +1,634 @@
+import json
+import math
+import os
+from operator import attrgetter
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from metrics import registry as metrics
+
+# 每张表的列（名称, dtype）；每列一个文件，按行追加
+ROOM_COLUMNS = (
+    ("ts", "<f8"),
+    ("room", "<i4"),
+    ("viewers", "<i8"),
+    ("sales", "<f8"),
+    ("conversion_rate", "<f8"),
+)
+PRODUCT_COLUMNS = (
+    ("ts", "<f8"),
+    ("room", "<i4"),
+    ("product", "<i4"),
+    ("stock", "<i4"),
+    ("sales", "<i4"),
+)
+TABLES = {"rooms": ROOM_COLUMNS, "products": PRODUCT_COLUMNS}
+# 每张表的键列与可查询的指标列
+KEY_COLUMNS = {"rooms": ("room",), "products": ("room", "product")}
+METRICS = {"rooms": ("viewers", "sales", "conversion_rate"), "products": ("stock", "sales")}
+
+# 汇总（rollup）层级：每个时间桶每个键一行，记录各指标的 min / max / sum / last 与点数
+DEFAULT_ROLLUPS = (10, 60, 600)
+ROLLUP_STATS = ("min", "max", "sum", "last")
+
+SEGMENT_PREFIX = "seg-"
+META_FILE = "meta.json"
+KEYS_FILE = "keys.json"
+INITIAL_CAPACITY = 65536  # 新分段每列预分配的行数，写满后翻倍扩容
+MAX_PENDING_WRITES = 4  # 写线程积压超过这么多批次时丢弃新批次，不让内存无限增长
+
+HISTORY_APPEND_SECONDS = metrics.histogram(
+    "livepulse_history_append_seconds", "Time spent writing one tick batch to the history segments"
+)
+HISTORY_ROWS = metrics.counter(
+    "livepulse_history_rows_total", "Rows appended to the history store", ("table",)
+)
+HISTORY_BATCHES_DROPPED = metrics.counter(
+    "livepulse_history_batches_dropped_total", "Tick batches dropped because the history writer fell behind"
+)
+
+Batch = Dict[str, Dict[str, np.ndarray]]
+
+_viewers = attrgetter("viewers")
+_sales = attrgetter("sales")
+_conversion_rate = attrgetter("conversion_rate")
+_stock = attrgetter("stock")
+_product_sales = attrgetter("sales")
+
+
+def rollup_label(width: float) -> str:
+    width = int(width)
+    if width % 3600 == 0:
+        return f"{width // 3600}h"
+    if width % 60 == 0:
+        return f"{width // 60}m"
+    return f"{width}s"
+
+
+def rollup_table(table: str, width: float) -> str:
+    return f"{table}_{rollup_label(width)}"
+
+
+def rollup_columns(table: str) -> Tuple[Tuple[str, str], ...]:
+    key_columns = tuple((name, dtype) for name, dtype in TABLES[table] if name in KEY_COLUMNS[table])
+    stat_columns = tuple((f"{metric}_{stat}", "<f8") for metric in METRICS[table] for stat in ROLLUP_STATS)
+    return (("ts", "<f8"),) + key_columns + (("count", "<i4"),) + stat_columns
+
+
+def _write_json(path: str, data):
+    # 先写临时文件再替换，崩溃时不会留下半个 JSON
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class _Column:
+    """One memory-mapped column file that grows by doubling."""
+
+    def __init__(self, path: str, dtype: str, rows: int, capacity: int):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        capacity = max(capacity, rows, 1)
+        if not os.path.exists(path) or os.path.getsize(path) < capacity * self.dtype.itemsize:
+            with open(path, "ab") as f:
+                f.truncate(capacity * self.dtype.itemsize)
+        self.capacity = os.path.getsize(path) // self.dtype.itemsize
+        self.array = np.memmap(path, dtype=self.dtype, mode="r+", shape=(self.capacity,))
+
+    def reserve(self, rows: int):
+        if rows <= self.capacity:
+            return
+        capacity = self.capacity
+        while capacity < rows:
+            capacity *= 2
+        self.array.flush()
+        del self.array
+        os.truncate(self.path, capacity * self.dtype.itemsize)
+        self.capacity = capacity
+        self.array = np.memmap(self.path, dtype=self.dtype, mode="r+", shape=(capacity,))
+
+    def close(self, rows: int):
+        """Flush and cut the preallocated tail off the file."""
+        self.array.flush()
+        del self.array
+        os.truncate(self.path, rows * self.dtype.itemsize)
+
+
+class Segment:
+    """Time slice ``[start, end)`` of the history: one column file per table column plus ``meta.json``.
+
+    ``rows`` in ``meta.json`` is updated after the column data of a batch
+    is written, so readers (and a restart after a crash) only ever see
+    complete batches. Closed segments are trimmed to their row count and
+    opened read-only.
+    """
+
+    def __init__(
+        self, path: str, start: float, end: float, schema: Dict = TABLES, capacity: int = INITIAL_CAPACITY
+    ):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.schema = schema
+        self.closed = False
+        self.rows = {table: 0 for table in schema}
+        meta_path = os.path.join(path, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            self.rows.update(meta["rows"])
+            self.closed = meta.get("closed", False)
+        else:
+            os.makedirs(path, exist_ok=True)
+        self.capacity = capacity
+        self.columns: Dict[str, Dict[str, _Column]] = {}
+        if not self.closed:
+            self.reopen()
+
+    def reopen(self):
+        """Map the column files for appending (again); a closed segment regains its spare capacity."""
+        for table, columns in self.schema.items():
+            self.columns[table] = {
+                name: _Column(self._column_path(table, name), dtype, self.rows[table], self.capacity)
+                for name, dtype in columns
+            }
+        self.closed = False
+        self._write_meta()
+
+    def _column_path(self, table: str, column: str) -> str:
+        return os.path.join(self.path, f"{table}.{column}.bin")
+
+    def _write_meta(self):
+        _write_json(
+            os.path.join(self.path, META_FILE),
+            {"start": self.start, "end": self.end, "rows": self.rows, "closed": self.closed},
+        )
+
+    def append(self, batch: Batch):
+        for table, values in batch.items():
+            count = len(values["ts"])
+            if not count:
+                continue
+            offset = self.rows[table]
+            for name, column in self.columns[table].items():
+                column.reserve(offset + count)
+                column.array[offset:offset + count] = values[name]
+        # 列数据写完后再提交行数
+        for table, values in batch.items():
+            self.rows[table] += len(values["ts"])
+        self._write_meta()
+
+    def read(self, table: str) -> Dict[str, np.ndarray]:
+        rows = self.rows.get(table, 0)
+        if not self.closed:
+            return {name: column.array[:rows] for name, column in self.columns[table].items()}
+        return {
+            name: np.memmap(self._column_path(table, name), dtype=dtype, mode="r", shape=(rows,))
+            if rows else np.empty(0, dtype=dtype)
+            for name, dtype in self.schema[table]
+        }
+
+    def close(self):
+        if self.closed:
+            return
+        for table, columns in self.columns.items():
+            for column in columns.values():
+                column.close(self.rows[table])
+        self.columns = {}
+        self.closed = True
+        self._write_meta()
+
+
+class _Rollup:
+    """The open time bucket of one rollup level, updated in place by each batch.
+
+    Per-key aggregates live in arrays indexed by key id. When a batch
+    falls into a later bucket, ``update`` returns the finished bucket's
+    rows (only keys that had points) and starts the new one.
+    """
+
+    def __init__(self, table: str, width: float):
+        self.source = table
+        self.width = width
+        self.name = rollup_table(table, width)
+        self.key = KEY_COLUMNS[table][-1]
+        self.metrics = METRICS[table]
+        self.start: Optional[float] = None
+        self.count = np.zeros(0, dtype=np.int32)
+        self.rooms = np.zeros(0, dtype=np.int32)
+        self.stats = {f"{metric}_{stat}": np.zeros(0) for metric in self.metrics for stat in ROLLUP_STATS}
+
+    def _grow(self, size: int):
+        if size <= len(self.count):
+            return
+        size = max(size, 2 * len(self.count))
+        pad = size - len(self.count)
+        self.count = np.concatenate((self.count, np.zeros(pad, dtype=np.int32)))
+        self.rooms = np.concatenate((self.rooms, np.zeros(pad, dtype=np.int32)))
+        for name, values in self.stats.items():
+            self.stats[name] = np.concatenate((values, np.zeros(pad)))
+
+    def update(self, values: Dict[str, np.ndarray]) -> Optional[Dict[str, np.ndarray]]:
+        if not len(values["ts"]):
+            return None
+        bucket = math.floor(values["ts"][0] / self.width) * self.width
+        rows = self.drain() if self.start is not None and bucket != self.start else None
+        self.start = bucket
+
+        keys = values[self.key]
+        self._grow(int(keys.max()) + 1)
+        # 本桶第一个点直接作为初值，避免每个桶都要整体重置 min / max / sum
+        first = self.count[keys] == 0
+        stats = self.stats
+        for metric in self.metrics:
+            metric_values = values[metric].astype(np.float64)
+            lowest, highest, total = stats[f"{metric}_min"], stats[f"{metric}_max"], stats[f"{metric}_sum"]
+            lowest[keys] = np.where(first, metric_values, np.minimum(lowest[keys], metric_values))
+            highest[keys] = np.where(first, metric_values, np.maximum(highest[keys], metric_values))
+            total[keys] = np.where(first, 0.0, total[keys]) + metric_values
+            stats[f"{metric}_last"][keys] = metric_values
+        self.count[keys] += 1
+        if self.key == "product":
+            self.rooms[keys] = values["room"]
+        return rows
+
+    def _rows(self, keys: np.ndarray) -> Dict[str, np.ndarray]:
+        rows = {
+            "ts": np.full(len(keys), self.start, dtype=np.float64),
+            self.key: keys.astype(np.int32),
+            "count": self.count[keys],
+        }
+        if self.key == "product":
+            rows["room"] = self.rooms[keys]
+        for name, values in self.stats.items():
+            rows[name] = values[keys]
+        return rows
+
+    def drain(self) -> Optional[Dict[str, np.ndarray]]:
+        """Rows of the open bucket; the bucket is closed afterwards."""
+        if self.start is None:
+            return None
+        keys = np.flatnonzero(self.count)
+        rows = self._rows(keys) if len(keys) else None
+        self.count[:] = 0
+        self.start = None
+        return rows
+
+    def current(self, key: int) -> Optional[Dict[str, np.ndarray]]:
+        """The open bucket's row for one key, so queries include the points not yet rolled up."""
+        if self.start is None or key >= len(self.count) or not self.count[key]:
+            return None
+        return self._rows(np.array([key]))
+
+
+def downsample(rows: Dict[str, np.ndarray], metrics: Sequence[str], resolution: float, raw: bool) -> Dict:
+    """Merge time-ordered raw or rollup rows into ``resolution``-second buckets.
+
+    Returns bucket start times and, per metric, the min / max / avg / last
+    of every bucket. Rollup rows are merged by their stats (min of mins,
+    sum of sums, ...), so a bucket stored twice is still counted once.
+    """
+    ts = rows["ts"]
+    if not len(ts):
+        return {"timestamps": [], "series": {metric: {"min": [], "max": [], "avg": [], "last": []} for metric in metrics}}
+    buckets = np.floor(ts / resolution) * resolution
+    starts = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+    lasts = np.concatenate((starts[1:], [len(ts)])) - 1
+    counts = np.diff(np.concatenate((starts, [len(ts)]))) if raw else np.add.reduceat(rows["count"], starts)
+
+    series = {}
+    for metric in metrics:
+        if raw:
+            values = rows[metric].astype(np.float64)
+            lowest, highest, total, last = values, values, values, values
+        else:
+            lowest, highest = rows[f"{metric}_min"], rows[f"{metric}_max"]
+            total, last = rows[f"{metric}_sum"], rows[f"{metric}_last"]
+        series[metric] = {
+            "min": np.minimum.reduceat(lowest, starts).tolist(),
+            "max": np.maximum.reduceat(highest, starts).tolist(),
+            "avg": (np.add.reduceat(total, starts) / counts).tolist(),
+            "last": last[lasts].tolist(),
+        }
+    return {"timestamps": buckets[starts].tolist(), "series": series}
+
+
+class TimeSeriesStore:
+    """Append-only columnar history of per-tick room and product metrics.
+
+    Each tick appends one row per room (viewers, sales, conversion rate)
+    and one row per product (stock, sales) to the current ``Segment``.
+    Segments cover fixed, aligned windows of ``segment_seconds``; the
+    first batch past the window closes the segment and opens the next one.
+    Segments older than ``retention_seconds`` are deleted at rollover.
+
+    Room and product ids are stored as integer keys; the key tables live
+    in ``keys.json`` next to the segments and only grow.
+
+    For each width in ``rollups`` (seconds) the writer also keeps a rollup
+    table with one row per key and time bucket (point count and min / max
+    / sum / last of every metric), appended when the bucket closes.
+    ``query`` reads the coarsest level that fits the requested
+    resolution, so its cost depends on the time range and resolution, not
+    on how many raw points were written. ``segment_seconds`` must be a
+    multiple of every rollup width so no bucket spans two segments.
+
+    ``append_tick`` copies the tick's values into NumPy arrays on the
+    calling thread and hands the batch to a single writer thread, so the
+    disk writes never block the event loop and batches land in order. If
+    the writer falls ``MAX_PENDING_WRITES`` batches behind, new batches
+    are dropped and counted instead of queueing without bound.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        segment_seconds: float = 3600,
+        retention_seconds: Optional[float] = None,
+        rollups: Sequence[float] = DEFAULT_ROLLUPS,
+    ):
+        if segment_seconds <= 0:
+            raise ValueError("segment_seconds must be positive")
+        for width in rollups:
+            if width <= 0 or segment_seconds % width:
+                raise ValueError(f"Rollup width {width}s must be positive and divide the segment length {segment_seconds}s")
+        self.rollup_widths = tuple(sorted(rollups))
+        self.rollups = [_Rollup(table, width) for width in self.rollup_widths for table in TABLES]
+        self.schema = dict(TABLES)
+        for rollup in self.rollups:
+            self.schema[rollup.name] = rollup_columns(rollup.source)
+        self.path = path
+        self.segment_seconds = segment_seconds
+        self.retention_seconds = retention_seconds
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-writer")
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+
+        self.room_keys: List[str] = []
+        self.product_keys: List[Tuple[str, str]] = []
+        keys_path = os.path.join(path, KEYS_FILE)
+        if os.path.exists(keys_path):
+            with open(keys_path, encoding="utf-8") as f:
+                keys = json.load(f)
+            self.room_keys = keys["rooms"]
+            self.product_keys = [tuple(key) for key in keys["products"]]
+        self._room_index: Dict[str, int] = {key: i for i, key in enumerate(self.room_keys)}
+        self._product_index: Dict[Hashable, int] = {key: i for i, key in enumerate(self.product_keys)}
+        self._keys_saved = (len(self.room_keys), len(self.product_keys))
+        self._layout = None
+
+        self.segments: List[Segment] = []
+        for name in sorted(os.listdir(path)):
+            if name.startswith(SEGMENT_PREFIX) and os.path.exists(os.path.join(path, name, META_FILE)):
+                with open(os.path.join(path, name, META_FILE), encoding="utf-8") as f:
+                    meta = json.load(f)
+                self.segments.append(Segment(os.path.join(path, name), meta["start"], meta["end"], self.schema))
+        self.segments.sort(key=lambda segment: segment.start)
+        for segment in self.segments[:-1]:
+            segment.close()
+
+    # ---- 写入 ----
+
+    def _key_ids(self, index: Dict, keys: List, new_keys: Sequence) -> np.ndarray:
+        ids = np.empty(len(new_keys), dtype=np.int32)
+        for position, key in enumerate(new_keys):
+            key_id = index.get(key)
+            if key_id is None:
+                key_id = index[key] = len(keys)
+                keys.append(key)
+            ids[position] = key_id
+        return ids
+
+    def _tick_layout(self, live_rooms: Dict):
+        """Key ids and flat product list, rebuilt only when the room objects change.
+
+        The simulation mutates the ``Product`` records in place and never
+        swaps a room's product list (snapshot restore and mirroring build new
+        room objects instead), so the cached flat list stays valid as long
+        as the rooms are the same objects.
+        """
+        room_ids = list(live_rooms)
+        rooms = list(live_rooms.values())
+        layout = self._layout
+        # 列表比较先比对象身份，房间对象不变时几乎没有开销
+        if layout is not None and layout[0] == room_ids and layout[1] == rooms:
+            return layout
+        products = [product for room in rooms for product in room.products]
+        product_keys = [(room_id, product.id) for room_id, room in zip(room_ids, rooms) for product in room.products]
+        room_key_ids = self._key_ids(self._room_index, self.room_keys, room_ids)
+        product_key_ids = self._key_ids(self._product_index, self.product_keys, product_keys)
+        product_rooms = np.repeat(room_key_ids, [len(room.products) for room in rooms])
+        self._layout = (room_ids, rooms, products, room_key_ids, product_key_ids, product_rooms)
+        return self._layout
+
+    def build_batch(self, live_rooms: Dict, ts: float, values: Optional[Dict[str, np.ndarray]] = None) -> Batch:
+        """Columns for one tick; ``values`` can supply the metric arrays directly (in ``live_rooms`` order).
+
+        ``values`` holds ``viewers``, ``sales`` and ``conversion_rate`` per
+        room and ``stock`` and ``product_sales`` per product, e.g. the
+        vectorized engine's arrays, which saves reading every room and
+        product. The arrays are copied.
+        """
+        _, rooms, products, room_key_ids, product_key_ids, product_rooms = self._tick_layout(live_rooms)
+        room_count, product_count = len(rooms), len(products)
+        if values is not None:
+            return {
+                "rooms": {
+                    "ts": np.full(room_count, ts, dtype=np.float64),
+                    "room": room_key_ids,
+                    "viewers": np.array(values["viewers"], dtype=np.int64),
+                    "sales": np.array(values["sales"], dtype=np.float64),
+                    "conversion_rate": np.array(values["conversion_rate"], dtype=np.float64),
+                },
+                "products": {
+                    "ts": np.full(product_count, ts, dtype=np.float64),
+                    "room": product_rooms,
+                    "product": product_key_ids,
+                    "stock": np.array(values["stock"], dtype=np.int32),
+                    "sales": np.array(values["product_sales"], dtype=np.int32),
+                },
+            }
+        return {
+            "rooms": {
+                "ts": np.full(room_count, ts, dtype=np.float64),
+                "room": room_key_ids,
+                "viewers": np.fromiter(map(_viewers, rooms), dtype=np.int64, count=room_count),
+                "sales": np.fromiter(map(_sales, rooms), dtype=np.float64, count=room_count),
+                "conversion_rate": np.fromiter(map(_conversion_rate, rooms), dtype=np.float64, count=room_count),
+            },
+            "products": {
+                "ts": np.full(product_count, ts, dtype=np.float64),
+                "room": product_rooms,
+                "product": product_key_ids,
+                "stock": np.fromiter(map(_stock, products), dtype=np.int32, count=product_count),
+                "sales": np.fromiter(map(_product_sales, products), dtype=np.int32, count=product_count),
+            },
+        }
+
+    def append_tick(
+        self, live_rooms: Dict, ts: Optional[float] = None, values: Optional[Dict[str, np.ndarray]] = None
+    ) -> Optional[Future]:
+        """Snapshot one tick of ``live_rooms`` and queue it for the writer thread."""
+        if self._pending >= MAX_PENDING_WRITES:
+            HISTORY_BATCHES_DROPPED.inc()
+            return None
+        batch = self.build_batch(live_rooms, time.time() if ts is None else ts, values)
+        keys = None
+        if (len(self.room_keys), len(self.product_keys)) != self._keys_saved:
+            keys = {"rooms": list(self.room_keys), "products": [list(key) for key in self.product_keys]}
+            self._keys_saved = (len(self.room_keys), len(self.product_keys))
+        with self._pending_lock:
+            self._pending += 1
+        future = self._executor.submit(self._write, batch, keys)
+        future.add_done_callback(self._write_done)
+        return future
+
+    def _write_done(self, future: Future):
+        with self._pending_lock:
+            self._pending -= 1
+        if future.exception() is not None:
+            print(f"History write failed: {future.exception()}")
+
+    def _write(self, batch: Batch, keys: Optional[Dict] = None):
+        with HISTORY_APPEND_SECONDS.time():
+            if keys is not None:
+                _write_json(os.path.join(self.path, KEYS_FILE), keys)
+            ts = float(batch["rooms"]["ts"][0]) if len(batch["rooms"]["ts"]) else time.time()
+            with self._lock:
+                # 先把已结束的时间桶写入它所在的分段，再写本 tick 的原始数据
+                for rollup in self.rollups:
+                    rows = rollup.update(batch[rollup.source])
+                    if rows is not None:
+                        self._segment_for(float(rows["ts"][0])).append({rollup.name: rows})
+                self._segment_for(ts).append(batch)
+        for table, values in batch.items():
+            HISTORY_ROWS.inc(len(values["ts"]), table=table)
+
+    def _segment_for(self, ts: float) -> Segment:
+        current = self.segments[-1] if self.segments else None
+        # 时间戳早于当前分段（时钟回拨）时也写入当前分段，保证分段按时间排序
+        if current is not None and ts < current.end:
+            # 重启后继续写入同一时间窗口的分段
+            if current.closed:
+                current.reopen()
+            return current
+        if current is not None:
+            current.close()
+        start = math.floor(ts / self.segment_seconds) * self.segment_seconds
+        segment = Segment(
+            os.path.join(self.path, f"{SEGMENT_PREFIX}{int(start):012d}"),
+            start,
+            start + self.segment_seconds,
+            self.schema,
+        )
+        self.segments.append(segment)
+        self._expire(ts)
+        return segment
+
+    def _expire(self, now: float):
+        if self.retention_seconds is None:
+            return
+        while len(self.segments) > 1 and self.segments[0].end < now - self.retention_seconds:
+            segment = self.segments.pop(0)
+            shutil.rmtree(segment.path, ignore_errors=True)
+
+    # ---- 读取 ----
+
+    def read(
+        self,
+        table: str,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        room_id: Optional[str] = None,
+        product_id: Optional[str] = None,
+    ) -> Dict[str, np.ndarray]:
+        """Rows of ``table`` with ``start <= ts < end``, optionally for one room or one product, in time order."""
+        columns = self.schema[table]
+        room_key = self._room_index.get(room_id) if room_id is not None else None
+        product_key = self._product_index.get((room_id, product_id)) if product_id is not None else None
+        if (room_id is not None and room_key is None) or (product_id is not None and product_key is None):
+            return {name: np.empty(0, dtype=dtype) for name, dtype in columns}
+
+        parts: Dict[str, List[np.ndarray]] = {name: [] for name, _ in columns}
+        with self._lock:
+            for segment in self.segments:
+                if (start is not None and segment.end <= start) or (end is not None and segment.start >= end):
+                    continue
+                data = segment.read(table)
+                ts = data["ts"]
+                # 同一分段内时间戳单调递增，用二分查找截取时间范围
+                lo = 0 if start is None else int(np.searchsorted(ts, start, side="left"))
+                hi = len(ts) if end is None else int(np.searchsorted(ts, end, side="left"))
+                if lo >= hi:
+                    continue
+                mask = None
+                if product_key is not None:
+                    mask = data["product"][lo:hi] == product_key
+                elif room_key is not None:
+                    mask = data["room"][lo:hi] == room_key
+                for name, _ in columns:
+                    values = data[name][lo:hi]
+                    parts[name].append(np.array(values if mask is None else values[mask]))
+        return {
+            name: np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype=dtype)
+            for name, dtype in columns
+        }
+
+    def query(
+        self,
+        table: str,
+        room_id: str,
+        product_id: Optional[str] = None,
+        metrics: Optional[Sequence[str]] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        resolution: float = 60,
+    ) -> Dict:
+        """Downsampled series of one room or product; see ``downsample`` for the result shape.
+
+        The source is the coarsest rollup level not wider than
+        ``resolution`` (raw rows when none fits), and the resolution is
+        rounded up to a multiple of that level's width. ``start`` is moved
+        back to the start of its bucket so the first bucket is complete.
+        """
+        metrics = tuple(metrics or METRICS[table])
+        width = max((width for width in self.rollup_widths if width <= resolution), default=None)
+        if width is not None:
+            resolution = math.ceil(resolution / width) * width
+        if start is not None:
+            start = math.floor(start / resolution) * resolution
+        if width is None:
+            rows = self.read(table, start, end, room_id, product_id)
+            result = downsample(rows, metrics, resolution, raw=True)
+        else:
+            source = rollup_table(table, width)
+            rows = self.read(source, start, end, room_id, product_id)
+            key = self._product_index.get((room_id, product_id)) if product_id is not None else self._room_index.get(room_id)
+            rollup = next(rollup for rollup in self.rollups if rollup.name == source)
+            with self._lock:
+                current = rollup.current(key) if key is not None else None
+            if current is not None and (start is None or current["ts"][0] >= start) and (end is None or current["ts"][0] < end):
+                rows = {name: np.concatenate((rows[name], current[name])) for name in rows}
+            result = downsample(rows, metrics, resolution, raw=False)
+        result["resolution"] = resolution
+        result["source"] = rollup_label(width) if width is not None else "raw"
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            # 未结束的时间桶也写盘；重启后同一时间桶可能再出现一行，查询时会合并
+            for rollup in self.rollups:
+                rows = rollup.drain()
+                if rows is not None:
+                    self._segment_for(float(rows["ts"][0])).append({rollup.name: rows})
+            if self.segments:
+                self.segments[-1].close()
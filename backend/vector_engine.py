@@ -0,0 +1,254 @@
+from typing import Dict, List, NamedTuple, Optional, Set
+
+import numpy as np
+
+from anomaly_detector import Anomalies, AnomalyDetector
+from effect_scheduler import clamp_conversion_rate
+from products import Product
+
+# 库存状态编码，数组中保存下标
+STOCK_STATUSES = ("充足", "紧张", "告急")
+_STATUS_CODES = {status: code for code, status in enumerate(STOCK_STATUSES)}
+STATUS_SUFFICIENT, STATUS_LOW, STATUS_CRITICAL = 0, 1, 2
+
+# 与逐房间循环保持一致的概率
+CRITICAL_WARNING_PROBABILITY = 0.3
+LOW_WARNING_PROBABILITY = 0.2
+INSIGHT_PROBABILITY = 0.1
+WAREHOUSE_LOG_PROBABILITY = 0.08
+INSIGHT_TYPE_COUNT = 3
+WAREHOUSE_ACTION_COUNT = 4
+
+
+class TickResult(NamedTuple):
+    """What happened during one tick, as indexes into the engine's room/product arrays."""
+
+    sales_amount: float
+    anomalies: Anomalies
+    stock_warnings: np.ndarray
+    insight_rooms: np.ndarray
+    insight_choices: np.ndarray
+    warehouse_products: np.ndarray
+    warehouse_choices: np.ndarray
+
+
+class VectorizedSimulation:
+    """Array-backed simulation engine equivalent to ``simulate_tick`` in main.py.
+
+    Room scalars (viewers, sales) live in per-room arrays and product fields
+    (stock, sales, price, initial_stock, stock status) in flat per-product
+    arrays, with ``product_rooms`` mapping each product to its room. A tick
+    draws all random numbers in one batch per kind and updates every room
+    with vectorized operations; ``write_back`` then copies the new values
+    into the ``LiveRoom`` objects and ``Product`` records so the rest of
+    the app observes the same state as with the Python loop.
+
+    Code that mutates rooms outside the tick (event triggers) must call
+    ``mark_dirty`` so the arrays are refreshed before the next tick. Timed
+    event effects come from an attached ``ActiveEffects`` scheduler, whose
+    changes are patched into per-room and per-product arrays. Viewers,
+    room sales and stock are scored by an ``AnomalyDetector`` every tick.
+    """
+
+    def __init__(
+        self,
+        live_rooms: Dict,
+        rng: Optional[np.random.Generator] = None,
+        active_effects=None,
+        anomaly_detector: Optional[AnomalyDetector] = None,
+    ):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.anomaly_detector = anomaly_detector if anomaly_detector is not None else AnomalyDetector()
+        self.active_effects = active_effects
+        if active_effects is not None:
+            active_effects.track_changes = True
+        self._dirty: Set[str] = set()
+        self._changed_products = np.empty(0, dtype=np.int64)
+        self.last_sold = np.empty(0, dtype=np.int64)
+        self.load(live_rooms)
+
+    def load(self, live_rooms: Dict):
+        self.live_rooms = live_rooms
+        self.room_ids: List[str] = list(live_rooms.keys())
+        self.rooms = [live_rooms[room_id] for room_id in self.room_ids]
+        self.room_index = {room_id: index for index, room_id in enumerate(self.room_ids)}
+
+        self.viewers = np.array([room.viewers for room in self.rooms], dtype=np.int64)
+        self.room_sales = np.array([room.sales for room in self.rooms], dtype=np.float64)
+
+        counts = np.array([len(room.products) for room in self.rooms], dtype=np.int64)
+        self.product_counts = counts
+        self.product_offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.product_rooms = np.repeat(np.arange(len(self.rooms), dtype=np.int64), counts)
+        self.products: List[Product] = [product for room in self.rooms for product in room.products]
+        self.product_room_ids: List[str] = [
+            room_id for room_id, room in zip(self.room_ids, self.rooms) for _ in room.products
+        ]
+
+        self.stock = np.array([p.stock for p in self.products], dtype=np.int64)
+        self.sales = np.array([p.sales for p in self.products], dtype=np.int64)
+        self.price = np.array([p.price for p in self.products], dtype=np.float64)
+        self.initial_stock = np.array([p.initial_stock for p in self.products], dtype=np.int64)
+        self.status = np.array(
+            [_STATUS_CODES.get(p.stock_status, STATUS_SUFFICIENT) for p in self.products],
+            dtype=np.int8,
+        )
+        # 检测器状态按直播间 / 商品 id 保存，重新加载后继续沿用
+        self._room_slots = self.anomaly_detector.room_slots(self.room_ids)
+        self._product_slots = self.anomaly_detector.products_slots(self.room_ids, self.rooms)
+        self._load_effects()
+        self._dirty.clear()
+
+    def _load_effects(self):
+        self.conversion_offset = np.zeros(len(self.rooms), dtype=np.float64)
+        self.sales_multiplier = np.ones(len(self.products), dtype=np.float64)
+        if self.active_effects is None:
+            return
+        self.active_effects.drain_changes()
+        for room_id, offset in self.active_effects.conversion_offsets.items():
+            if room_id in self.room_index:
+                self.conversion_offset[self.room_index[room_id]] = offset
+        for (room_id, product_id), multiplier in self.active_effects.sales_multipliers.items():
+            product_index = self._product_index(room_id, product_id)
+            if product_index is not None:
+                self.sales_multiplier[product_index] = multiplier
+
+    def _apply_effect_changes(self):
+        changed_rooms, changed_products = self.active_effects.drain_changes()
+        for room_id in changed_rooms:
+            if room_id in self.room_index:
+                self.conversion_offset[self.room_index[room_id]] = self.active_effects.conversion_offset(room_id)
+        for room_id, product_id in changed_products:
+            product_index = self._product_index(room_id, product_id)
+            if product_index is not None:
+                self.sales_multiplier[product_index] = self.active_effects.sales_multiplier(room_id, product_id)
+
+    def _product_index(self, room_id: str, product_id: str) -> Optional[int]:
+        index = self.room_index.get(room_id)
+        if index is None:
+            return None
+        for position, product in enumerate(self.rooms[index].products):
+            if product.id == product_id:
+                return int(self.product_offsets[index]) + position
+        return None
+
+    @property
+    def changed_products(self) -> np.ndarray:
+        """Indexes of the products whose stock, sales or status changed in the last tick."""
+        return self._changed_products
+
+    def mark_dirty(self, room_id: str):
+        self._dirty.add(room_id)
+
+    def product_room_id(self, product_index: int) -> str:
+        return self.product_room_ids[product_index]
+
+    def _refresh_dirty(self):
+        if set(self.live_rooms) != set(self.room_ids):
+            self.load(self.live_rooms)
+            return
+        for room_id in self._dirty:
+            index = self.room_index[room_id]
+            room = self.rooms[index]
+            if len(room.products) != self.product_counts[index]:
+                self.load(self.live_rooms)
+                return
+            self.viewers[index] = room.viewers
+            self.room_sales[index] = room.sales
+            for product_index, product in enumerate(room.products, start=self.product_offsets[index]):
+                self.stock[product_index] = product.stock
+                self.sales[product_index] = product.sales
+                self.price[product_index] = product.price
+                self.initial_stock[product_index] = product.initial_stock
+                self.status[product_index] = _STATUS_CODES.get(product.stock_status, STATUS_SUFFICIENT)
+        self._dirty.clear()
+
+    def tick(self) -> TickResult:
+        if self._dirty or len(self.live_rooms) != len(self.room_ids):
+            self._refresh_dirty()
+
+        if self.active_effects is not None:
+            self._apply_effect_changes()
+
+        rng = self.rng
+        room_count = len(self.rooms)
+        product_count = len(self.products)
+
+        # 观众数变化
+        self.viewers = np.maximum(100, self.viewers + rng.integers(-100, 201, room_count))
+
+        # 商品销售：只有有库存的商品参与，销量不超过库存；事件效果中的销量倍数向下取整
+        in_stock = self.stock > 0
+        draws = rng.integers(0, 4, product_count)
+        if self.active_effects is not None and self.active_effects.sales_multipliers:
+            draws = (draws * self.sales_multiplier).astype(np.int64)
+        sold = np.where(in_stock, np.minimum(draws, self.stock), 0)
+        self.stock -= sold
+        self.sales += sold
+        self.last_sold = sold
+        room_amounts = np.bincount(self.product_rooms, weights=sold * self.price, minlength=room_count)
+        self.room_sales += room_amounts
+
+        # 异常检测：观众数与库存的变化（含 tick 之间的事件影响）、本 tick 的房间销售额
+        anomalies = self.anomaly_detector.check(
+            self._room_slots, self.viewers, room_amounts, self._product_slots, self.stock
+        )
+
+        # 库存状态只在本 tick 有库存的商品上更新
+        ratio = self.stock / self.initial_stock
+        new_status = np.where(ratio < 0.1, STATUS_CRITICAL, np.where(ratio < 0.3, STATUS_LOW, STATUS_SUFFICIENT))
+        previous_status = self.status
+        self.status = np.where(in_stock, new_status, previous_status).astype(np.int8)
+        warning_rolls = rng.random(product_count)
+        warnings = in_stock & (
+            ((new_status == STATUS_CRITICAL) & (warning_rolls < CRITICAL_WARNING_PROBABILITY))
+            | ((new_status == STATUS_LOW) & (warning_rolls < LOW_WARNING_PROBABILITY))
+        )
+        self._changed_products = np.flatnonzero((sold > 0) | (self.status != previous_status))
+
+        # 转化率 = 房间内商品累计销量 / 观众数，再叠加仍在生效的事件转化率偏移
+        units = np.bincount(self.product_rooms, weights=self.sales, minlength=room_count)
+        self.conversion_rate = clamp_conversion_rate(units / self.viewers + self.conversion_offset)
+
+        # AI 洞察与仓储管理日志
+        insight_rooms = np.flatnonzero(rng.random(room_count) < INSIGHT_PROBABILITY)
+        insight_choices = rng.integers(0, INSIGHT_TYPE_COUNT, len(insight_rooms))
+        warehouse_rooms = np.flatnonzero(
+            (rng.random(room_count) < WAREHOUSE_LOG_PROBABILITY) & (self.product_counts > 0)
+        )
+        warehouse_products = self.product_offsets[warehouse_rooms] + (
+            rng.random(len(warehouse_rooms)) * self.product_counts[warehouse_rooms]
+        ).astype(np.int64)
+        warehouse_choices = rng.integers(0, WAREHOUSE_ACTION_COUNT, len(warehouse_rooms))
+
+        return TickResult(
+            sales_amount=float(room_amounts.sum()),
+            anomalies=anomalies,
+            stock_warnings=np.flatnonzero(warnings),
+            insight_rooms=insight_rooms,
+            insight_choices=insight_choices,
+            warehouse_products=warehouse_products,
+            warehouse_choices=warehouse_choices,
+        )
+
+    def write_back(self):
+        """Copy array state into the LiveRoom objects and the ``Product`` records touched this tick."""
+        for room, viewers, sales, conversion_rate in zip(
+            self.rooms, self.viewers.tolist(), self.room_sales.tolist(), self.conversion_rate.tolist()
+        ):
+            room.viewers = viewers
+            room.sales = sales
+            room.conversion_rate = conversion_rate
+
+        changed = self._changed_products
+        products = self.products
+        for product_index, stock, sales, status in zip(
+            changed.tolist(),
+            self.stock[changed].tolist(),
+            self.sales[changed].tolist(),
+            self.status[changed].tolist(),
+        ):
+            product = products[product_index]
+            product.stock = stock
+            product.sales = sales
+            product.stock_status = STOCK_STATUSES[status]
@@ -0,0 +1,123 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+import msgpack
+
+# 客户端在 connect 时通过 auth 或查询参数 ?encoding= 协商编码，默认 JSON
+JSON_ENCODING = "json"
+MSGPACK_ENCODING = "msgpack"
+SUPPORTED_ENCODINGS = (JSON_ENCODING, MSGPACK_ENCODING)
+
+# 字符串表引用使用的 MessagePack 扩展类型，数据为大端序的表下标
+STRING_REF_EXT = 1
+MAX_STRING_TABLE_SIZE = 65536
+
+# 增量同步与日志协议中固定出现的字段名
+PROTOCOL_STRINGS = (
+    "version",
+    "seq",
+    "base_seq",
+    "ts",
+    "rooms",
+    "removed",
+    "products",
+    "product_ids",
+    "timestamp",
+    "room_id",
+    "room_name",
+    "action_type",
+    "message",
+    "impact",
+    "color",
+    "source",
+)
+
+
+def negotiate_encoding(environ: Dict[str, Any], auth: Any = None) -> str:
+    """Pick the payload encoding a client asked for at connect, falling back to JSON."""
+    requested = None
+    if isinstance(auth, dict):
+        requested = auth.get("encoding")
+    if not requested:
+        for pair in (environ.get("QUERY_STRING") or "").split("&"):
+            key, _, value = pair.partition("=")
+            if key == "encoding":
+                requested = value
+                break
+    return requested if requested in SUPPORTED_ENCODINGS else JSON_ENCODING
+
+
+class WireCodec:
+    """MessagePack encoder that replaces well-known strings with table references.
+
+    Field names and the vocabulary repeated on every tick (room themes,
+    host names, product names, stock statuses, log action types) are
+    registered once with ``extend``; each occurrence is then sent as a
+    3-4 byte extension value instead of the UTF-8 text. Strings outside
+    the table go out unchanged, so the table only affects size, never
+    what a client decodes.
+
+    Clients receive ``table()`` once after connecting and resolve
+    extension type ``STRING_REF_EXT`` by index. The table is append-only:
+    existing indexes never change, and ``version`` counts the entries so a
+    client can tell whether its copy is current.
+    """
+
+    def __init__(self, strings: Iterable[str] = PROTOCOL_STRINGS):
+        self.strings: List[str] = []
+        self._refs: Dict[str, msgpack.ExtType] = {}
+        self.extend(strings)
+
+    @property
+    def version(self) -> int:
+        return len(self.strings)
+
+    def extend(self, strings: Iterable[str]) -> int:
+        """Add strings to the table, returning how many were new."""
+        added = 0
+        for text in strings:
+            if not isinstance(text, str) or text in self._refs or len(self.strings) >= MAX_STRING_TABLE_SIZE:
+                continue
+            index = len(self.strings)
+            # 引用占 3-4 字节，更短的字符串直接发送反而更省
+            if len(text.encode("utf-8")) <= (2 if index < 256 else 3):
+                continue
+            data = index.to_bytes(1 if index < 256 else 2, "big")
+            self._refs[text] = msgpack.ExtType(STRING_REF_EXT, data)
+            self.strings.append(text)
+            added += 1
+        return added
+
+    def table(self) -> Dict[str, Any]:
+        return {"version": self.version, "encoding": MSGPACK_ENCODING, "strings": list(self.strings)}
+
+    def compact(self, payload: Any) -> Any:
+        """Copy of ``payload`` with table strings swapped for extension values."""
+        lookup = self._refs.get
+        containers = (dict, list, tuple)
+
+        # 标量直接查表（非字符串查不到会原样返回），只对容器递归，减少函数调用
+        def walk(value):
+            if type(value) is dict:
+                return {
+                    lookup(key, key): walk(item) if type(item) in containers else lookup(item, item)
+                    for key, item in value.items()
+                }
+            return [walk(item) if type(item) in containers else lookup(item, item) for item in value]
+
+        if type(payload) in containers:
+            return walk(payload)
+        return lookup(payload, payload)
+
+    def encode(self, payload: Any) -> bytes:
+        return msgpack.packb(self.compact(payload), use_bin_type=True)
+
+    def decode(self, data: bytes, strings: Optional[List[str]] = None) -> Any:
+        """Inverse of ``encode``; mirrors what a client does with its copy of the table."""
+        strings = self.strings if strings is None else strings
+
+        def ext_hook(code, data):
+            if code == STRING_REF_EXT:
+                return strings[int.from_bytes(data, "big")]
+            return msgpack.ExtType(code, data)
+
+        return msgpack.unpackb(data, ext_hook=ext_hook, raw=False, strict_map_key=False)
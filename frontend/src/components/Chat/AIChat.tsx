@@ -33,7 +33,7 @@ const AIChat: React.FC = () => {
   const [input, setInput] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const messagesEndRef = useRef<null | HTMLDivElement>(null);
-  const { globalStats, liveRooms, formatTime } = useAppContext();
+  const { formatTime } = useAppContext();
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -78,32 +78,64 @@ const AIChat: React.FC = () => {
     setIsLoading(true);
 
     try {
-      const response = await fetch(`${API_BASE_URL}/api/chat`, {
+      // Stream tokens over server-sent events so the answer appears as it is generated
+      const response = await fetch(`${API_BASE_URL}/api/chat/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
+        // The server builds the data context from its live state, so only the question is sent
         body: JSON.stringify({
           message: currentInput,
-          context: {
-            globalStats,
-            liveRooms,
-          },
         }),
       });
 
-      if (!response.ok) {
+      if (!response.ok || !response.body) {
         throw new Error('Failed to get response');
       }
 
-      const data = await response.json();
       const assistantMessage: Message = {
         role: 'assistant',
-        content: data.response,
+        content: '',
         timestamp: new Date().toISOString(),
       };
+      let started = false;
 
-      setMessages(prev => [...prev, assistantMessage]);
+      const appendToAnswer = (text: string) => {
+        assistantMessage.content += text;
+        const snapshot = { ...assistantMessage };
+        const replaceLast = started;
+        setMessages(prev => (replaceLast ? [...prev.slice(0, -1), snapshot] : [...prev, snapshot]));
+        started = true;
+      };
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let done = false;
+      while (!done) {
+        const chunk = await reader.read();
+        done = chunk.done;
+        buffer += decoder.decode(chunk.value || new Uint8Array(), { stream: !done });
+
+        // SSE events are separated by a blank line
+        const events = buffer.split('\n\n');
+        buffer = events.pop() || '';
+        for (const rawEvent of events) {
+          const lines = rawEvent.split('\n');
+          const eventType = lines.find(line => line.startsWith('event:'))?.slice(6).trim();
+          const dataLine = lines.find(line => line.startsWith('data:'));
+          if (!dataLine) continue;
+          const data = JSON.parse(dataLine.slice(5));
+          if (eventType === 'error') {
+            throw new Error(data.detail || 'Streaming error');
+          }
+          if (!eventType && data.text) {
+            appendToAnswer(data.text);
+            setIsLoading(false);
+          }
+        }
+      }
     } catch (error) {
       console.error('Error:', error);
       const errorMessage: Message = {
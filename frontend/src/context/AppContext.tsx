@@ -1,6 +1,6 @@
-import React, { createContext, useContext, useState, useEffect, ReactNode } from 'react';
+import React, { createContext, useContext, useState, useEffect, useRef, ReactNode } from 'react';
 import { io, Socket } from 'socket.io-client';
-import { AgentLog, EventTrigger, GlobalStats, LiveRoom } from '../types';
+import { AgentLog, EventTrigger, GlobalStats, LiveRoom, LiveRoomsDelta, LiveRoomsSnapshot, Product } from '../types';
 
 // API base URL
 const API_BASE_URL = process.env.REACT_APP_API_URL || 'http://localhost:8200';
@@ -68,6 +68,33 @@ const defaultContextValue: AppContextType = {
   }),
 };
 
+// Apply a live_rooms_delta patch on top of the current room list
+const applyRoomsDelta = (rooms: LiveRoom[], delta: LiveRoomsDelta): LiveRoom[] => {
+  const removed = new Set(delta.removed);
+  const byId = new Map(rooms.filter(room => !removed.has(room.id)).map(room => [room.id, room]));
+
+  Object.entries(delta.rooms).forEach(([roomId, patch]) => {
+    const { products: productPatches, product_ids: productIds, ...fields } = patch;
+    const current = byId.get(roomId);
+    const productsById = new Map((current?.products || []).map(product => [product.id, product]));
+
+    if (productPatches) {
+      Object.entries(productPatches).forEach(([productId, productPatch]) => {
+        productsById.set(productId, { ...productsById.get(productId), ...productPatch } as Product);
+      });
+    }
+
+    const order = productIds || (current?.products || []).map(product => product.id);
+    byId.set(roomId, {
+      ...current,
+      ...fields,
+      products: order.map(productId => productsById.get(productId)).filter(Boolean),
+    } as LiveRoom);
+  });
+
+  return Array.from(byId.values());
+};
+
 // Create context
 const AppContext = createContext<AppContextType>(defaultContextValue);
 
@@ -87,6 +114,8 @@ export const AppProvider: React.FC<AppProviderProps> = ({ children }) => {
   const [error, setError] = useState<string | null>(null);
   const [socket, setSocket] = useState<Socket | null>(null);
   const [isAutoRefreshEnabled, setIsAutoRefreshEnabled] = useState<boolean>(true);
+  // Last applied live_rooms_delta seq, used to detect missed patches
+  const roomsSeqRef = useRef<number | null>(null);
   const [baselineStats, setBaselineStats] = useState({
     sales: 0,
     profit: 0,
@@ -148,6 +177,9 @@ export const AppProvider: React.FC<AppProviderProps> = ({ children }) => {
     // Socket event handlers
     socketInstance.on('connect', () => {
       console.log('Connected to server');
+      // The dashboard shows every room, so watch them all
+      roomsSeqRef.current = null;
+      socketInstance.emit('subscribe', { all: true });
     });
 
     socketInstance.on('disconnect', () => {
@@ -156,25 +188,29 @@ export const AppProvider: React.FC<AppProviderProps> = ({ children }) => {
       setAgentLogs([]);
     });
 
-    socketInstance.on('live_rooms', (rooms: LiveRoom[]) => {
-      setLiveRooms(rooms);
-      
-      // Update selected room if it exists
-      if (selectedRoom) {
-        const updatedRoom = rooms.find(room => room.id === selectedRoom.id);
-        if (updatedRoom) {
-          setSelectedRoom(updatedRoom);
-        }
+    socketInstance.on('live_rooms_snapshot', (snapshot: LiveRoomsSnapshot) => {
+      roomsSeqRef.current = snapshot.seq;
+      setLiveRooms(snapshot.rooms);
+    });
+
+    socketInstance.on('live_rooms_delta', (delta: LiveRoomsDelta) => {
+      if (roomsSeqRef.current === null || delta.base_seq !== roomsSeqRef.current) {
+        // Missed a patch, ask the server for a full snapshot
+        roomsSeqRef.current = null;
+        socketInstance.emit('resync');
+        return;
       }
+      roomsSeqRef.current = delta.seq;
+      setLiveRooms(prev => applyRoomsDelta(prev, delta));
     });
 
-    socketInstance.on('agent_log', (log: AgentLog) => {
+    socketInstance.on('agent_logs_batch', (logs: AgentLog[]) => {
       setAgentLogs(prev => {
-        // Remove any duplicate logs based on timestamp and message
-        const filtered = prev.filter(l => 
-          !(l.timestamp === log.timestamp && l.message === log.message)
-        );
-        return [log, ...filtered].slice(0, 100); // Keep only the latest 100 logs
+        // Newest first; remove any duplicate logs based on timestamp and message
+        const incoming = [...logs].reverse();
+        const seen = new Set(incoming.map(log => `${log.timestamp}|${log.message}`));
+        const filtered = prev.filter(l => !seen.has(`${l.timestamp}|${l.message}`));
+        return [...incoming, ...filtered].slice(0, 100); // Keep only the latest 100 logs
       });
     });
 
@@ -223,6 +259,11 @@ export const AppProvider: React.FC<AppProviderProps> = ({ children }) => {
     };
   }, []);
 
+  // Keep the selected room in sync with incoming room updates
+  useEffect(() => {
+    setSelectedRoom(prev => (prev ? liveRooms.find(room => room.id === prev.id) || prev : prev));
+  }, [liveRooms]);
+
   // Set up auto refresh
   useEffect(() => {
     let refreshInterval: NodeJS.Timeout;
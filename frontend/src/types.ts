@@ -27,6 +27,29 @@ export interface LiveRoom {
   start_time: string;
 }
 
+// live_rooms_snapshot payload (sent on connect and on resync)
+export interface LiveRoomsSnapshot {
+  version: number;
+  seq: number;
+  rooms: LiveRoom[];
+}
+
+// Patch for one room inside a live_rooms_delta; only changed fields are present
+export type LiveRoomPatch = Partial<Omit<LiveRoom, 'products'>> & {
+  products?: Record<string, Partial<Product>>;
+  product_ids?: string[];
+};
+
+// live_rooms_delta payload (sent every tick)
+export interface LiveRoomsDelta {
+  version: number;
+  seq: number;
+  base_seq: number;
+  ts: number;
+  rooms: Record<string, LiveRoomPatch>;
+  removed: string[];
+}
+
 // AI Action type
 export interface AIAction {
   type: string;